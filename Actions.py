@@ -0,0 +1,155 @@
+from collections import namedtuple
+
+''' The actions a player can take, as sent by a client to the server. Like the events (see Events) they only contain
+hex indices and numbers, so they can be sent as they are. Every action is checked by validate before it touches the
+game: the server is the only one which changes the game state, clients only ask for it.'''
+
+Click = namedtuple('Click', 'index dig')        # Click on hex index, dig is set if the dig icon was clicked
+EndTurn = namedtuple('EndTurn', '')
+ShiftResources = namedtuple('ShiftResources', 'source destination checks')     # checks: 0 or 1 per card in source
+SelectFuel = namedtuple('SelectFuel', 'index resource_index')                   # resource_index -1 is rowing
+FulfillAssignment = namedtuple('FulfillAssignment', 'index tier choices')       # choices: one of CHOICES per card
+StealResource = namedtuple('StealResource', 'source destination resource_index')    # From enemy boat source
+
+ACTION_TYPES = {x.__name__: x for x in [Click, EndTurn, ShiftResources, SelectFuel, FulfillAssignment, StealResource]}
+CHOICES = ['none', 'earth', 'wood', 'stone', 'metal', 'fuel', 'collect']   # What a card is used for in an assignment
+
+
+class IllegalAction(Exception):
+    '''Raised for actions which are malformed or not allowed in the current state of the game.'''
+    pass
+
+
+def decode(message):
+    ''' Turns a dict as received from a client, e.g. {'action': 'Click', 'index': 12, 'dig': False}, into an action.'''
+    if not isinstance(message, dict) or message.get('action') not in ACTION_TYPES:
+        raise IllegalAction('Unknown action')
+    kind = ACTION_TYPES[message['action']]
+    try:
+        return kind(**{field: message[field] for field in kind._fields})
+    except KeyError as e:
+        raise IllegalAction(kind.__name__ + ' is missing ' + str(e))
+
+
+def encode(action):
+    ''' Turns an action into a dict which can be sent as json.'''
+    message = {'action': type(action).__name__}
+    message.update(action._asdict())
+    return message
+
+
+def check_index(grid, index):
+    if not isinstance(index, int) or isinstance(index, bool) or not 0 <= index < grid.n_hexes:
+        raise IllegalAction('No hex ' + str(index))
+
+
+def check_own(grid, player, index, kinds):
+    ''' Checks that hex index holds an object of player of one of the kinds (labels contain the kind).'''
+    check_index(grid, index)
+    obj = grid.objects[index]
+    if not obj or obj.owner != player or not any(kind in obj.label for kind in kinds):
+        raise IllegalAction('No ' + ' or '.join(kinds) + ' of ' + player + ' on hex ' + str(index))
+    return obj
+
+
+def check_selection(values, length, allowed):
+    if not isinstance(values, list) or len(values) != length or any(x not in allowed for x in values):
+        raise IllegalAction('Selection should have ' + str(length) + ' values out of ' + str(allowed))
+
+
+def validate(game, player, action):
+    ''' Raises IllegalAction if player may not take action now. Checks the same rules the popups of the visualiser
+    apply when they offer their buttons.'''
+    grid = game.grid
+    if type(action) not in ACTION_TYPES.values():
+        raise IllegalAction('Unknown action')
+    if player != game.current_player:
+        raise IllegalAction('It is not the turn of ' + player)
+
+    if isinstance(action, Click):
+        check_index(grid, action.index)
+        if not isinstance(action.dig, bool):
+            raise IllegalAction('dig should be true or false')
+    elif isinstance(action, ShiftResources):
+        source = check_own(grid, player, action.source, ['harbour', 'home', 'boat'])
+        if action.destination not in grid.get_resource_destinations(action.source):
+            raise IllegalAction('Cannot pass resources from hex ' + str(action.source) + ' to ' + str(action.destination))
+        check_selection(action.checks, source.resources.get_size(), [0, 1])
+    elif isinstance(action, SelectFuel):
+        boat = check_own(grid, player, action.index, ['boat'])
+        if not boat.occupying_pawn or boat.moves <= 0:
+            raise IllegalAction(boat.label + ' cannot move')
+        if action.resource_index != -1:
+            if not isinstance(action.resource_index, int) or not 0 <= action.resource_index < boat.resources.get_size():
+                raise IllegalAction(boat.label + ' has no resource ' + str(action.resource_index))
+            if int(boat.resources.stack[action.resource_index].fuel) <= 0:
+                raise IllegalAction('Resource ' + str(action.resource_index) + ' of ' + boat.label + ' is not fuel')
+    elif isinstance(action, FulfillAssignment):
+        home = check_own(grid, player, action.index, ['home'])
+        if action.tier not in [1, 2]:
+            raise IllegalAction('No assignment tier ' + str(action.tier))
+        check_selection(action.choices, home.resources.get_size(), CHOICES)
+        fulfilled = game.check_assignment(action.index, action.choices, game.get_current_player().assignment)
+        if not fulfilled[action.tier - 1]:
+            raise IllegalAction('The chosen resources do not fulfill tier ' + str(action.tier))
+    elif isinstance(action, StealResource):
+        check_index(grid, action.source)
+        victim = grid.objects[action.source]
+        if not victim or 'boat' not in victim.label or victim.owner == player:
+            raise IllegalAction('No enemy boat on hex ' + str(action.source))
+        if action.destination not in grid.get_pirates(action.source):
+            raise IllegalAction('No boat on hex ' + str(action.destination) + ' can steal from ' + victim.label)
+        if not isinstance(action.resource_index, int) or not 0 <= action.resource_index < victim.resources.get_size():
+            raise IllegalAction(victim.label + ' has no resource ' + str(action.resource_index))
+
+
+def apply(game, player, action):
+    ''' Validates action and carries it out. The changes come out as events on the event bus of the grid.'''
+    validate(game, player, action)
+    grid = game.grid
+    if isinstance(action, Click):
+        grid.dig = action.dig
+        grid.activate_hex(action.index)
+    elif isinstance(action, EndTurn):
+        game.end_player_turn()
+    elif isinstance(action, ShiftResources):
+        game.shift_resources(action.source, action.destination, action.checks)
+    elif isinstance(action, SelectFuel):
+        game.boat_select_fuel(action.index, action.resource_index)
+    elif isinstance(action, FulfillAssignment):
+        fulfill = game.fulfill_tier1 if action.tier == 1 else game.fulfill_tier2
+        fulfill(action.index, list(action.choices), game.get_current_player().assignment)
+    elif isinstance(action, StealResource):
+        grid.steal_resource(action.source, action.destination, action.resource_index)
+
+
+def legal_actions(game, player):
+    ''' Returns the actions player can take now, for clients which want to offer or pick them. Clicks are only listed
+    for hexes where something happens: the own pieces, the hexes the selected piece can go to and its dig icon.
+    Resource shifts are listed one card at a time.'''
+    if player != game.current_player:
+        return []
+    grid = game.grid
+    actions = [EndTurn()]
+    own = [i for i, x in enumerate(grid.objects) if x and x.owner == player]
+    actions += [Click(i, False) for i in own]
+    selected = grid.objects[grid.selected] if grid.selected != [] else None
+    if selected:
+        actions += [Click(int(i), False) for i in grid.select_reachable if not grid.objects[i]]
+        if 'team' in selected.label and selected.moves > 0:
+            actions.append(Click(grid.selected, True))
+    for i in own:
+        obj = grid.objects[i]
+        if not hasattr(obj, 'resources'):
+            continue
+        size = obj.resources.get_size()
+        for destination in grid.get_resource_destinations(i):
+            actions += [ShiftResources(i, int(destination), [int(j == k) for k in range(size)]) for j in range(size)]
+        if 'boat' in obj.label and obj.occupying_pawn and obj.moves > 0:
+            actions.append(SelectFuel(i, -1))
+            actions += [SelectFuel(i, j) for j in range(size) if int(obj.resources.stack[j].fuel) > 0]
+        for victim in grid.get_reachable_object_indices('water', i, 1) if 'boat' in obj.label else []:
+            if 'boat' in grid.objects[victim].label and grid.objects[victim].owner != player and \
+                    i in grid.get_pirates(victim):
+                actions += [StealResource(int(victim), i, j) for j in range(grid.objects[victim].resources.get_size())]
+    return actions
@@ -0,0 +1,138 @@
+import os
+import glob
+import zlib
+import struct
+import hashlib
+
+import numpy
+
+''' Digits 0-9 in a 3x5 pixel font, one string per row, for printing the hex indices into the image.'''
+DIGITS = {'0': ['111', '101', '101', '101', '111'],
+          '1': ['010', '110', '010', '010', '111'],
+          '2': ['111', '001', '111', '100', '111'],
+          '3': ['111', '001', '111', '001', '111'],
+          '4': ['101', '101', '111', '001', '001'],
+          '5': ['111', '100', '111', '001', '111'],
+          '6': ['111', '100', '111', '101', '111'],
+          '7': ['111', '001', '010', '010', '010'],
+          '8': ['111', '101', '111', '101', '111'],
+          '9': ['111', '101', '111', '001', '111']}
+GLYPHS = {digit: numpy.array([[c == '1' for c in row] for row in rows]) for digit, rows in DIGITS.items()}
+
+
+def hex_norm(dx, dy, hex_size):
+    '''Distance measure of a pixel at dx, dy from a hex centre, 1 on the hex outline as given by MainTK.hex_corners
+    and smaller inside the hex. The hexes have vertical sides at dx = +-hex_size/2 and corners at dy = +-hex_size/2.'''
+    dx = numpy.abs(dx) / (0.5 * hex_size)
+    dy = numpy.abs(dy) / (0.5 * hex_size)
+    return numpy.maximum(dx, dy + 0.5 * dx)
+
+
+def hex_at(x, y, x_pix, y_pix, size_x, hex_size):
+    '''Returns the index of the hex that pixel x, y (scalars or arrays) falls in, and its hex_norm. Only the hexes of
+    the two rows the pixel can fall in are tested, so this takes the same time for any board size. Pixels outside
+    the board get the nearest hex on the edge, with a norm larger than 1.'''
+    n_rows = len(x_pix) // size_x
+    row_step = 0.75 * hex_size
+    stagger = x_pix[size_x] - x_pix[0] if n_rows > 1 else 0     # Odd rows are shifted right by half a hex
+    x = numpy.asarray(x, dtype=float)
+    y = numpy.asarray(y, dtype=float)
+    best_norm = numpy.full(numpy.shape(x), numpy.inf)
+    best_hex = numpy.zeros(numpy.shape(x), dtype=int)
+    first_row = numpy.floor((y - y_pix[0]) / row_step).astype(int)
+    for offset in [0, 1]:
+        row = numpy.clip(first_row + offset, 0, n_rows - 1)
+        col = numpy.rint((x - x_pix[0] - (row % 2) * stagger) / hex_size).astype(int)
+        col = numpy.clip(col, 0, size_x - 1)
+        index = row * size_x + col
+        norm = hex_norm(x - x_pix[index], y - y_pix[index], hex_size)
+        closer = norm < best_norm
+        best_norm = numpy.where(closer, norm, best_norm)
+        best_hex = numpy.where(closer, index, best_hex)
+    return best_hex, best_norm
+
+
+def rasterise(x_pix, y_pix, size_x, hex_size, colors, width, height, show_index=False, line_color=(190, 190, 190),
+              line_width=2, background=(255, 255, 255)):
+    '''Renders the terrain of the board into an height x width x 3 array of RGB pixels.
+
+    colors holds the RGB color of every hex. Every pixel gets the color of the hex it is in (see hex_at), for the whole
+    image at once. Pixels within line_width of a hex outline get the line color and pixels outside the board the
+    background color. If show_index is set, the hex numbers are printed in the hex centres. The image always starts
+    at pixel 0, 0: to render a part of the board, shift x_pix and y_pix.'''
+    colors = numpy.asarray(colors, dtype=numpy.uint8)
+    y, x = numpy.mgrid[0:height, 0:width] + 0.5
+    best_hex, best_norm = hex_at(x, y, x_pix, y_pix, size_x, hex_size)
+
+    pixels = colors[best_hex]
+    pixels[best_norm > 1 - line_width / (0.5 * hex_size)] = line_color
+    pixels[best_norm > 1] = background
+
+    if show_index:
+        scale = max(1, int(hex_size // 20))     # Size of a font pixel in image pixels
+        # Only the hexes with their centre in the image, or close to it
+        inside = numpy.flatnonzero((x_pix > -hex_size) & (x_pix < width + hex_size) &
+                                   (y_pix > -hex_size) & (y_pix < height + hex_size))
+        for index in inside:
+            text = str(index)
+            glyph = numpy.hstack([numpy.pad(GLYPHS[c], ((0, 0), (0, 1)), 'constant') for c in text])[:, :-1]
+            glyph = numpy.kron(glyph, numpy.ones((scale, scale), dtype=bool))
+            top = int(y_pix[index] - glyph.shape[0] / 2)
+            left = int(x_pix[index] - glyph.shape[1] / 2)
+            # Cut off the part of the digits that falls outside the image
+            clip_top = max(0, -top)
+            clip_left = max(0, -left)
+            bottom = min(height, top + glyph.shape[0])
+            right = min(width, left + glyph.shape[1])
+            if bottom <= top + clip_top or right <= left + clip_left:
+                continue
+            part = glyph[clip_top:bottom - top, clip_left:right - left]
+            pixels[top + clip_top:bottom, left + clip_left:right][part] = 0
+    return pixels
+
+
+def write_png(file_name, pixels):
+    '''Writes an height x width x 3 array of RGB pixels as a PNG file, which Tk can show with PhotoImage.'''
+    height, width = pixels.shape[:2]
+    # Every scanline starts with filter type 0 (none)
+    raw = numpy.hstack((numpy.zeros((height, 1), dtype=numpy.uint8), pixels.reshape(height, -1))).tobytes()
+
+    def chunk(kind, data):
+        return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data) & 0xffffffff)
+
+    with open(file_name, 'wb') as f:
+        f.write(b'\x89PNG\r\n\x1a\n')
+        f.write(chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b'IDAT', zlib.compress(raw, 6)))
+        f.write(chunk(b'IEND', b''))
+
+
+def map_key(tiles, colors, size_x, hex_size, show_index):
+    '''Hash of everything that determines what the terrain of a board looks like, used to name its cached tiles.'''
+    return hashlib.sha256(repr((list(tiles), numpy.asarray(colors).tolist(), size_x, hex_size,
+                                show_index)).encode()).hexdigest()[:20]
+
+
+def terrain_tile(cache_dir, key, x_pix, y_pix, size_x, hex_size, colors, zoom, left, top, width, height,
+                 show_index=False, keep=2000):
+    '''Returns the file name of a rendered piece of the terrain, rendering it only if it is not in the cache yet.
+
+    The tile covers width x height pixels from left, top of the board drawn at zoom. key is the map_key of the board,
+    so every tile of the same map at the same zoom is rendered once and then reused by every redraw and every
+    restart. When there are more than keep tiles in the cache directory, the least recently used ones are removed;
+    boards with random tiles give new tiles every game.'''
+    file_name = os.path.join(cache_dir, 'terrain_' + key + '_' + str(zoom) + '_' + str(left) + '_' + str(top) + '_' +
+                             str(width) + 'x' + str(height) + '.png')
+    if os.path.exists(file_name):
+        os.utime(file_name)     # Mark as recently used
+        return file_name
+
+    os.makedirs(cache_dir, exist_ok=True)
+    pixels = rasterise(numpy.asarray(x_pix) * zoom - left, numpy.asarray(y_pix) * zoom - top, size_x,
+                       hex_size * zoom, colors, width, height, show_index)
+    write_png(file_name, pixels)
+    cached = glob.glob(os.path.join(cache_dir, 'terrain_*.png'))
+    if len(cached) > keep * 1.25:      # Don't sort the whole cache after every tile
+        for old in sorted(cached, key=os.path.getmtime)[:-keep]:
+            os.remove(old)
+    return file_name
@@ -1,4 +1,41 @@
 import itertools  # itertools allows creating multpiple instances in one go.
+import os
+import configparser
+from collections import OrderedDict
+
+parsed_files = OrderedDict()    # Sections of the ini files read so far, by path, modification time and size
+max_parsed_files = 64           # Least recently used files are dropped beyond this, e.g. the temp files of old games
+
+
+def read_ini(file_names):
+    ''' Returns a ConfigParser with the contents of one or more ini files, like ConfigParser.read. Every file is only
+    parsed once per process (until it changes on disk): a server with many games would otherwise parse the same card
+    files for every game it sets up. The returned parser is a fresh copy, so it can be changed freely.'''
+    if isinstance(file_names, str):
+        file_names = [file_names]
+    config = configparser.ConfigParser()
+    for file_name in file_names:
+        try:
+            info = os.stat(file_name)
+        except OSError:
+            continue        # Like ConfigParser.read, files which cannot be opened are skipped
+        key = (os.path.abspath(file_name), info.st_mtime_ns, info.st_size)
+        sections = parsed_files.get(key)
+        if sections is None:
+            parser = configparser.ConfigParser()
+            parser.read(file_name)
+            defaults = parser.defaults()
+            # Only keep what a section sets itself, so the defaults stay defaults in the copy
+            sections = OrderedDict([(parser.default_section, OrderedDict(defaults))])
+            sections.update((x, OrderedDict((k, v) for k, v in parser.items(x, raw=True)
+                                            if k not in defaults or defaults[k] != v)) for x in parser.sections())
+            parsed_files[key] = sections
+            if len(parsed_files) > max_parsed_files:
+                parsed_files.popitem(last=False)
+        else:
+            parsed_files.move_to_end(key)
+        config.read_dict(sections)
+    return config
 
 class Stack:
     '''Class for a stack of cards'''
@@ -9,10 +46,8 @@ class Stack:
 
     def create_cards_from_file(self,file_name):
         ''' Creates a stack of cards based on specifications in a config file.'''
-        import configparser
         print('Retrieving cards from ' + file_name)
-        config = configparser.ConfigParser()
-        config.read(file_name)
+        config = read_ini(file_name)
         for this_card in config.sections():
             temp = lambda: 0
             temp.name = this_card
@@ -87,10 +122,10 @@ class Stack:
 
         return self.create_dummy() # Return a dummy. Needed for consistency with the sized stack, which can return the passed card if the stack is full.
 
-    def lose_card(self):
-        # Passively lose a card to another stack
+    def lose_card(self, index=-1):
+        # Passively lose a card to another stack, the top card unless another index is given
         try:
-            cardOut = self.stack.pop()
+            cardOut = self.stack.pop(index)
             print('Stash ' + self.stack_name + ' loses a card')
             self.log_stack_size()
             return cardOut
@@ -0,0 +1,74 @@
+from collections import namedtuple, deque
+
+''' The events Grid and Game emit when the state of the game changes. They are small, immutable and only contain
+labels, hex indices and numbers, so they can be queued, logged or sent over the network as they are. Pieces and stacks
+are named by their label (e.g. player1team2, player1harbour), drawpiles by their name in Game (e.g. sand_drawpile).'''
+
+PiecePlaced = namedtuple('PiecePlaced', 'index label')                          # A piece is put on hex index
+PieceRemoved = namedtuple('PieceRemoved', 'index label')                        # A piece is taken off hex index
+PieceMoved = namedtuple('PieceMoved', 'label source destination')               # A piece moves between two hexes
+PieceHighlighted = namedtuple('PieceHighlighted', 'index label highlighted')    # Highlight of an active piece with moves
+Highlighted = namedtuple('Highlighted', 'indices kind')     # Hex outlines: 'reachable' for the selected piece, 'selected'
+OptionShown = namedtuple('OptionShown', 'index option')     # Option icon: 'dig', 'board', 'unboard' or 'steal'
+SelectionCleared = namedtuple('SelectionCleared', '')       # All hex outlines and option icons are removed
+ObjectSelected = namedtuple('ObjectSelected', 'index label own')    # A piece of the current player (own) or an enemy
+FuelSelected = namedtuple('FuelSelected', 'index resource_index')   # A boat picked the fuel to burn, -1 for rowing
+CardTransferred = namedtuple('CardTransferred', 'source destination card index')  # destination None: the card is burned
+CardCountsChanged = namedtuple('CardCountsChanged', 'sand forest meadow rock swamp')    # Cards left in the drawpiles
+TurnChanged = namedtuple('TurnChanged', 'player turn')
+ScoresChanged = namedtuple('ScoresChanged', 'scores')       # Tuple of (player, points) in player order
+Message = namedtuple('Message', 'text')                     # Message for the players
+GameOver = namedtuple('GameOver', 'scores')                 # The game ended, scores is the final score text
+
+EVENT_TYPES = [PiecePlaced, PieceRemoved, PieceMoved, PieceHighlighted, Highlighted, OptionShown, SelectionCleared,
+               ObjectSelected, FuelSelected, CardTransferred, CardCountsChanged, TurnChanged, ScoresChanged, Message,
+               GameOver]
+
+
+class EventBus:
+    '''Publish/subscribe between the game core and everything that shows or sends the game state.
+
+    Grid and Game call emit() for every change; subscribers are called synchronously in the order they subscribed.
+    A subscriber can ask for all events or only for some types. Subscribers which want to batch or drop events do
+    that themselves, e.g. with an EventQueue, so the game logic never waits for them.'''
+
+    def __init__(self):
+        self.subscribers = []   # (callback, event types or None for all events)
+
+    def emit(self, event):
+        for callback, types in self.subscribers:
+            if types is None or type(event) in types:
+                callback(event)
+
+    def subscribe(self, callback, *types):
+        ''' Calls callback(event) for every event of the given types, or for all events if no types are given.'''
+        self.subscribers.append((callback, frozenset(types) if types else None))
+        return callback
+
+    def unsubscribe(self, callback):
+        self.subscribers = [x for x in self.subscribers if x[0] != callback]
+
+
+class EventQueue:
+    '''Collects the events of a bus until they are drained, e.g. once per frame or once per network tick. If maxlen is
+    given, only the newest maxlen events are kept and dropped counts the ones that fell off.'''
+
+    def __init__(self, bus, *types, maxlen=None):
+        self.bus = bus
+        self.events = deque(maxlen=maxlen)
+        self.dropped = 0
+        bus.subscribe(self.put, *types)
+
+    def put(self, event):
+        if self.events.maxlen is not None and len(self.events) == self.events.maxlen:
+            self.dropped += 1
+        self.events.append(event)
+
+    def drain(self):
+        ''' Returns the collected events, oldest first, and empties the queue.'''
+        events = list(self.events)
+        self.events.clear()
+        return events
+
+    def close(self):
+        self.bus.unsubscribe(self.put)
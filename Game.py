@@ -1,6 +1,5 @@
 # os module is used for deleting generated config files when the program is closed
 import os
-import configparser
 import math
 
 # The numpy package is used for connectivity matrix manipulation and solving the linear resource requirement equations.
@@ -9,9 +8,14 @@ import numpy
 # Pawn class for the land pawns, boats and home towns
 from Pawn import Pawn, Harbour, Boat, Home
 # Cards class for managing drawpiles of land tiles and resource cards
-from Cards import DrawPile, Stack
+from Cards import DrawPile, Stack, read_ini
 # The randomize function for shuffling the player order
 from random import shuffle
+# Timing of the initialization steps
+from Timing import startup
+# Events emitted for every change of the game state
+from Events import PieceHighlighted, FuelSelected, CardTransferred, CardCountsChanged, TurnChanged, ScoresChanged, \
+    Message, GameOver
 
 
 class Game:
@@ -32,7 +36,10 @@ class Game:
     Input:
     - config: a configparser object containing the keys of the Config.ini file
     - grid: reference to the grid object which manages the location-based game mechanics
-    - visualiser: reference to visualiser object which handles all i/o
+    - visualiser: reference to visualiser object, only used for logging
+
+    All changes of the game state are emitted as events on the event bus of the grid (see Events), the visualiser
+    and any other consumer subscribe to that.
     
     Functions:
     - activate_player: activates a specified player
@@ -44,13 +51,16 @@ class Game:
     - fulfill_tier2: fulfills the requirement of the plyer's tier2 assignment by removing the appropriate resources
     - game_over: checks whether the game's end conditions have been reached.
     - get_current_player: returns a reference to the object of the current player
+    - get_stack: returns a card stack by the name used for it in events
     - quit: Cleans up the generated card config files and kills the program
     - shift_resources: Moves selected resources from one stakck to another.
-        !!! The checkboxes are interface specific, move (part of) function to visualiser
+        The selection is a plain list with one value per resource card, the visualiser keeps the widgets.
+    - transfer_card: moves a card between two stacks and emits a CardTransferred event
     - update_card_counts: Initiates updating the visualization of the card counts of the resource drawpiles.
     - update_points: Calculates all player scores, stores them and updates the visualisation.
     
-    The following functions are run during __init__ to generate the resource draw decks:
+    The following functions are run during __init__ to create the players and generate the resource draw decks:
+    - create_players: draws the player assignments and creates and places the player pieces
     - get_required_resources: calculates resource requirement of the all player assignments
     - adjust_resources: adjusts resource requirement determined by get_required_resources as specified in config
     - get_resource_matrix: constructs a list of card names and the matrix with the number of each resource in it
@@ -78,13 +88,15 @@ class Game:
         # Store references to the grid, visualiser and config objects in the object for easy access.
         self.grid = grid
         self.visualiser = visualiser
+        self.events = grid.events
         self.config = config
-        # Retrieve the number of players
-        self.game_config = configparser.ConfigParser()
         # Config file which stores the player information
-        self.game_config.read('Game.ini')
-        # Retrieve the number of players
-        self.n_players = self.game_config.getint('Players', 'n_players')
+        self.game_config = read_ini('Game.ini')
+        # Retrieve the number of players. The config can overrule Game.ini, e.g. for the rooms of a server.
+        if config.has_option('Players', 'n_players'):
+            self.n_players = config.getint('Players', 'n_players')
+        else:
+            self.n_players = self.game_config.getint('Players', 'n_players')
         # Assign colors to players. May want to move this to config at some point.
         self.player_colors = ['red', 'blue', 'green', 'orange', 'pink', 'purple']
         # Inititalize the list which will store the player order
@@ -98,6 +110,48 @@ class Game:
 
         # Loop over the players to create struct for each containing their playing pieces. The playing pieces which
         # need to be created are stored in the grid object.
+        with startup.phase('draw assignments, create players'):
+            self.create_players()
+
+        # In the next block, derive the number of each resource card type to be added to the game and distribute them
+        # over the landscapes.
+        with startup.phase('calculate resources (lstsq)'):
+            # Get the total resource requirement for all assignments
+            req = self.get_required_resources()
+            # Apply multipliers and offsets to requirements to get the number of resources needed in the game.
+            req_corr = self.adjust_resources(req)
+            # Retrieve resource count of each resource type except the collectibles.
+            [cards, value_matrix] = self.get_resource_matrix()
+            # Calculate the number of each resource card to be added to the game (excluding specials).
+            res_count = self.calculate_resources(req_corr, value_matrix)
+        with startup.phase('write resource ini files'):
+            # Creaate an ini temp file for each landscape type
+            self.gen_res_conf(res_count, cards)
+        with startup.phase('create resource drawpiles'):
+            # Create the resource draw stacks for each terrain type using the generated ini files.
+            self.swamp_drawpile = DrawPile(config.get('Game', 'swamp_resources'), 'swamp_drawpile')
+            self.rock_drawpile = DrawPile(config.get('Game', 'rock_resources'), 'rock_drawpile')
+            self.forest_drawpile = DrawPile(config.get('Game', 'forest_resources'), 'forest_drawpile')
+            self.meadow_drawpile = DrawPile(config.get('Game', 'meadow_resources'), 'meadow_drawpile')
+            self.sand_drawpile = DrawPile(config.get('Game', 'sand_resources'), 'sand_drawpile')
+
+        # Randomize the player order.
+        shuffle(self.player_order)
+        # Keep track of the turns, initialize at turn 1.
+        self.turn = 1
+        # Initialize a counter to keep track of the current active player.
+        self.player_index = -1
+        # Initialize a label indicating the current player.
+        self.current_player = 'init'
+        # Activate the first player in the sequence.
+        self.activate_player(0)
+
+    def create_players(self):
+        """Create a struct for each player with a drawn assignment and the playing pieces found in the grid's
+        objects_init list, and place the pieces on the board.
+
+        """
+        grid = self.grid
         for i in range(1, self.n_players+1):
             # Make an empty struct.
             def new_player(): return 0
@@ -200,47 +254,18 @@ class Game:
             # Report on the creation of the new player.
             self.visualiser.log('Created player ' + self.player_order[i-1])
 
-        # In the next block, derive the number of each resource card type to be added to the game and distribute them
-        # over the landscapes.
-        # Get the total resource requirement for all assignments
-        req = self.get_required_resources()
-        # Apply multipliers and offsets to requirements to get the number of resources needed in the game.
-        req_corr = self.adjust_resources(req)
-        # Retrieve resource count of each resource type except the collectibles.
-        [cards, value_matrix] = self.get_resource_matrix()
-        # Calculate the number of each resource card to be added to the game (excluding specials).
-        res_count = self.calculate_resources(req_corr, value_matrix)
-        # Creaate an ini temp file for each landscape type
-        self.gen_res_conf(res_count, cards)
-        # Create the resource draw stacks for each terrain type using the generated ini files.
-        self.swamp_drawpile = DrawPile(config.get('Game', 'swamp_resources'), 'swamp_drawpile')
-        self.rock_drawpile = DrawPile(config.get('Game', 'rock_resources'), 'rock_drawpile')
-        self.forest_drawpile = DrawPile(config.get('Game', 'forest_resources'), 'forest_drawpile')
-        self.meadow_drawpile = DrawPile(config.get('Game', 'meadow_resources'), 'meadow_drawpile')
-        self.sand_drawpile = DrawPile(config.get('Game', 'sand_resources'), 'sand_drawpile')
-
-        # Randomize the player order.
-        shuffle(self.player_order)
-        # Keep track of the turns, initialize at turn 1.
-        self.turn = 1
-        # Initialize a counter to keep track of the current active player.
-        self.player_index = -1
-        # Initialize a label indicating the current player.
-        self.current_player = 'init'
-        # Activate the first player in the sequence.
-        self.activate_player(0)
-
     def activate_player(self, index):
         """ Perform all actions required to activate a player. This means that the object belonging to one player become
         clickable. Index specifies the position in the player list.
         
         """
         # Report on the activation of the player.
-        self.visualiser.message('Activating player ' + self.player_order[index])
+        self.events.emit(Message('Activating player ' + self.player_order[index]))
         # Set the active player in index to the input index.
         self.player_index = index
         # Set the label of the current player to the player in the sequence indicated by index.
         self.current_player = self.player_order[self.player_index]
+        self.events.emit(TurnChanged(self.current_player, self.turn))
         # Update the scoreso of all players.
         self.update_points()
 
@@ -250,7 +275,7 @@ class Game:
         for b in getattr(self, self.current_player).boat_list:
             b.reset_moves()
 
-        # Instruct the visualiser object to highlight the objects of the players which have moves for this turn.
+        # Highlight the objects of the players which have moves for this turn.
         # NB: This does not include homes, harbours and boats without pawns in them.
         # Loop over all tiles...
         for i in range(self.grid.n_hexes):
@@ -258,15 +283,9 @@ class Game:
             if self.grid.objects[i]:
                 # ... which belongs to the activated player...
                 if self.grid.objects[i].owner == self.player_order[index]:
-                    # ... remove the visualisation of the objects...
-                    self.visualiser.remove_object(i)
-                    # ... snd redraw them.
-                    # If the object has moves for this turn, the visualiser draws them highlighted.
-                    if self.grid.objects[i].moves > 0:
-                        self.visualiser.draw_object(i, self.grid.objects[i], 'highlight')
-                    # If there are no moves for this turn, the object is drawn non-highlighted.
-                    else:
-                        self.visualiser.draw_object(i, self.grid.objects[i])
+                    # ... highlight them if they have moves for this turn. The visualiser only redraws the objects
+                    # of which the highlight changed.
+                    self.events.emit(PieceHighlighted(i, self.grid.objects[i].label, self.grid.objects[i].moves > 0))
 
     def adjust_resources(self, req):
         """" Apply the intercepts and slopes specified in the config files to the resource requirements. Resource order 
@@ -318,8 +337,8 @@ class Game:
         - resource_index: the index of the selected fual in the list of fuel cards. Value -1 indicates to fuel selected.
         
         """
-        # Close the boat's resource popup. NB: This is a tkinter operation, should move this to the visualiser.
-        self.visualiser.popup.destroy()
+        # Tell the visualiser, it closes the boat's resource popup.
+        self.events.emit(FuelSelected(index, resource_index))
         # If resource_index = -1, no fuel is selected and just use the basic move capability of the boat.
         if resource_index == -1:
             # Deselect the fuel card if the index is -1 ("row" in the boat dialog)
@@ -370,9 +389,11 @@ class Game:
         
         Arguments:
             - index: identifies the currently selected tile of the player board
-            - res_select: tkinter variables indicating which property of each resource card is selected
+            - res_select: list with the selected property of each resource card ('none' if the card is not used)
             - assignment: the assignment card object which needs to be checked.
-        
+
+        Returns whether the selection fulfills tier1 and whether it fulfills tier2, the visualiser enables the
+        fulfill buttons accordingly.
         """
         # Using the grid and index, retrieve the resources in the stack of the object located on the selected tile.
         # Get direct reference to the resource stack
@@ -391,13 +412,13 @@ class Game:
         # Loop over the selected resources and add up the resource counts
         for i in range(0, len(res_select)):
             # Count collectibles if they match the assigment's tier2 objective.
-            if res_select[i].get() == 'collect' and assignment.tier2.find(res[i].collect) != 'none':
+            if res_select[i] == 'collect' and assignment.tier2.find(res[i].collect) != 'none':
                 temp.collect += 1
             # Count the non-collectibles.
-            elif res_select[i].get() != 'none':
-                this_res = getattr(temp, res_select[i].get())
-                this_res += int(getattr(res[i], res_select[i].get()))
-                setattr(temp, res_select[i].get(), this_res)
+            elif res_select[i] != 'none':
+                this_res = getattr(temp, res_select[i])
+                this_res += int(getattr(res[i], res_select[i]))
+                setattr(temp, res_select[i], this_res)
 
         # If tier1 of the assignment is unfulfilled and the resource count of the selection fulfills the tier1
         # requirements, then activate the tier1 fulfill button.
@@ -407,18 +428,16 @@ class Game:
                 temp.stone >= int(assignment.tier1_req_stone) and
                 temp.metal >= int(assignment.tier1_req_metal) and
                 temp.fuel >= int(assignment.tier1_req_fuel)):
-            self.visualiser.ass_enable_1(True)
+            tier1 = True
         # If the requirements of the tier1 assignment are not met, the tier1 fulfull button is disabled.
         else:
-            self.visualiser.ass_enable_1(False)
+            tier1 = False
 
         # If tier1 is fulfilled and any of the selected resources fulfills the tier2 requirement (ie it is a collectible
         # of the correct type), then enable the tier2 fulfill button.
-        if assignment.tier1_fulfilled == '1' and temp.collect > 0:
-            self.visualiser.ass_enable_2(True)
         # In any other case the tier2 fulfill button is disabled.
-        else:
-            self.visualiser.ass_enable_2(False)
+        tier2 = assignment.tier1_fulfilled == '1' and temp.collect > 0
+        return tier1, tier2
 
     def deactivate_player(self, index):
         """ Update the player's point count and de-highlight the player's pawns in case not all were used.
@@ -430,7 +449,7 @@ class Game:
         # Log message indicating that the player is being deactivated.
         self.visualiser.log('Deactivating player ' + self.player_order[index])
         # Message to UI to indicate that the player ended her/his turn.
-        self.visualiser.message(self.player_order[index] + ' ended her/his turn.')
+        self.events.emit(Message(self.player_order[index] + ' ended her/his turn.'))
         # Update the scores.
         self.update_points()
         # Deselected any object which may still be selected.
@@ -438,11 +457,9 @@ class Game:
         # Loop over all board tiles to find objects of the current player.
         for i in range(self.grid.n_hexes):
             if self.grid.objects[i]:
-                # If an object is found which belongs to the player being deactivated, remove it and redraw it as
-                # unselected.
+                # If an object is found which belongs to the player being deactivated, redraw it as unselected.
                 if self.grid.objects[i].owner == self.player_order[index]:
-                    self.visualiser.remove_object(i)
-                    self.visualiser.draw_object(i, self.grid.objects[i])
+                    self.events.emit(PieceHighlighted(i, self.grid.objects[i].label, False))
     
     def end_player_turn(self):
         """Ends the current player's turn by activating the next player. If the last player in the sequence ends his
@@ -471,7 +488,7 @@ class Game:
             # Throw a log message that a new turn has started.
             self.visualiser.log('New turn (' + str(self.turn) + '), activating ' + self.current_player)
 
-    def fulfill_tier1(self, index, res_select, assignment, window):
+    def fulfill_tier1(self, index, res_select, assignment):
         """Fulfills the requirement of the tier1 assignment by removing the appropriate resources. 
         
         The selected resources as passed in the res_select argumment fulfill the requirements as this was already 
@@ -484,12 +501,13 @@ class Game:
             - index: the index of the tile on which the player's home town is located
             - res_select: variables indicating which resource property of each card is selected
             - assignment: the assignment to be fulfilled
-            - window: handle to the popup window with the resource selections.
         """
         # Show a message.
         self.visualiser.log('Attempting to fulfull tier 1 assigment...')
-        # Get a shorter reference to the resource stack
+        # Get a shorter reference to the resource stack and the names of the stacks for the events
         res = self.grid.objects[index].resources
+        home = self.grid.objects[index].label
+        tier1_stack = self.grid.objects[index].owner + '.tier1'
 
         # Create a dummy object for containing the resource counts. Initialize the values to the requirements of the
         # assignment and subtract the selected attributes of the passed resource cards. By putting the counters in a
@@ -511,16 +529,16 @@ class Game:
         i = res.get_size() - 1
         while assignment.tier1_fulfilled == '0' and i >= 0:
             # We only work on the selected resources
-            if res_select[i].get() != 'none':
+            if res_select[i] != 'none':
                 # Check whether the selected resource attribute contributes to fulfulling the assignment
-                if getattr(counter, res_select[i].get()) > 0:
+                if getattr(counter, res_select[i]) > 0:
                     # Deduct the resource value from the appropriate counter. We do this by retrieving the current
                     # resource count of the selected property from the counter struct, deducting the value of the
                     # selected resource and then setting the counter in the struct to the new result.
-                    setattr(counter, res_select[i].get(),
-                            getattr(counter, res_select[i].get())-int(getattr(res.stack[i], res_select[i].get())))
+                    setattr(counter, res_select[i],
+                            getattr(counter, res_select[i])-int(getattr(res.stack[i], res_select[i])))
                     # Push the resource to the assignment stack.
-                    res.give_selected_card(assignment.tier1_stack, i)
+                    self.transfer_card(home, tier1_stack, i)
 
                     # Check whether the the assignment requirements are fulfulled. If so, we're done.
                     if (counter.earth <= 0 and counter.wood <= 0 and
@@ -539,12 +557,9 @@ class Game:
             self.visualiser.log('Tier 1 assignment not fulfilled, returning resources to home stack.')
             # Loop over all resource cards in the assignment stack and give them to the home town stack.
             while len(assignment.tier1_stack.stack) > 0:
-                assignment.tier1_stack.give_card(res)
-        # Close the resource window, it is not up-to-date anymore and pressing the fulfill button again would
-        # cause problems.
-        window.destroy()
+                self.transfer_card(tier1_stack, home)
 
-    def fulfill_tier2(self, index, res_select, assignment, window):
+    def fulfill_tier2(self, index, res_select, assignment):
         """Fulfill the requirement of the tier2 assignment by moving the appropriate resources. 
         
         The selected resources
@@ -554,31 +569,29 @@ class Game:
             - index: the index of the tile on which the player's home town is located
             - res_select: variables indicating which resource property of each card is selected
             - assignment: the assignment to be fulfilled
-            - window: handle to the popup window with the resource selections.
     
         """
         # Log message to announcing what we're about to do.
         self.visualiser.log('Attempting to fulfull tier 2 assigment...')
         # Get a short reference to the resource stack
         res = self.grid.objects[index].resources
+        home = self.grid.objects[index].label
         # Loop over the selected resources and remove them from the stack if it is the right type of special resource.
         # These resources are transferred to the assignment tier2 stack.
         # We will loop backwards, that way we don't get indexing problems when we pop a resource.
         i = res.get_size() - 1
         while i >= 0:
             # Check whether the resource is selected and whether the selection is the special for the assignment.
-            if res_select[i].get() != 'none' and assignment.tier2.find(res_select[i].get()):
+            if res_select[i] != 'none' and assignment.tier2.find(res_select[i]):
                 # If so, transfer the resource to the assignment stack and remove the corresponding variable from
                 # the res_select list.
-                res.give_selected_card(assignment.tier2_stack, i)
+                self.transfer_card(home, self.grid.objects[index].owner + '.tier2', i)
                 res_select.pop(i)
 
             # Decrease the counter for the next iteration
             i -= 1
         # Update the player scores
         self.update_points()
-        # Close the resource window, it is not up-to-date anymore.
-        window.destroy()
 
     def game_over(self):
         """Checks whether the game's end conditions have been reached. 
@@ -601,7 +614,7 @@ class Game:
                 # Each player gets one more turn till game end
                 self.turns_till_end = self.n_players
                 # Send a message to the UI that the end-of-game phase has been started.
-                self.visualiser.message(str(n_empty_stacks) + ' landscapes are empty. Each player gets one more turn.')
+                self.events.emit(Message(str(n_empty_stacks) + ' landscapes are empty. Each player gets one more turn.'))
         # end_cycle is > -1, so we are in the end phase.
         else:
             # Every turn the counter gets lowered. When it hits 0 the game is over.
@@ -609,7 +622,7 @@ class Game:
 
         # When the end-of-game counter reaches 0, the game is over.
         if self.turns_till_end == 0:
-            self.visualiser.message('Game over')
+            self.events.emit(Message('Game over'))
             return True
         else:
             return False
@@ -639,10 +652,8 @@ class Game:
 
         # Loop over terrain types.
         for i in terrains:
-            # Initialize a new config structure
-            this_config = configparser.ConfigParser()
-            # Load all resource tiles except the specials.
-            this_config.read([self.config.get('Game', 'resources'), self.config.get('Game', 'specials')])
+            # Initialize a new config structure and load all resource tiles except the specials.
+            this_config = read_ini([self.config.get('Game', 'resources'), self.config.get('Game', 'specials')])
             # Add the config for this terrain to the terr object. NB: all five configs are the same for now
             setattr(terr, i+'_conf', this_config)
 
@@ -743,6 +754,18 @@ class Game:
 
         return getattr(self, self.current_player)
 
+    def get_stack(self, name):
+        """Returns a card stack by the name used for it in events: the label of a piece with resources (e.g.
+        player1harbour), the name of a drawpile (e.g. sand_drawpile) or a player label followed by .tier1 or .tier2 for
+        the stacks of the player's assignment."""
+        if name.endswith('.tier1') or name.endswith('.tier2'):
+            player, tier = name.split('.')
+            return getattr(getattr(self, player).assignment, tier + '_stack')
+        item = getattr(self, name)
+        if isinstance(item, Stack):
+            return item
+        return item.resources
+
     def get_required_resources(self):
         """ Adds up the resource requirement of the all player assignments and applies the multiplier specified in the 
         game confige file.
@@ -817,15 +840,12 @@ class Game:
 
         # Tell people that there are no winners since the game ends prematurely.
         self.visualiser.log('Game is unfinished so no one wins and no one loses.')
-        # Remove the temp config files.
-        os.remove(self.config.get('Game', 'sand_resources'))
-        os.remove(self.config.get('Game', 'swamp_resources'))
-        os.remove(self.config.get('Game', 'rock_resources'))
-        os.remove(self.config.get('Game', 'forest_resources'))
-        os.remove(self.config.get('Game', 'meadow_resources'))
-        os.remove(self.config.get('Grid', 'tile_temp'))
+        # Remove the temp config files. A game restored from a saved state (see State) never wrote them.
+        for pile in ['sand', 'swamp', 'rock', 'forest', 'meadow']:
+            if os.path.exists(self.config.get('Game', pile + '_resources')):
+                os.remove(self.config.get('Game', pile + '_resources'))
         # Tell the visualiser object to terminate.
-        self.visualiser.kill(self.update_points())
+        self.events.emit(GameOver(self.update_points()))
 
     def shift_resources(self, source_index, destination_index, checks):
         """Move selected resources from source to destination.
@@ -835,28 +855,51 @@ class Game:
             - checks: selection of which resources need to be passed.
         """
 
-        # Retrieve an easy reference to the source and destination stacks.
-        source = self.grid.objects[source_index].resources
-        destination = self.grid.objects[destination_index]
+        # Shifting cards out of a boat moves the cards behind them, so a selected fuel card is deselected first.
+        if hasattr(self.grid.objects[source_index], 'deselect_fuel'):
+            self.grid.objects[source_index].deselect_fuel()
+        # Retrieve the labels of the source and destination objects.
+        source = self.grid.objects[source_index].label
+        destination = self.grid.objects[destination_index].label
 
         # Loop from back to front over the resources in the source.
         for i in reversed(range(0, len(checks))):
             # If a check is yes, then pass the resource from source to destinatioon.
-            if checks[i].get():
-                source.give_selected_card(destination.resources, i)
-        # Destroy the resource popup since it is not up to date anymore.
-        self.visualiser.popup.destroy()
+            if checks[i]:
+                self.transfer_card(source, destination, i)
+
+    def transfer_card(self, source, destination, index=None):
+        """Moves a card from one stack to another and emits a CardTransferred event if it arrived.
+        Arguments:
+            - source: name of the stack the card is taken from (see get_stack)
+            - destination: name of the stack the card goes to
+            - index: position of the card in the source stack, None for the top card.
+        Returns whether the card was transferred; a full destination stack refuses it.
+        """
+        source_stack = self.get_stack(source)
+        destination_stack = self.get_stack(destination)
+        if not source_stack.stack:
+            return False
+        if index is None:
+            index = len(source_stack.stack) - 1
+        card = source_stack.stack[index].name
+        size = destination_stack.get_size()
+        source_stack.give_selected_card(destination_stack, index)
+        if destination_stack.get_size() > size:
+            self.events.emit(CardTransferred(source, destination, card, index))
+            return True
+        return False
 
     def update_card_counts(self):
         """Updates the visualization of the card counts. 
         Counts are supplied in the order sand, forest, meadow, rock, swamp.
                 
         """
-        self.visualiser.update_card_counts(self.sand_drawpile.get_size(),
+        self.events.emit(CardCountsChanged(self.sand_drawpile.get_size(),
                                            self.forest_drawpile.get_size(),
                                            self.meadow_drawpile.get_size(),
                                            self.rock_drawpile.get_size(),
-                                           self.swamp_drawpile.get_size())
+                                           self.swamp_drawpile.get_size()))
 
     def update_points(self):
         """Calculates all player scores, stores them and updates the visualisation."""
@@ -875,7 +918,7 @@ class Game:
                 score_string += i + ': ' + str(player.points) + ' points.\n'
         # Show the score string in the log.
         self.visualiser.log(score_string)
-        # Send the string with socres to the visualiser.
-        self.visualiser.update_scores()
+        # Send the scores to the visualiser.
+        self.events.emit(ScoresChanged(tuple((i, getattr(self, i).points) for i in self.player_order)))
 
         return score_string
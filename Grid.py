@@ -1,20 +1,26 @@
+import os
 import csv
 import configparser
 
 import numpy
 
-from Cards import DrawPile
 from Hexgrid import Hexgrid
+import Mapcompile
+from Events import EventBus, PiecePlaced, PieceRemoved, PieceMoved, PieceHighlighted, Highlighted, OptionShown, \
+    SelectionCleared, ObjectSelected, CardTransferred, Message
 
 class Grid(Hexgrid):
     def __init__(self,size_x,size_y, visualiser):
         super().__init__(size_x,size_y)     # Run the hexgrid constructor
-        self.visualiser = visualiser        # Set a link with the visualiser, safes a lot of parameter passing
+        self.visualiser = visualiser        # Set a link with the visualiser, only used for logging
+        ''' Every change of the board is emitted as an event (see Events). The visualiser and any other consumer
+        subscribe to it, Game emits its events on the same bus.'''
+        self.events = EventBus()
 
     def activate_hex(self,index):
         ''' Spaghetti which handles the events when a player clicks a hex '''
 
-        self.visualiser.remove_selected_items() # Remove all highlighted items and option icons from the board.
+        self.events.emit(SelectionCleared())    # Remove all highlighted items and option icons from the board.
 
         if self.selected == [] and not self.objects[index]:
             ''' Do nothing'''
@@ -24,11 +30,11 @@ class Grid(Hexgrid):
             ''' If a pawn is selected and the clicked index is the selected index and the drawpile for the landscape is not empty, check whether the "dig" option was clicked.'''
             self.visualiser.log('Digging...')
             '''The drawpile of the tile type gives a resource to the stash of the activeplayer'''
-            getattr(self.game,self.tiles[index]+'_drawpile').give_card(getattr(self.game,self.game.player_order[self.game.player_index] + 'harbour').resources) # Get a card from the appropriate stack and move it to the player's harbour
+            self.game.transfer_card(self.tiles[index] + '_drawpile', self.game.current_player + 'harbour')  # Get a card from the appropriate stack and move it to the player's harbour
             self.objects[self.selected].use_moves(1)          # Deduct one move for the pawn
             self.deselect_object()                          # Deselect the hex
             self.game.update_card_counts()                  # Update the card counts
-            self.visualiser.message(self.game.player_order[self.game.player_index] + ' gains ' + getattr(self.game,self.game.player_order[self.game.player_index] + 'harbour').resources.stack[-1].name)
+            self.events.emit(Message(self.game.player_order[self.game.player_index] + ' gains ' + getattr(self.game,self.game.player_order[self.game.player_index] + 'harbour').resources.stack[-1].name))
 
         elif self.selected and not self.objects[index]:
             ''' If a boat is selected which has a pawn, we see if the pawn can disembark. If the index hex contains an enemy ship, we try to steal from it.'''
@@ -43,7 +49,7 @@ class Grid(Hexgrid):
                     self.visualiser.log('Attempt to move pawn to ' + str(index))
                     found = self.select_reachable.tolist().index(index) #This is just a trick to generate an exception if index is empty
                     self.move_object(index)
-                    self.visualiser.remove_selected_items()
+                    self.events.emit(SelectionCleared())
                     self.selected = []
 
                 except ValueError:
@@ -58,7 +64,7 @@ class Grid(Hexgrid):
             if 'team' in self.objects[self.selected].label:
                 if index in self.get_reachable_boats(self.selected):
                     ''' Move the pawn into the boat'''
-                    self.visualiser.message(self.game.current_player + ' moves pawn ' + self.objects[self.selected].label + ' into boat' + self.objects[index].label)
+                    self.events.emit(Message(self.game.current_player + ' moves pawn ' + self.objects[self.selected].label + ' into boat' + self.objects[index].label))
                     not_removed =  self.objects[index].occupy(self.objects[self.selected])
                     if not not_removed:
                         moved_pawn_index = self.selected
@@ -93,13 +99,11 @@ class Grid(Hexgrid):
     def deselect_object(self):
         if self.selected == []: # Escape the method if nothing is selected
             return
-        self.visualiser.remove_object(self.selected)
-        self.visualiser.remove_selected_items()
+        self.events.emit(SelectionCleared())
         '''If the pawn belongs to the active player and has moves left, it needs to be highliighted, '''
-        if self.objects[self.selected].owner == self.game.current_player and self.objects[self.selected].moves > 0:
-            self.visualiser.draw_object(self.selected,self.objects[self.selected],'highlight')
-        else:
-            self.visualiser.draw_object(self.selected,self.objects[self.selected])
+        selected = self.objects[self.selected]
+        self.events.emit(PieceHighlighted(self.selected, selected.label,
+                                          selected.owner == self.game.current_player and selected.moves > 0))
         ''' Clear the index of the currently selected hex '''
         self.selected = []
         self.selected_reachable = []
@@ -111,6 +115,22 @@ class Grid(Hexgrid):
         conn_1 = self.get_connections([index], terrain + '_conn', radius)
         return  [x for i, x in enumerate(conn_1) if self.objects[x]]
 
+    def get_pirates(self, index):
+        ''' Returns the hexes with boats of the current player which can steal from the boat on hex index: boats next to
+        it which have used their moves and haven't stolen yet this turn.'''
+        has_objects = self.get_reachable_object_indices('all', index, 1)
+        boats = [x for x in has_objects if (self.game.current_player + 'boat') in self.objects[x].label]  # Find current players ships one removed
+        return [x for x in boats if self.objects[x].moves == 0 and self.objects[x].can_steal]  # Only keep ships that have moves = 0 and can steal = True
+
+    def get_resource_destinations(self, index):
+        ''' Returns the hexes of the harbour, home town and boats of the current player next to the object on hex
+        index, to which it can pass resources.'''
+        has_object = self.get_reachable_object_indices('all', index, 1)
+        destinations = []
+        for kind in ['harbour', 'home', 'boat']:
+            destinations += [x for x in has_object if (self.game.current_player + kind) in self.objects[x].label]
+        return destinations
+
     def get_landscape_stack_size_by_index(self,index):
         ''' Returns the number of resources still available in the stack of the landscape of hex index.'''
         return getattr(self.game,self.tiles[index]+'_drawpile').get_size()
@@ -221,59 +241,61 @@ class Grid(Hexgrid):
                 if row[2]:
                     self.objects_init[index] = 'init_' + row[3] + '_' + row[2]
 
-            # Determine how many of each landscape tile we need for the randomized tiles. There are two types of
-            # random tiles: 1. random (all tile types, including water) and 2. land (random but has to be land).
-            # Count the number of random entries.
-            n_random = self.tiles.count('random') + self.tiles.count('land')
-            # Determine the number of land tiles required of each type. This is random/6 + land/5.
-            n_land = numpy.floor(self.tiles.count('random')/6 + self.tiles.count('land')/5)
-            # Number of water is all that remains
-            n_water = n_random - 5*n_land
-            # Initialize a new config structure
-            this_config = configparser.ConfigParser()
-            # Load a template for all tiles (single copy each)
-            this_config.read(config.get('Grid', 'tile_file'))
-
-            # Set the number of copies for each tile type.
-            for type in ['sand','forest','meadow','rock','swamp']:
-                this_config.set(type, 'copies', str(int(n_land)))
-            this_config.set('water', 'copies', str(int(n_water)))
-
-            # Write the result to a temporary ini file
-            with open(config.get('Grid', 'tile_temp'), 'w') as configfile:
-                this_config.write(configfile)
-
-            # Create the draw pile for the randomized tiles from the temp file.
-            self.tile_draw = DrawPile(config.get('Grid', 'tile_temp'), 'tile_drawpile')
-
-        # Now we loop over the randomized tiles and assign a random tile from the draw pile.
-        for tile, index in zip(self.tiles,self.all_hexes):
-            # Process randomized land; draw tiles until land is drawn. If we draw water, we put it back, shuffle,
-            # and draw again.
-            if tile == 'land':
-                iswater = True
-                iterations = 0
-                # Keep drawing until a non-water tile is drawn
-                while iswater:
-                    drawn_tile = self.tile_draw.lose_card()
-                    # At some point we may need to give up because there may be a mistake in the game setup.
-                    if drawn_tile.name == 'water' and iterations < 2*self.tile_draw.get_size():
-                        self.tile_draw.receive_card(drawn_tile)
-                        self.tile_draw.shuffle_stack()
-                        iswater = True
-                        iterations += 1
-                    else:
-                        self.tiles[index] = drawn_tile.name
-                        iswater = False
-            # PRocess fully randomized tiles, including water.
-            elif tile == 'random':
-                drawn_tile = self.tile_draw.lose_card()
-                self.tiles[index] = drawn_tile.name
-
-        # Set the land connectivity matrix.
-        self.set_land_connectivity()
-        # Set the water connectivity matrix.
-        self.set_water_connectivity()
+        # Randomized tiles come in two kinds: 1. random (all tile types, including water) and 2. land (random but has
+        # to be land). They are all assigned in one go below.
+        self.assign_random_tiles(config.get('Grid', 'tile_file'))
+
+        self.set_connectivity(config.get('Game', 'board'))
+
+    def set_connectivity(self, board_file):
+        '''Sets the land and water connectivity for the tiles of the board.'''
+        # Use the compiled version of the map if there is one which matches the board file. It contains the land and
+        # water connectivity and the k-step matrices, so nothing needs to be recalculated.
+        self.compiled = None
+        if os.path.exists(board_file):
+            self.compiled = Mapcompile.load_compiled(board_file, self.size_x, self.n_hexes // self.size_x)
+        if self.compiled is not None:
+            self.visualiser.log('Using compiled map ' + self.compiled.file_name)
+            self.land_conn_1 = self.compiled.get('land_conn_1')
+            self.water_conn_1 = self.compiled.get('water_conn_1')
+        else:
+            # Set the land connectivity matrix.
+            self.set_land_connectivity()
+            # Set the water connectivity matrix.
+            self.set_water_connectivity()
+
+    def assign_random_tiles(self, tile_file):
+        '''Replaces the land and random placeholder tiles by drawn landscape tiles.
+
+        The pile holds n copies of each land type in the tile file, n being random/6 + land/5 (but at least enough for
+        all land placeholders), and water for the remaining random tiles. The pile is split into land and water: the
+        land placeholders get a sample without replacement from the land part, the random placeholders a sample from
+        what is left of the land together with the water. The water makes up whatever the land does not cover, so the
+        random placeholders always get a tile; raises a ValueError if the board has land placeholders but the tile file
+        has no land types.'''
+        tiles = numpy.array(self.tiles, dtype=object)
+        land_hexes = numpy.flatnonzero(tiles == 'land')
+        random_hexes = numpy.flatnonzero(tiles == 'random')
+        if len(land_hexes) + len(random_hexes) == 0:
+            return
+
+        tile_config = configparser.ConfigParser()
+        tile_config.read(tile_file)
+        land_types = [x for x in tile_config.sections() if x != 'water']
+        # Number of copies of each land type and number of water tiles in the pile
+        n_land = int(numpy.floor(len(random_hexes)/6 + len(land_hexes)/5))
+        if land_types:
+            n_land = max(n_land, -(-len(land_hexes) // len(land_types)))
+        n_water = max(len(random_hexes) + len(land_hexes) - len(land_types)*n_land, 0)
+
+        land_pile = numpy.random.permutation(numpy.repeat(numpy.array(land_types, dtype=object), n_land))
+        if len(land_pile) < len(land_hexes):
+            raise ValueError('Tile file ' + tile_file + ' has no land types for the ' + str(len(land_hexes)) +
+                             ' land tiles of the board')
+        rest_pile = numpy.concatenate((land_pile[len(land_hexes):], numpy.array(['water']*n_water, dtype=object)))
+        tiles[land_hexes] = land_pile[:len(land_hexes)]
+        tiles[random_hexes] = numpy.random.permutation(rest_pile)[:len(random_hexes)]
+        self.tiles = list(tiles)
 
     def move_object(self, new_index):
         ''' Attempts to move a pawn from the current location to new_index'''
@@ -281,11 +303,16 @@ class Grid(Hexgrid):
         ''' check if the new_index is reachable, if so do the move'''
         #if numpy.where(self.select_reachable == new_index):
         if new_index in self.select_reachable:
-            object = self.remove_object(self.selected)
-            self.place_object(object,new_index)
+            object = self.objects[self.selected]
+            self.objects[self.selected] = None
+            self.objects[new_index] = object
+            self.events.emit(PieceMoved(object.label, self.selected, new_index))
             object.moves = 0
             ''' If the moved object is a boat then burn the selected fuel'''
             if 'boat' in object.label:
+                if object.selected_fuel != -1:
+                    self.events.emit(CardTransferred(object.label, None, object.resources.stack[object.selected_fuel].name,
+                                                     object.selected_fuel))
                 object.burn_fuel()                                  # Burn selected fuel
             self.visualiser.log('Pawn ' + object.label + ' moved from hex ' + str(self.selected) + ' to ' + str(new_index))
             
@@ -299,7 +326,7 @@ class Grid(Hexgrid):
         # Check whether position x,y is occupied, if so return false.
         if not self.objects[index]:
             self.objects[index] = object
-            self.visualiser.draw_object(index, object)
+            self.events.emit(PiecePlaced(index, object.label))
             self.visualiser.log('    ...success')
             return True
         else:
@@ -310,9 +337,9 @@ class Grid(Hexgrid):
         if not self.objects:
             self.visualiser.log('No pawn found on hex ' + str(index))
         else:
-            self.visualiser.remove_object(index)
             removed  = self.objects[index]
             self.objects[index] = None
+            self.events.emit(PieceRemoved(index, removed.label))
             self.visualiser.log('Object ' + removed.label + ' removed from hex ' + str(index))
             return removed
 
@@ -325,10 +352,10 @@ class Grid(Hexgrid):
             self.visualiser.log('No options for enemy pawns')
         elif 'boat' in self.objects[index].label:
             '''Draw the highlighted pawn, draw the icons for the boat options (unboarding), display the resource popup and display the fuel burn popup. '''
-            self.visualiser.enemy_resources_popup(index)
+            self.events.emit(ObjectSelected(index, self.objects[index].label, False))
         elif 'harbour' in self.objects[index].label or 'home' in self.objects[index].label:
             ''' Draw the harbour and show the resource popup.'''
-            self.visualiser.enemy_resources_popup(index)
+            self.events.emit(ObjectSelected(index, self.objects[index].label, False))
         else:
             self.visualiser.log('Unknown object')
 
@@ -346,27 +373,66 @@ class Grid(Hexgrid):
         ''' Determine hexes reachable by the pawn in hex index '''
         self.select_reachable = numpy.array(self.get_reachable_hexes(index, self.objects[index]))
 
-        for i in self.select_reachable:
-            self.visualiser.highlight_hex(i, 'pawn')
+        self.events.emit(Highlighted(tuple(int(i) for i in self.select_reachable), 'reachable'))
 
-        '''Remove existing pawn visualisation'''
-        self.visualiser.remove_object(index)
-        ''' Highlight the hex '''
-        self.visualiser.highlight_hex(index,'reachable')
+        ''' Highlight the hex and draw the selected piece without the highlight of active pieces '''
+        self.events.emit(Highlighted((index,), 'selected'))
+        self.events.emit(PieceHighlighted(index, self.objects[index].label, False))
 
         ''' The rest of the procedure depends on the object type'''
         if 'team' in self.objects[index].label:
-            ''' Draw the highlighted pawn and show the pawn options (digging, boarding a boat) '''
-            self.visualiser.draw_object(index,self.objects[index])
-            self.visualiser.show_pawn_options(index)
+            ''' Show the pawn options (digging, boarding a boat) '''
+            self.show_pawn_options(index)
         elif 'boat' in self.objects[index].label:
-            '''Draw the highlighted pawn, draw the icons for the boat options (unboarding), display the resource popup and display the fuel burn popup. '''
-            self.visualiser.draw_object(index, self.objects[index])
-            self.visualiser.show_boat_options(index)
-            self.visualiser.player_resources_popup(index)
+            '''Show the icons for the boat options (unboarding), the resource popup and the fuel burn popup. '''
+            self.show_boat_options(index)
+            self.events.emit(ObjectSelected(index, self.objects[index].label, True))
         elif 'harbour' in self.objects[index].label or 'home' in self.objects[index].label:
-            ''' Draw the harbour and show the resource popup.'''
-            self.visualiser.draw_object(index, self.objects[index])
-            self.visualiser.player_resources_popup(index)
+            ''' Show the resource popup.'''
+            self.events.emit(ObjectSelected(index, self.objects[index].label, True))
         else:
             self.visualiser.log('Unknown object')
+
+    def show_boat_options(self, index):
+        ''' Shows the options for a selected boat'''
+
+        ''' Show the tiles on a which an occupying pawn, if present, can disembark.'''
+        if self.objects[index].occupying_pawn and self.objects[index].moves > 0:
+            ''' Find all unoccupied land tiles within moveable distance of the pawn on the boat.'''
+            reachable_land = self.get_reachable_land(index)
+            ''' Draw a down arrow on all reachable hexes for the pawn'''
+            for i in reachable_land:
+                self.events.emit(OptionShown(int(i), 'unboard'))
+
+        ''' Show enemy ships which can be boarded and which have something to loot'''
+        if self.objects[index].moves == 0 and self.objects[index].can_steal: # Boat already moved and hasn't stolen in this turn
+            reachable_sea = self.get_connections([index],'water_conn',1) # Get all sea hexes one removed. Boat can only steal from neighbouring hexes
+            for i in reachable_sea:
+                if self.objects[i]: # First see if there is an object there at all
+                    if 'boat' in self.objects[i].label and self.game.current_player not in self.objects[i].owner: # Identify enemy ships
+                        if self.objects[i].resources.get_size() > 0:         # Check if there's anything to steal
+                            self.events.emit(OptionShown(int(i), 'steal'))
+
+    def show_pawn_options(self,index):
+        '''Display the dig and move options in the hex'''
+        # Only show options if pawn has at least 1 move left and if the resource stack for the occupied landscape type still has cards
+        if self.objects[index].moves > 0 and self.get_landscape_stack_size_by_index(index) > 0:
+            '''Show the dig option.'''
+            self.events.emit(OptionShown(index, 'dig'))
+
+            ''' Draw the boarding option '''
+            ''' First, we need to determine if a ship owned by the player is located 1. next to land, 2. within walkable reach and 3. unoccupied.'''
+            boats = self.get_reachable_boats(index)
+            '''Draw an arrow on the reachable boats'''
+            for i in boats:
+                self.events.emit(OptionShown(int(i), 'board'))
+
+    def steal_resource(self, source_index, destination_index, resource_index):
+        ''' The boat on destination_index steals resource resource_index from the enemy boat on source_index.'''
+        pirate = self.objects[destination_index]
+        victim = self.objects[source_index]
+        card = victim.resources.stack[resource_index].name if resource_index < victim.resources.get_size() else None
+        size = pirate.resources.get_size()
+        pirate.steal_resource_from_boat(victim, resource_index)
+        if pirate.resources.get_size() > size:
+            self.events.emit(CardTransferred(victim.label, pirate.label, card, resource_index))
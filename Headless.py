@@ -0,0 +1,56 @@
+import random
+import configparser
+
+import numpy
+
+from Grid import Grid
+from Game import Game
+
+''' Runs the game without a window: Grid and Game only talk to the outside world through the events on grid.events
+(see Events), so anything that subscribes to them can show or send the game state. Used by tools and servers.'''
+
+
+class HeadlessVisualiser:
+    '''Stands in for MainTK. Grid and Game only use the visualiser for logging.'''
+
+    def __init__(self, verbose=False):
+        self.verbose = verbose
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+
+def new_game(config_file='Config.ini', seed=None, verbose=False, config=None):
+    ''' Sets up the board and the game like MainTK does, without a window. A seed makes the map and the shuffled
+    drawpiles the same every time. Subscribe to grid.events before the first click to receive all changes; the
+    pieces placed while setting up can be read from grid.objects. Returns the grid and the game.'''
+    if seed is not None:
+        numpy.random.seed(seed)
+        random.seed(seed)
+    if config is None:
+        config = configparser.ConfigParser()
+        config.read(config_file)
+    visualiser = HeadlessVisualiser(verbose)
+    grid = Grid(config.getint('Grid', 'hexes_x'), config.getint('Grid', 'hexes_y'), visualiser)
+    grid.load_map(config)
+    game = Game(config, grid, visualiser)
+    grid.game = game
+    return grid, game
+
+
+if __name__ == '__main__':
+    from Events import EventQueue
+
+    grid, game = new_game(seed=1)
+    events = EventQueue(grid.events)
+    # Let the first player dig with a pawn and end the turn
+    pawn = [i for i, x in enumerate(grid.objects) if x and x.owner == game.current_player and 'team' in x.label][0]
+    grid.dig = False
+    grid.activate_hex(pawn)
+    grid.dig = True         # MainTK sets this when the dig icon is clicked
+    grid.activate_hex(pawn)
+    game.end_player_turn()
+    for event in events.drain():
+        print(event)
+    game.quit()
@@ -1,5 +1,27 @@
 import numpy
 
+from Cards import DrawPile
+
+shared_connections = {}  # Full board connectivity (all_conn_k matrices and neighbours) by board size, see Hexgrid
+
+
+def hex_neighbours(size_x, size_y):
+    ''' Returns an (n_hexes, 6) array with the indices of the neighbours of every hex, or -1 where the board ends.
+    The columns are ordered east, west, north-west, north-east, south-west and south-east. This gives exactly the same
+    connections as the all_conn_1 matrix of the Hexgrid class, but it is built in one vectorised pass and takes 6 entries
+    per hex instead of n_hexes. Use it wherever the full matrix is too big, e.g. for map generation and analysis.'''
+    index = numpy.arange(size_x * size_y)
+    row = index // size_x
+    col = index % size_x
+    ''' The uneven rows (counting from 0) are staggered half a hex to the right. Their diagonal neighbours are therefore
+    in the same column and the column to the right, for the even rows it's the column to the left and the same column.'''
+    shift = row % 2
+    cols = numpy.stack([col + 1, col - 1, col - 1 + shift, col + shift, col - 1 + shift, col + shift], 1)
+    rows = numpy.stack([row, row, row - 1, row - 1, row + 1, row + 1], 1)
+    on_board = (cols >= 0) & (cols < size_x) & (rows >= 0) & (rows < size_y)
+    return numpy.where(on_board, rows * size_x + cols, -1)
+
+
 class Hexgrid:
     '''Hexagonal grid for board management'''
     def __init__(self,size_x,size_y):
@@ -18,6 +40,8 @@ class Hexgrid:
         self.objects_init = list([''] * self.n_hexes)   # List of names of the objects on the board during init.
         self.selected = []                              # Index of the hex containing the currently selected pawn . Passing this index handles most game functionality.
         self.select_reachable = numpy.array([])         # Index list of the hexes reachable for the currently selected pawn.
+        self.compiled = None                            # Precomputed connectivity of the loaded map, see Mapcompile.
+        self.on_connections = None                      # If set, called with where get_connections found each matrix.
 
         ''' Generate the y-coordinates by repeating the y_coordinates 'size_x' times and transposing to x-first matrix orientation.
         NB, the hex centers in y direction are in reality 0.75 apart. To mame things easier, I account for this in the visualizer.'''
@@ -44,6 +68,13 @@ class Hexgrid:
         # List of all hexes
         self.all_hexes = numpy.array(range(0, self.n_hexes))
 
+        # The connectivity of the full board only depends on its size, so boards of the same size share it.
+        shared = shared_connections.get((size_x, size_y))
+        if shared is not None:
+            self.all_conn_1 = shared['all_conn_1']
+            self.neighbours = shared['neighbours']
+            return
+
         # For assigning the oblique connections we need to distinguish between even and uneven rows.
         odd_rows = self.all_hexes[numpy.in1d(self.y_coords, numpy.array(range(0, size_y * 2, 4)))]
         even_rows = self.all_hexes[numpy.in1d(self.y_coords, numpy.array(range(2, size_y * 2, 4)))]
@@ -86,6 +117,14 @@ class Hexgrid:
         select = numpy.intersect1d(numpy.concatenate([inside, north, east, west]), even_rows)  # Connections to the south-west, even rows
         self.all_conn_1[(select), (select) + size_x] = 1
 
+        # Sparse version of the same connectivity: the six neighbours of each hex, -1 for off-board.
+        self.neighbours = hex_neighbours(size_x, size_y)
+
+        # Share both with the next boards of this size. They are made read-only, so no board can change them for others.
+        self.all_conn_1.flags.writeable = False
+        self.neighbours.flags.writeable = False
+        shared_connections[(size_x, size_y)] = {'all_conn_1': self.all_conn_1, 'neighbours': self.neighbours}
+
     def get_connections(self,index_list,conn_list_name,dist):
         ''' Returns all hex indices of tiles which are dist away from all hexes in index_list according to connectivity matrix conn_list_name'''
         # Check if the list of connections has been extended far enough to fulfill the request. If not then add it.
@@ -94,7 +133,32 @@ class Hexgrid:
             connections = getattr(self, conn_list_name + '_' + str(dist))
 
         except AttributeError:
+            connections = None
+        if connections is not None and self.on_connections is not None:
+            self.on_connections('cache')
+
+        # The k-step matrices of the full board may have been made by another board of the same size.
+        shared = shared_connections.get((self.size_x, self.n_hexes // self.size_x)) if conn_list_name == 'all_conn' else None
+        if connections is None and shared is not None:
+            connections = shared.get(conn_list_name + '_' + str(dist))
+            if connections is not None:
+                if self.on_connections is not None:
+                    self.on_connections('shared')
+                setattr(self, conn_list_name + '_' + str(dist), connections)
+
+        # A compiled map (see Mapcompile) may already contain the matrix, so we only need to unpack it.
+        if connections is None and self.compiled is not None:
+            connections = self.compiled.get(conn_list_name + '_' + str(dist))
+            if connections is not None:
+                print('Loading compiled connectivity matrix ' + conn_list_name + '_' + str(dist))
+                if self.on_connections is not None:
+                    self.on_connections('compiled')
+                setattr(self, conn_list_name + '_' + str(dist), connections)
+
+        if connections is None:
             print('Generating ' + str(dist) + '-step connectivity matrix for ' + conn_list_name)
+            if self.on_connections is not None:
+                self.on_connections('generated')
             ''' Retrieve the dist-min-1-step connectivity for conn_list_name. 
             If this isn't found, it is created by running this function recursively.'''
             try:
@@ -112,6 +176,9 @@ class Hexgrid:
             connections[remove,:] = 0
             connections[:,remove] = 0
             setattr(self,conn_list_name + '_' + str(dist), connections)       # Store the new connectivity matrix because we will probably need it again
+            if shared is not None:
+                connections.flags.writeable = False
+                shared[conn_list_name + '_' + str(dist)] = connections
 
         # Return indices to the columns which contain a number for any of the rows in Index_list, excluding the hexes in index_list themselves
         return numpy.setdiff1d(numpy.where(connections[index_list,:].sum(0)>0), index_list)
@@ -126,20 +193,34 @@ class Hexgrid:
         drawn_tile = self.tile_draw.lose_card()
         print('Land tile ' + drawn_tile.name + ' added to hex ' + str(this_index))
         self.tiles[this_index] = drawn_tile.name
-        index_list = [this_index]
-        # Add the remaining tiles to the start hex
+        placed = {this_index}
+        ''' Keep the neighbours of the island in a list (for picking a random one) and a dict with their position in the
+        list (for removing them again). This way each step only touches the six neighbours of the new tile instead of
+        recalculating the neighbours of the whole island. '''
+        frontier = []
+        frontier_pos = {}
         for i in range(1, number):
-            # Retrieve the neighboring hexes of the already placed land tiles
-            neighbours = self.get_connections(index_list, 'all_conn', 1)
-            # Select a random hex from the neighbours
-            this_index = neighbours[numpy.random.randint(0, len(neighbours))]
+            # Add the neighbours of the previously placed tile to the frontier
+            for neighbour in self.neighbours[this_index]:
+                if neighbour >= 0 and neighbour not in placed and neighbour not in frontier_pos:
+                    frontier_pos[neighbour] = len(frontier)
+                    frontier.append(neighbour)
+            if not frontier:
+                print('No room left to grow the island after ' + str(i) + ' tiles')
+                break
+            # Select a random hex from the neighbours and swap it with the last entry so it can be popped.
+            pick = numpy.random.randint(0, len(frontier))
+            this_index = frontier[pick]
+            frontier[pick] = frontier[-1]
+            frontier_pos[frontier[pick]] = pick
+            frontier.pop()
+            del frontier_pos[this_index]
             drawn_tile = self.tile_draw.lose_card()
             print('Land tile ' + drawn_tile.name + ' added to hex ' + str(this_index))
 
             # Add a land tile label to the tiles list
             self.tiles[this_index] = drawn_tile.name
-            # Add the new index to the index_list for use in the next iterations
-            index_list.append(this_index)
+            placed.add(this_index)
 
         self.set_land_connectivity()
 
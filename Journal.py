@@ -0,0 +1,220 @@
+import os
+import json
+import time
+import queue
+import threading
+
+import Actions
+import State
+import Savegame
+
+''' Append-only journal of a game, for recovering it after a crash. A journal is a directory with:
+    actions.jsonl           every action carried out, one json line each: {"n": 12, "player": ..., "action": {...}}
+    snapshot_<n>.state      the state of the game (see State) after n actions, as a save (see Savegame)
+    finished                only there when the game has ended
+
+Recovering loads the latest snapshot and replays the actions after it. The first snapshot is written when the journal
+starts, so the journal never needs the seed or the temp ini files of the game.
+
+Recording an action only appends a line to a buffer. A thread of the journal writes the buffer to disk and syncs it
+every sync_interval seconds, and writes the snapshots, which are taken every snapshot_interval actions: the game only
+waits for taking the state, not for the disk. A crash loses at most the actions of the last sync_interval seconds.'''
+
+ACTIONS = 'actions.jsonl'
+FINISHED = 'finished'
+
+
+def snapshot_name(n):
+    return 'snapshot_' + str(n).zfill(8) + '.state'
+
+
+def read_actions(directory):
+    ''' Returns the actions in a journal as a list of (n, player, action), and the number of bytes they take in the
+    file. A last action which was only partly written is left out.'''
+    actions = []
+    good = 0            # Bytes of the journal up to the last complete line
+    with open(os.path.join(directory, ACTIONS), 'rb') as f:
+        for line in f:
+            if not line.endswith(b'\n'):
+                break
+            try:
+                entry = json.loads(line.decode())
+            except ValueError:
+                break
+            good += len(line)
+            actions.append((entry['n'], entry['player'], Actions.decode(entry['action'])))
+    return actions, good
+
+
+def replay(game, player, action, name):
+    ''' Carries out a recorded action again. Raises ValueError if the game does not allow it: then the record is not
+    of this game. Other errors are ignored, the game failed on the action when it was recorded too.'''
+    try:
+        Actions.apply(game, player, action)
+    except Actions.IllegalAction as e:
+        raise ValueError(name + ' cannot be replayed: ' + str(e))
+    except Exception:
+        pass
+
+
+class Journal:
+    '''Writes the journal of one game into directory. Call start with the game once it has been set up, then record
+    with every action the game carries out, and close at the end.'''
+
+    def __init__(self, directory, snapshot_interval=100, sync_interval=0.1, keep=2):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.sync_interval = sync_interval
+        self.keep = keep                                # Number of snapshots kept besides the first
+        self.n = 0                                      # Number of actions recorded
+        self.grid = None
+        self.game = None
+        self.file = None
+        self.jobs = queue.Queue()                       # Snapshots for the writer thread to write
+        self.dirty = False
+        self.thread = None
+
+    def close(self, finished=False):
+        ''' Writes everything to disk and stops the writer thread. A finished game is not recovered.'''
+        if self.thread is None:
+            return
+        self.jobs.put(None)
+        self.thread.join()
+        self.thread = None
+        self.file.close()
+        if finished:
+            with open(os.path.join(self.directory, FINISHED), 'w') as f:
+                f.write(str(self.n))
+
+    def open(self, grid, game, n):
+        self.grid = grid
+        self.game = game
+        self.n = n
+        self.file = open(os.path.join(self.directory, ACTIONS), 'ab')
+        self.thread = threading.Thread(target=self.write, daemon=True)
+        self.thread.start()
+
+    def record(self, player, action):
+        ''' Adds an action which player carried out.'''
+        self.n += 1
+        self.file.write(json.dumps({'n': self.n, 'player': player, 'action': Actions.encode(action)},
+                                   separators=(',', ':'), default=lambda x: x.item()).encode() + b'\n')
+        self.dirty = True
+        if self.n % self.snapshot_interval == 0:
+            self.snapshot()
+
+    def snapshot(self):
+        ''' Takes the state of the game now; the writer thread writes it.'''
+        self.jobs.put((self.n, State.capture(self.grid, self.game)))
+
+    def start(self, grid, game):
+        ''' Starts the journal of a new game in an empty directory, with the snapshot of the game as it was set up.'''
+        os.makedirs(self.directory, exist_ok=True)
+        if os.listdir(self.directory):
+            raise ValueError('Journal directory ' + self.directory + ' is not empty')
+        with open(os.path.join(self.directory, snapshot_name(0)), 'wb') as f:
+            f.write(Savegame.encode(State.capture(grid, game)))
+        self.open(grid, game, 0)
+
+    def write(self):
+        ''' Runs in the writer thread: syncs the actions every sync_interval seconds and writes the snapshots.'''
+        while True:
+            try:
+                job = self.jobs.get(timeout=self.sync_interval)
+            except queue.Empty:
+                job = False
+            if self.dirty:
+                self.dirty = False
+                self.file.flush()
+                os.fsync(self.file.fileno())
+            if job is None:
+                break
+            if job:
+                n, state = job
+                # Write to a temp file first, so a crash never leaves half a snapshot
+                name = os.path.join(self.directory, snapshot_name(n))
+                with open(name + '.tmp', 'wb') as f:
+                    f.write(Savegame.encode(state))
+                    f.flush()
+                    os.fsync(f.fileno())
+                os.replace(name + '.tmp', name)
+                # The first snapshot is kept as well: with all actions it is the recording of the whole game
+                old = sorted(x for x in os.listdir(self.directory) if x.endswith('.state') and x != snapshot_name(0))
+                for name in old[:-self.keep]:
+                    os.remove(os.path.join(self.directory, name))
+
+    @classmethod
+    def recover(cls, directory, config, visualiser, snapshot_interval=100, sync_interval=0.1):
+        ''' Restores the game of a journal: loads the latest snapshot which can be read and replays the actions after
+        it. A last action which was only partly written is dropped. Returns the journal, open for recording the next
+        actions, the grid and the game.'''
+        snapshots = sorted((x for x in os.listdir(directory) if x.endswith('.state')), reverse=True)
+        state = None
+        for name in snapshots:
+            try:
+                with open(os.path.join(directory, name), 'rb') as f:
+                    state = Savegame.decode(f.read())
+                break
+            except (OSError, ValueError):
+                continue
+        if state is None:
+            raise ValueError('No snapshot in journal ' + directory)
+        n = int(name[len('snapshot_'):-len('.state')])
+        grid, game = State.restore(state, config, visualiser)
+
+        actions, good = read_actions(directory)
+        for number, player, action in actions:
+            if number > n:
+                replay(game, player, action, 'Action ' + str(number) + ' of journal ' + directory)
+                n = number
+        with open(os.path.join(directory, ACTIONS), 'r+b') as f:
+            f.truncate(good)
+
+        journal = cls(directory, snapshot_interval, sync_interval)
+        journal.open(grid, game, n)
+        return journal, grid, game
+
+    @staticmethod
+    def unfinished(directory):
+        ''' Returns True if directory holds a journal of a game which has not ended.'''
+        return any(x.endswith('.state') for x in os.listdir(directory)) and \
+            not os.path.exists(os.path.join(directory, FINISHED))
+
+
+if __name__ == '__main__':
+    import io
+    import random
+    import shutil
+    import tempfile
+    import contextlib
+
+    import Headless
+
+    # Play a game with a journal, then recover it as after a crash and check it is the same game.
+    directory = tempfile.mkdtemp()
+    with contextlib.redirect_stdout(io.StringIO()):
+        grid, game = Headless.new_game(seed=1)
+        journal = Journal(os.path.join(directory, 'game'), snapshot_interval=100)
+        journal.start(grid, game)
+        rng = random.Random(1)
+        times = []
+        for i in range(1050):
+            action = rng.choice(Actions.legal_actions(game, game.current_player)) if rng.random() > 0.05 \
+                else Actions.EndTurn()
+            player = game.current_player
+            Actions.apply(game, player, action)
+            start = time.perf_counter()
+            journal.record(player, action)
+            times.append(time.perf_counter() - start)
+        journal.close()
+        start = time.perf_counter()
+        journal2, grid2, game2 = Journal.recover(os.path.join(directory, 'game'), game.config,
+                                                 Headless.HeadlessVisualiser())
+        recovered = time.perf_counter() - start
+        journal2.close(finished=True)
+        game.quit()
+    print('Recorded ' + str(journal.n) + ' actions, ' + str(round(sum(times) / len(times) * 1e6, 1)) +
+          ' us per action on average, ' + str(round(max(times) * 1000, 2)) + ' ms at most')
+    print('Recovered after ' + str(journal2.n) + ' actions in ' + str(round(recovered * 1000, 1)) + ' ms, ' +
+          ('same' if State.capture(grid, game) == State.capture(grid2, game2) else 'DIFFERENT') + ' state')
+    shutil.rmtree(directory)
@@ -0,0 +1,252 @@
+import sys
+import json
+import time
+import random
+import asyncio
+import tracemalloc
+import multiprocessing
+from collections import deque
+
+import numpy
+
+import Server
+from Metrics import metrics
+
+''' Load test for the game server (see Server). Simulated clients play random legal actions against a server over
+loopback, game after game, so the number of games and connections goes up step by step over the ramp time. The report
+tells:
+    - the round trip of the actions of the players, as percentiles per load step (the number of games running),
+    - the processor time the server takes per action, all in all and for the game code only, and to set up a game,
+    - the memory the server takes per game,
+    - the updates spectators did not get (they got a snapshot instead) or got late, and the resyncs of the players.
+      These are only known with the binary protocol, the default,
+    - the time the server takes per kind of action and its counters, see Metrics.
+
+The server runs in a process of its own, so its processor time is not mixed up with the clients'. The clients all run
+in this process and share one processor; when that is the bottleneck, the round trips go up before the server is
+loaded. Every client needs a file descriptor, so many games may need a higher limit (ulimit -n).
+
+python Loadtest.py --games 50 --ramp 20 --spectators 2 --json report.json
+'''
+
+
+def peak_memory():
+    ''' Returns the peak resident memory of this process in bytes, None where the resource module is missing.'''
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is in bytes on macOS, in kilobytes elsewhere
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+def serve(config_file, seed, trace_memory, players, max_rooms, pipe):
+    ''' Runs a game server for games of players players until it gets a message over pipe. Sends back the port it
+    listens on with the processor time and memory it took to start, and at the end the same after the load with the
+    stats of all rooms and the metrics of the server.'''
+    if trace_memory:
+        tracemalloc.start()
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    server = Server.GameServer(config_file, seed)
+    server.config.read_dict({'Players': {'n_players': str(players)}})
+    server.max_rooms = max(server.max_rooms, max_rooms)
+    loop.run_until_complete(server.start())
+    pipe.send({'port': server.port, 'cpu_time': time.process_time(), 'memory': peak_memory()})
+    loop.run_until_complete(loop.run_in_executor(None, pipe.recv))
+    cpu_time = time.process_time()
+    memory = peak_memory()
+    loop.run_until_complete(server.stop())
+    pipe.send({'cpu_time': cpu_time, 'memory': memory, 'rooms': server.stats(), 'metrics': metrics.snapshot()})
+    loop.close()
+
+
+class LoadTest:
+    '''Runs games of simulated clients against a server and collects what they measure.'''
+
+    def __init__(self, host, port, games=10, players=3, spectators=0, turns=5, ramp=10.0, binary=True, seed=None):
+        self.host = host
+        self.port = port
+        self.games = games
+        self.players = players
+        self.spectators = spectators
+        self.turns = turns
+        self.ramp = ramp
+        self.binary = binary
+        self.rng = random.Random(seed)
+        self.latencies = []                             # (time sent, round trip) of all actions
+        self.periods = []                               # (start, end) of every game
+        self.missed = 0                                 # Updates spectators did not get
+        self.late = []                                  # How long after the players the spectators got each update
+        self.resyncs = 0
+        self.errors = 0
+        self.failed = 0                                 # Games which could not be started
+
+    async def play_game(self, delay):
+        ''' Starts a game after delay seconds, plays it and collects its measurements.'''
+        await asyncio.sleep(delay)
+        start = time.perf_counter()
+        clients = []
+        try:
+            for i in range(self.players):
+                client = Server.Client('load' + str(len(self.periods)) + '.' + str(i), self.binary)
+                await client.connect(self.host, self.port, 'new' if i == 0 else clients[0].room)
+                clients.append(client)
+            watchers = []
+            for i in range(self.spectators):
+                client = Server.Client('watch' + str(i), self.binary)
+                client.arrivals = {}
+                await client.connect(self.host, self.port, clients[0].room, True)
+                client.joined = client.mirror.seq if self.binary else None
+                watchers.append(client)
+        except (ConnectionError, OSError):
+            self.failed += 1
+            for client in clients:
+                client.close()
+            return
+        for client in clients + watchers:
+            client.events = deque(maxlen=100)           # The events are not needed, only the last few are kept
+        clients[0].arrivals = {}
+        watching = [asyncio.ensure_future(Server.watch(x)) for x in watchers]
+        await asyncio.gather(*[Server.play_randomly(x, random.Random(self.rng.random()), self.turns, self.latencies)
+                               for x in clients])
+        self.periods.append((start, time.perf_counter()))
+        # Let the spectators receive the last updates before the game is left
+        await asyncio.sleep(0.2)
+        for client in clients + watchers:
+            self.resyncs += client.resyncs
+            self.errors += sum(1 for x in client.events if x['type'] == 'error')
+            client.close()
+        await asyncio.gather(*watching)
+        sent = clients[0].arrivals
+        for watcher in watchers if self.binary else []:
+            # The updates after the snapshot the spectator got when it joined, which it did not get as delta
+            for seq, arrival in sent.items():
+                if seq <= watcher.joined:
+                    continue
+                if seq in watcher.arrivals:
+                    self.late.append(watcher.arrivals[seq] - arrival)
+                else:
+                    self.missed += 1
+
+    async def run(self):
+        ''' Plays all games, starting them evenly spread over the ramp time.'''
+        start = time.perf_counter()
+        await asyncio.gather(*[self.play_game(self.ramp * i / self.games) for i in range(self.games)])
+        self.elapsed = time.perf_counter() - start
+
+    def running_games(self, at):
+        return sum(1 for start, end in self.periods if start <= at <= end)
+
+    def report(self, late_limit=0.1, server=None):
+        ''' Returns the measurements as a dict. late_limit is the delay in seconds from which a spectator update is
+        counted as late. server has the results of serve, if the server was started by the load test.'''
+        report = {'games': self.games, 'players': self.players, 'spectators': self.spectators, 'turns': self.turns,
+                  'ramp': self.ramp, 'elapsed': round(self.elapsed, 3), 'failed_games': self.failed,
+                  'round_trips': len(self.latencies), 'resyncs': self.resyncs, 'errors': self.errors,
+                  'missed_updates': self.missed,
+                  'late_updates': sum(1 for x in self.late if x > late_limit), 'late_limit': late_limit}
+        if self.latencies:
+            round_trips = numpy.array([x[1] for x in self.latencies]) * 1000
+            report['round_trip_ms'] = percentiles(round_trips)
+            # Per load step: group the actions by the number of games running when they were sent
+            running = numpy.array([self.running_games(x[0]) for x in self.latencies])
+            step = max(1, int(numpy.ceil(self.games / 5)))
+            report['round_trip_ms_by_games'] = []
+            for low in range(0, max(running) + 1, step):
+                select = (running > low) & (running <= low + step)
+                if select.any():
+                    entry = {'games': str(low + 1) + '-' + str(low + step), 'actions': int(select.sum())}
+                    entry.update(percentiles(round_trips[select]))
+                    report['round_trip_ms_by_games'].append(entry)
+        if self.late:
+            report['spectator_delay_ms'] = percentiles(numpy.array(self.late) * 1000)
+        if server is not None:
+            started, ended = server
+            rooms = ended['rooms']
+            actions = sum(x['actions'] for x in rooms)
+            report['server_actions'] = actions
+            if actions:
+                report['server_cpu_ms_per_action'] = round((ended['cpu_time'] - started['cpu_time']) / actions * 1000, 3)
+                report['game_cpu_ms_per_action'] = round(sum(x['cpu_time'] - x['setup_time'] for x in rooms) /
+                                                         actions * 1000, 3)
+            if rooms:
+                report['setup_cpu_ms_per_game'] = round(numpy.mean([x['setup_time'] for x in rooms]) * 1000, 3)
+                report['array_bytes_per_game'] = int(numpy.mean([x['arrays'] for x in rooms]))
+                if any(x['memory'] for x in rooms):
+                    report['allocated_bytes_per_game'] = int(numpy.mean([x['memory'] for x in rooms]))
+                report['bytes_sent_per_game'] = int(numpy.mean([x['bytes_sent'] for x in rooms]))
+            if started['memory'] is not None and rooms:
+                report['peak_memory_bytes_per_game'] = int((ended['memory'] - started['memory']) / len(rooms))
+            report['spectator_snapshots'] = sum(x['spectator_snapshots'] for x in rooms)
+            # The time the server took to handle each kind of action
+            report['server_action_ms'] = []
+            for name, summary in sorted(ended['metrics']['histograms'].items()):
+                if name.startswith('action_') and summary['count']:
+                    entry = {'action': name[len('action_'):-len('_seconds')], 'count': summary['count']}
+                    entry.update({x: round(summary[x] * 1000, 3) for x in ['p50', 'p99', 'max']})
+                    report['server_action_ms'].append(entry)
+            report['server_counters'] = ended['metrics']['counters']
+        return report
+
+
+def percentiles(values):
+    result = dict(zip(['p50', 'p90', 'p99'], numpy.percentile(values, [50, 90, 99]).round(3).tolist()))
+    result['max'] = round(float(values.max()), 3)
+    return result
+
+
+def print_report(report):
+    for key, value in report.items():
+        if key in ['round_trip_ms_by_games', 'server_action_ms']:
+            print(key.replace('_by_games', ' by games running') + ':')
+            for entry in value:
+                print('    ' + ', '.join(x + ' ' + str(y) for x, y in entry.items()))
+        else:
+            print(key + ': ' + str(value))
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Load test the game server with simulated clients over loopback.')
+    parser.add_argument('--games', type=int, default=10, help='number of games to play')
+    parser.add_argument('--players', type=int, default=3,
+                        help='clients playing each game; with --host it must match the players of the server')
+    parser.add_argument('--spectators', type=int, default=0, help='spectators following each game')
+    parser.add_argument('--turns', type=int, default=5, help='turns every player plays')
+    parser.add_argument('--ramp', type=float, default=10.0, help='seconds over which the games are started')
+    parser.add_argument('--json-clients', action='store_true', help='clients use json instead of the binary protocol')
+    parser.add_argument('--late', type=float, default=100, help='ms after which a spectator update counts as late')
+    parser.add_argument('--seed', type=int, help='seed for the server and the clients')
+    parser.add_argument('--config', default='Config.ini', help='config file of the server')
+    parser.add_argument('--trace-memory', action='store_true', help='let the server count the memory of every game')
+    parser.add_argument('--host', help='test a server which is already running instead of starting one')
+    parser.add_argument('--port', type=int, default=0)
+    parser.add_argument('--json', metavar='FILE', help='also write the report to a json file')
+    args = parser.parse_args()
+
+    server_results = None
+    if args.host is None:
+        pipe, server_pipe = multiprocessing.Pipe()
+        process = multiprocessing.Process(target=serve, args=(args.config, args.seed, args.trace_memory, args.players,
+                                                              args.games, server_pipe))
+        process.start()
+        started = pipe.recv()
+        host, port = '127.0.0.1', started['port']
+    else:
+        host, port = args.host, args.port
+
+    test = LoadTest(host, port, args.games, args.players, args.spectators, args.turns, args.ramp,
+                    not args.json_clients, args.seed)
+    asyncio.get_event_loop().run_until_complete(test.run())
+
+    if args.host is None:
+        pipe.send('stop')
+        server_results = (started, pipe.recv())
+        process.join()
+    results = test.report(args.late / 1000, server_results)
+    print_report(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
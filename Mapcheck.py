@@ -0,0 +1,249 @@
+import json
+
+import numpy
+
+from Hexgrid import hex_neighbours
+from Mapcompile import read_board
+
+
+def union_find(neighbours, member):
+    '''Connected components of the hexes flagged in member, only connecting neighbouring member hexes.
+
+    This is union-find done on whole arrays: every round each edge hooks the root with the higher index onto the root
+    with the lower index, then the parent pointers are compressed by pointer jumping until every hex points at its
+    root. Only a handful of rounds are needed, each one linear in the number of hexes. Returns the root (lowest hex
+    index) of the component of each hex, -1 for hexes outside member.'''
+    n = len(member)
+    member_pad = numpy.append(member, False)
+    # All edges between member hexes. Only the east, south-west and south-east directions, the other three are the
+    # same edges the other way round.
+    u = numpy.repeat(numpy.arange(n), 3)
+    v = neighbours[:, [0, 4, 5]].ravel()
+    keep = member_pad[u] & member_pad[v]
+    u = u[keep]
+    v = v[keep]
+
+    parent = numpy.arange(n)
+    while True:
+        root_u = parent[u]
+        root_v = parent[v]
+        low = numpy.minimum(root_u, root_v)
+        high = numpy.maximum(root_u, root_v)
+        hook = low != high
+        if not hook.any():
+            break
+        numpy.minimum.at(parent, high[hook], low[hook])
+        # Pointer jumping until every hex points directly at its root
+        while True:
+            grandparent = parent[parent]
+            if (grandparent == parent).all():
+                break
+            parent = grandparent
+    return numpy.where(member, parent, -1)
+
+
+def bfs(neighbours, member, sources):
+    '''Hop distance from the nearest of the source hexes to every hex, only stepping over member hexes. The sources
+    themselves don't need to be members. Returns -1 for hexes which can't be reached.'''
+    dist = numpy.full(len(member), -1)
+    frontier = numpy.unique(numpy.asarray(sources, dtype=int))
+    dist[frontier] = 0
+    step = 0
+    while len(frontier):
+        step += 1
+        nxt = neighbours[frontier].ravel()
+        nxt = nxt[nxt >= 0]
+        nxt = numpy.unique(nxt[member[nxt] & (dist[nxt] < 0)])
+        dist[nxt] = step
+        frontier = nxt
+    return dist
+
+
+def coast(neighbours, member, hexes):
+    '''Returns the member hexes next to any of the given hexes.'''
+    around = neighbours[numpy.asarray(hexes, dtype=int)].ravel()
+    around = around[around >= 0]
+    return numpy.unique(around[member[around]])
+
+
+def check_map(tiles, objects, owners, size_x, size_y):
+    '''Analyses a board: which land and water regions there are and whether every player's start positions are
+    connected. Returns a dict with the findings; 'problems' lists everything that makes the board unplayable.
+
+    Per player it checks that the pawns can walk to the harbour, that the boats can sail to the harbour and to the
+    home town, and how far apart all of these are. 'random' tiles may become land or water, so they count as
+    neither: a connection is only reported if it exists whatever is drawn for them. 'land' tiles always become land.
+
+    Everything is linear in the number of hexes, so thousands of boards can be checked in one go.'''
+    neighbours = hex_neighbours(size_x, size_y)
+    tiles = numpy.asarray(tiles)
+    land = ~numpy.in1d(tiles, ['water', 'home', 'random'])
+    water = tiles == 'water'
+    land_components = union_find(neighbours, land)
+    water_components = union_find(neighbours, water)
+    problems = []
+    result = {'hexes': len(tiles),
+              'land_hexes': int(land.sum()),
+              'water_hexes': int(water.sum()),
+              'random_hexes': int((tiles == 'random').sum()),
+              'land_regions': len(numpy.unique(land_components[land])),
+              'water_regions': len(numpy.unique(water_components[water])),
+              'players': {},
+              'problems': problems}
+
+    # Collect the start positions of all players in one pass over the board.
+    start_positions = {}
+    for index, (kind, player) in enumerate(zip(objects, owners)):
+        if kind:
+            start_positions.setdefault(player, {'harbour': [], 'pawn': [], 'boat': [], 'home': []})
+            start_positions[player].setdefault(kind, []).append(index)
+    players = sorted(start_positions)
+    sailable = numpy.zeros(len(tiles), dtype=bool)      # Water which at least one boat can reach
+    walkable = numpy.zeros(len(tiles), dtype=bool)      # Land which at least one pawn can reach
+    for player in players:
+        pieces = start_positions[player]
+        report = {kind: pieces[kind] for kind in pieces}
+        result['players'][player] = report
+        for kind in ['harbour', 'home']:
+            if len(pieces[kind]) != 1:
+                problems.append(player + ' has ' + str(len(pieces[kind])) + ' ' + kind + 's instead of 1')
+        for index in pieces['pawn']:
+            if not land[index]:
+                problems.append(player + ' pawn on hex ' + str(index) + ' is not on land')
+        for index in pieces['boat']:
+            if not water[index]:
+                problems.append(player + ' boat on hex ' + str(index) + ' is not on water')
+
+        # Pawns walk over land, only their own region counts.
+        pawns = [i for i in pieces['pawn'] if land[i]]
+        boats = [i for i in pieces['boat'] if water[i]]
+        if pawns:
+            from_pawns = bfs(neighbours, land, pawns)
+            walkable |= from_pawns >= 0
+        if boats:
+            from_boats = bfs(neighbours, water, boats)
+            sailable |= from_boats >= 0
+
+        if pieces['harbour']:
+            harbour = pieces['harbour'][0]
+            harbour_land = bfs(neighbours, land, [harbour])
+            report['pawn_to_harbour'] = [int(harbour_land[i]) for i in pawns]
+            for i, d in zip(pawns, report['pawn_to_harbour']):
+                if d < 0:
+                    problems.append(player + ' pawn on hex ' + str(i) + ' cannot walk to the harbour')
+            ''' Boats load resources from the harbour when they are next to it, so the distance is to the nearest
+            water hex next to the harbour.'''
+            harbour_water = coast(neighbours, water, [harbour])
+            if len(harbour_water) == 0:
+                problems.append(player + ' harbour on hex ' + str(harbour) + ' has no water next to it')
+            else:
+                from_harbour = bfs(neighbours, water, harbour_water)
+                report['boat_to_harbour'] = [int(from_harbour[i]) for i in boats]
+                for i, d in zip(boats, report['boat_to_harbour']):
+                    if d < 0:
+                        problems.append(player + ' boat on hex ' + str(i) + ' cannot sail to the harbour')
+                if pieces['home']:
+                    home_water = coast(neighbours, water, pieces['home'])
+                    route = from_harbour[home_water] if len(home_water) else numpy.array([-1])
+                    route = route[route >= 0]
+                    report['harbour_to_home'] = int(route.min()) if len(route) else -1
+                    if report['harbour_to_home'] < 0:
+                        problems.append(player + ' cannot ship resources from the harbour to the home town')
+        if pieces['home'] and boats:
+            home_water = coast(neighbours, water, pieces['home'])
+            to_home = bfs(neighbours, water, home_water) if len(home_water) else numpy.full(len(tiles), -1)
+            report['boat_to_home'] = [int(to_home[i]) for i in boats]
+
+    ''' Pawns can also walk on land next to water their boats can reach, so land regions touching sailable water count
+    as reachable too. Regions which nobody can get to are flagged.'''
+    if players:
+        sailable_coast = coast(neighbours, land, numpy.flatnonzero(sailable)) if sailable.any() else []
+        reachable_land = numpy.unique(land_components[numpy.flatnonzero(walkable)])
+        reachable_land = numpy.union1d(reachable_land, land_components[sailable_coast])
+        land_sizes = numpy.bincount(land_components[land], minlength=len(tiles))
+        water_sizes = numpy.bincount(water_components[water], minlength=len(tiles))
+        unreachable = numpy.setdiff1d(numpy.flatnonzero(land_sizes), reachable_land)
+        result['unreachable_land_regions'] = [{'region': int(x), 'size': int(land_sizes[x])} for x in unreachable]
+        unsailable = numpy.flatnonzero((water_sizes > 0) & ~sailable)
+        result['unreachable_water_regions'] = [{'region': int(x), 'size': int(water_sizes[x])} for x in unsailable]
+        if len(unreachable):
+            problems.append(str(len(unreachable)) + ' land regions cannot be reached by any player')
+
+    return result
+
+
+def check_board(board_file, size_x, size_y):
+    '''Runs check_map on a board file.'''
+    tiles, objects, owners = read_board(board_file, size_x * size_y)
+    result = check_map(tiles, objects, owners, size_x, size_y)
+    result['board'] = board_file
+    return result
+
+
+def report(result):
+    '''Returns the result of check_map as readable text.'''
+    lines = [result.get('board', 'Board') + ': ' + str(result['hexes']) + ' hexes, ' +
+             str(result['land_regions']) + ' land regions (' + str(result['land_hexes']) + ' hexes), ' +
+             str(result['water_regions']) + ' water regions (' + str(result['water_hexes']) + ' hexes), ' +
+             str(result['random_hexes']) + ' random hexes']
+    for player, info in sorted(result['players'].items()):
+        line = '  ' + player + ': ' + str(len(info['pawn'])) + ' pawns, ' + str(len(info['boat'])) + ' boats'
+        for key in ['pawn_to_harbour', 'boat_to_harbour', 'boat_to_home', 'harbour_to_home']:
+            if key in info:
+                line += ', ' + key.replace('_', ' ') + ' ' + str(info[key])
+        lines.append(line)
+    for region in result.get('unreachable_land_regions', []):
+        lines.append('  land region at hex ' + str(region['region']) + ' (' + str(region['size']) +
+                     ' hexes) cannot be reached')
+    for region in result.get('unreachable_water_regions', []):
+        lines.append('  water region at hex ' + str(region['region']) + ' (' + str(region['size']) +
+                     ' hexes) has no boat in it')
+    for problem in result['problems']:
+        lines.append('  PROBLEM: ' + problem)
+    if not result['problems']:
+        lines.append('  OK')
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    import argparse
+    import configparser
+    import sys
+    import time
+
+    parser = argparse.ArgumentParser(description='Check boards for unreachable start positions and regions.')
+    parser.add_argument('boards', nargs='*', help='board files, default is the board in Config.ini')
+    parser.add_argument('--size', type=int, nargs=2, metavar=('X', 'Y'), help='board size, default from Config.ini')
+    parser.add_argument('--generate', type=int, default=0, metavar='N', help='check N boards made by Mapgen instead')
+    parser.add_argument('--players', type=int, default=3, help='players to place on generated boards')
+    parser.add_argument('--json', action='store_true', help='print the results as json')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('Config.ini')
+    size = args.size or [config.getint('Grid', 'hexes_x'), config.getint('Grid', 'hexes_y')]
+
+    start = time.perf_counter()
+    results = []
+    if args.generate:
+        from Mapgen import IslandGenerator
+        for seed in range(args.generate):
+            generator = IslandGenerator(size[0], size[1], seed=seed)
+            generator.generate(n_players=args.players)
+            result = check_map(generator.tiles, generator.objects, generator.owners, size[0], size[1])
+            result['board'] = 'generated seed ' + str(seed)
+            results.append(result)
+    else:
+        for board in args.boards or [config.get('Game', 'board')]:
+            results.append(check_board(board, size[0], size[1]))
+    elapsed = time.perf_counter() - start
+
+    if args.json:
+        print(json.dumps(results, indent=1))
+    else:
+        for result in results:
+            print(report(result))
+        failed = len([x for x in results if x['problems']])
+        print(str(len(results)) + ' boards checked in ' + str(round(elapsed, 3)) + ' s, ' + str(failed) +
+              ' with problems')
+    sys.exit(1 if any(x['problems'] for x in results) else 0)
@@ -0,0 +1,193 @@
+import csv
+import hashlib
+import io
+import contextlib
+
+import numpy
+
+from Hexgrid import Hexgrid, hex_neighbours
+
+FORMAT_VERSION = 1
+
+
+def sidecar_name(board_file):
+    '''Returns the file name of the compiled map belonging to a board file.'''
+    return board_file + '.compiled.npz'
+
+
+def board_hash(board_file, size_x, size_y):
+    '''Hash identifying the board file contents and the grid size it is played on. A compiled map is only used when its
+    hash matches the board it is loaded for.'''
+    with open(board_file, 'rb') as f:
+        contents = f.read()
+    return hashlib.sha256(contents + (' ' + str(size_x) + 'x' + str(size_y)).encode()).hexdigest()
+
+
+def read_board(board_file, n_hexes):
+    '''Reads a board file in the same way as Grid.load_map. Returns lists with the tile type and the object type and
+    owner of the player piece (empty if none) for each hex.'''
+    tiles = [''] * n_hexes
+    objects = [''] * n_hexes
+    owners = [''] * n_hexes
+    with open(board_file, encoding='utf-8') as f:
+        reader = csv.reader(f, delimiter=',')
+        next(reader, 'none')
+        for row, index in zip(reader, range(0, n_hexes)):
+            tiles[index] = row[1]
+            if row[2]:
+                objects[index] = row[2]
+                owners[index] = row[3]
+    return tiles, objects, owners
+
+
+def bfs_distances(neighbours, member):
+    '''All-pairs hop distances between the hexes flagged in member, only stepping over member hexes. Returns an
+    int16 matrix with -1 for unreachable pairs and for hexes outside member. All sources are expanded together, one
+    step per iteration, using the neighbour table.'''
+    n = len(member)
+    dist = numpy.full((n, n), -1, dtype=numpy.int16)
+    sources = numpy.flatnonzero(member)
+    reach = numpy.zeros((n, n + 1), dtype=bool)     # Extra column is the off-board hex at index -1
+    reach[sources, sources] = True
+    dist[sources, sources] = 0
+    step = 0
+    member_pad = numpy.append(member, False)
+    while True:
+        step += 1
+        grown = reach[:, :-1].copy()
+        for direction in range(6):
+            grown |= reach[:, neighbours[:, direction]]
+        grown &= member_pad[:-1]
+        grown[~member] = False
+        new = grown & ~reach[:, :-1]
+        if not new.any():
+            break
+        dist[new] = step
+        reach[:, :-1] |= new
+    return dist
+
+
+def compile_map(board_file, size_x, size_y, hex_size=None, max_dist=7):
+    '''Precomputes everything about a board that does not change between games and saves it next to the board file.
+
+    Saved are the neighbour table, the all/land/water k-step connectivity matrices up to max_dist exactly as
+    Hexgrid.get_connections would calculate them, all-pairs distance tables and connected components per terrain
+    type and, if hex_size is given, the pixel centres of the hexes.
+
+    Only boards without 'random' tiles can be compiled. 'land' tiles are fine: whatever land type gets drawn for them,
+    the land and water connectivity stays the same.'''
+    print('Compiling map ' + board_file)
+    with contextlib.redirect_stdout(io.StringIO()):     # get_connections is rather chatty
+        grid = Hexgrid(size_x, size_y)
+    grid.tiles = read_board(board_file, grid.n_hexes)[0]
+    if 'random' in grid.tiles:
+        raise ValueError('Board ' + board_file + ' has random tiles, its connectivity differs per game')
+    grid.set_land_connectivity()
+    grid.set_water_connectivity()
+
+    arrays = {}
+    with contextlib.redirect_stdout(io.StringIO()):
+        for terrain in ['all', 'land', 'water']:
+            grid.get_connections([0], terrain + '_conn', max_dist)
+            for dist in range(1, max_dist + 1):
+                name = terrain + '_conn_' + str(dist)
+                # Only whether an entry is larger than zero matters, so store the matrices as bits.
+                arrays[name] = numpy.packbits(getattr(grid, name) > 0, axis=1)
+
+    neighbours = hex_neighbours(size_x, size_y)
+    tiles = numpy.array(grid.tiles)
+    members = {'all': numpy.ones(grid.n_hexes, dtype=bool),
+               'land': ~numpy.in1d(tiles, ['water', 'home']),
+               'water': tiles == 'water'}
+    for terrain, member in members.items():
+        dist = bfs_distances(neighbours, member)
+        arrays[terrain + '_dist'] = dist
+        # Label each hex with the lowest index in its component, -1 if the hex is not of this terrain type.
+        arrays[terrain + '_components'] = numpy.where(member, (dist >= 0).argmax(1), -1)
+
+    arrays['neighbours'] = neighbours
+    if hex_size:
+        arrays['x_pix'] = (grid.x_coords + 1) * hex_size / 2
+        arrays['y_pix'] = (grid.y_coords * 0.75 + 1) * hex_size / 2
+        arrays['hex_size'] = numpy.array(hex_size)
+    arrays['max_dist'] = numpy.array(max_dist)
+    arrays['version'] = numpy.array(FORMAT_VERSION)
+    arrays['hash'] = numpy.array(board_hash(board_file, size_x, size_y))
+
+    numpy.savez_compressed(sidecar_name(board_file), **arrays)
+    print('Compiled map written to ' + sidecar_name(board_file))
+
+
+class CompiledMap:
+    '''Read-only view on a compiled map file. Connectivity matrices are only unpacked when they are first asked for
+    and are then kept, so all grids using the same compiled map share the same (read-only) arrays.'''
+
+    def __init__(self, file_name):
+        self.file_name = file_name
+        with numpy.load(file_name) as data:
+            self.arrays = {key: data[key] for key in data.files}
+        self.hash = str(self.arrays['hash'])
+        self.version = int(self.arrays['version'])
+        self.max_dist = int(self.arrays['max_dist'])
+        self.neighbours = self.arrays['neighbours']
+        self.hex_size = int(self.arrays['hex_size']) if 'hex_size' in self.arrays else None
+        self.unpacked = {}
+
+    def get(self, name):
+        '''Returns connectivity matrix name (e.g. land_conn_3) in the format used by Hexgrid, or None if it was not
+        compiled.'''
+        if name not in self.unpacked:
+            if name not in self.arrays:
+                return None
+            packed = self.arrays[name]
+            matrix = numpy.unpackbits(packed, axis=1)[:, :packed.shape[0]].astype(float)
+            matrix.flags.writeable = False
+            self.unpacked[name] = matrix
+        return self.unpacked[name]
+
+    def distances(self, terrain):
+        return self.arrays[terrain + '_dist']
+
+    def components(self, terrain):
+        return self.arrays[terrain + '_components']
+
+    def pixel_centres(self, hex_size):
+        '''Returns the x and y pixel coordinates of the hex centres, or None if they were compiled for another size.'''
+        if self.hex_size != hex_size:
+            return None
+        return self.arrays['x_pix'], self.arrays['y_pix']
+
+
+compiled_maps = {}  # Compiled maps which are already loaded, by file name
+
+
+def load_compiled(board_file, size_x, size_y):
+    '''Returns the CompiledMap for board_file if a sidecar exists and matches the board, otherwise None.'''
+    file_name = sidecar_name(board_file)
+    expected = board_hash(board_file, size_x, size_y)
+    compiled = compiled_maps.get(file_name)
+    if compiled is None or compiled.hash != expected:
+        try:
+            compiled = CompiledMap(file_name)
+        except (OSError, KeyError, ValueError):
+            return None
+        compiled_maps[file_name] = compiled
+    if compiled.hash != expected or compiled.version != FORMAT_VERSION:
+        print('Compiled map ' + file_name + ' is out of date, ignoring it')
+        return None
+    return compiled
+
+
+if __name__ == '__main__':
+    import argparse
+    import configparser
+
+    parser = argparse.ArgumentParser(description='Precompute the connectivity of the board used in a config file.')
+    parser.add_argument('config', nargs='?', default='Config.ini')
+    parser.add_argument('--max-dist', type=int, default=7, help='number of k-step connectivity matrices to store')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    compile_map(config.get('Game', 'board'), config.getint('Grid', 'hexes_x'), config.getint('Grid', 'hexes_y'),
+                config.getint('Visualiser', 'hex_size'), args.max_dist)
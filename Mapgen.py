@@ -0,0 +1,260 @@
+import csv
+import configparser
+from collections import deque
+
+import numpy
+
+from Hexgrid import hex_neighbours
+from Mapcheck import union_find
+
+
+class IslandGenerator:
+    '''Procedural map generator for boards of any size.
+
+    Islands are grown simultaneously from random seed hexes. Every round each coastal hex of an island that is still
+    below its target size claims some of its water neighbours. Everything is done on whole arrays at once with the
+    neighbour table from Hexgrid, so there is no dense connectivity matrix and no per-tile Python loop. Islands are kept
+    at least one water hex apart and the edge of the board is water, so the sea around them is connected. Lakes can be
+    enclosed by an island though, so harbours, home towns and boats are only placed on the open sea.
+
+    The result is written in the same csv format that Grid.load_map reads. All randomness comes from one RandomState,
+    so the same seed and settings always give the same board.
+    '''
+
+    def __init__(self, size_x, size_y, tile_file='Land.ini', seed=None):
+        self.size_x = size_x
+        self.size_y = size_y
+        self.n_hexes = size_x * size_y
+        self.neighbours = hex_neighbours(size_x, size_y)
+        self.random = numpy.random.RandomState(seed)
+
+        ''' The land types and their relative frequency are taken from the tile file. Water is handled separately
+        through the land ratio.'''
+        config = configparser.ConfigParser()
+        config.read(tile_file)
+        self.land_types = [x for x in config.sections() if x != 'water']
+        weights = numpy.array([config.getint(x, 'copies') for x in self.land_types], dtype=float)
+        self.land_weights = weights / weights.sum()
+
+        self.tiles = numpy.array(['water'] * self.n_hexes, dtype=object)
+        self.objects = [''] * self.n_hexes
+        self.owners = [''] * self.n_hexes
+
+    def generate(self, n_islands=4, land_ratio=0.35, home_island=True, n_players=0, growth=0.5):
+        '''Fills self.tiles with n_islands islands which together cover land_ratio of the board. If home_island is set,
+        the smallest island with room for a home town of every player is made of home tiles (the white destination
+        island). If n_players > 0, start positions are placed for each player as in the hand-made boards: a harbour
+        with five pawns and two boats on the biggest island and a home town on the home island.'''
+        labels = self.grow_islands(n_islands, land_ratio, growth)
+        sizes = numpy.bincount(labels[labels >= 0], minlength=n_islands)
+        islands = [i for i in numpy.argsort(-sizes) if sizes[i] > 0]
+
+        ''' Draw a land type for every land hex, then let each hex copy a random land neighbour a couple of times. This
+        turns the salt-and-pepper pattern into patches of the same landscape.'''
+        land = numpy.flatnonzero(labels >= 0)
+        types = numpy.full(self.n_hexes, -1)
+        types[land] = self.random.choice(len(self.land_types), len(land), p=self.land_weights)
+        types_pad = numpy.append(types, -1)
+        for i in range(2):
+            pick = self.neighbours[land, self.random.randint(0, 6, len(land))]
+            copy = (types_pad[pick] >= 0) & (self.random.random_sample(len(land)) < 0.5)
+            types[land[copy]] = types_pad[pick[copy]]
+            types_pad[:-1] = types
+        self.tiles[land] = numpy.array(self.land_types, dtype=object)[types[land]]
+
+        ''' The open sea is the water region which touches the edge of the board, which is always water. A lake inside
+        an island is not connected to the other islands, so towns and boats are only placed next to the sea.'''
+        water = union_find(self.neighbours, self.tiles == 'water')
+        sea = water == water[0]
+
+        home = None
+        if home_island and len(islands) > 1:
+            # The smallest island with room on its sea coast for the home towns of all players
+            sea_pad = numpy.append(sea, False)
+            coast = (labels >= 0) & sea_pad[self.neighbours].any(1)
+            room = numpy.bincount(labels[coast], minlength=n_islands)
+            home = ([x for x in islands[1:] if room[x] >= n_players] or islands[-1:])[-1]
+            islands.remove(home)
+            self.tiles[labels == home] = 'home'
+
+        if n_players > 0 and islands:
+            self.place_players(n_players, labels, islands[0], home, sea)
+
+        print('Generated ' + str(len(land)) + ' land hexes on ' + str(len(sizes[sizes > 0])) + ' islands')
+        return self.tiles
+
+    def grow_islands(self, n_islands, land_ratio, growth):
+        '''Returns an array with the island number of every hex, -1 for water.'''
+        labels = numpy.full(self.n_hexes, -1)
+
+        ''' Hexes on the edge of the board never become land, so every island has water all around it.'''
+        inner = numpy.flatnonzero((self.neighbours >= 0).all(1))
+        n_land = min(int(land_ratio * self.n_hexes), len(inner))
+        seeds = self.random.choice(inner, n_islands, replace=False)
+        labels[seeds] = numpy.arange(n_islands)
+
+        # Give each island a somewhat different target size
+        shares = self.random.uniform(0.5, 1.5, n_islands)
+        targets = numpy.floor(shares / shares.sum() * n_land).astype(int)
+        targets = numpy.maximum(targets, 1)
+        counts = numpy.ones(n_islands, dtype=int)
+
+        is_inner = numpy.zeros(self.n_hexes + 1, dtype=bool)
+        is_inner[inner] = True
+        labels_pad = numpy.append(labels, -1)   # Index -1 in the neighbour table points at the padded water entry
+        coast = seeds
+        stuck = 0
+        while (counts < targets).any() and stuck < 3:
+            # Only coastal hexes of islands which still need to grow propose new land.
+            coast = coast[counts[labels[coast]] < targets[labels[coast]]]
+            proposed = self.neighbours[coast]
+            owner = numpy.repeat(labels[coast], 6)
+            proposed = proposed.ravel()
+            keep = is_inner[proposed] & (labels_pad[proposed] == -1) & (self.random.random_sample(len(proposed)) < growth)
+            proposed = proposed[keep]
+            owner = owner[keep]
+
+            ''' A water hex that touches another island cannot be claimed, otherwise the islands would merge.'''
+            around = labels_pad[self.neighbours[proposed]]
+            keep = ((around == -1) | (around == owner[:, None])).all(1)
+            proposed, first = numpy.unique(proposed[keep], return_index=True)
+            owner = owner[keep][first]
+
+            ''' Don't overshoot the target size: order the claims per island randomly and only keep as many as the
+            island still needs.'''
+            order = numpy.lexsort((self.random.random_sample(len(proposed)), owner))
+            proposed = proposed[order]
+            owner = owner[order]
+            group_start = numpy.searchsorted(owner, owner)
+            rank = numpy.arange(len(owner)) - group_start
+            keep = rank < (targets - counts)[owner]
+            proposed = proposed[keep]
+            owner = owner[keep]
+
+            labels[proposed] = owner
+            labels_pad[proposed] = owner
+            ''' Two islands can still claim neighbouring hexes in the same round. Give those hexes back to the sea.'''
+            around = labels_pad[self.neighbours[proposed]]
+            clash = ((around != -1) & (around != owner[:, None])).any(1)
+            labels[proposed[clash]] = -1
+            labels_pad[proposed[clash]] = -1
+            proposed = proposed[~clash]
+            owner = owner[~clash]
+
+            counts += numpy.bincount(owner, minlength=n_islands)
+            stuck = stuck + 1 if len(proposed) == 0 else 0
+
+            # The new coast is every island hex that still has a water neighbour.
+            land = numpy.flatnonzero(labels >= 0)
+            coast = land[(labels_pad[self.neighbours[land]] == -1).any(1)]
+
+        return labels
+
+    def place_players(self, n_players, labels, main_island, home_island, sea):
+        '''Places the start positions of n_players players. Harbours are spread around the coast of the main island,
+        each with five pawns on the nearest free land and two boats on the nearest free water. Home towns are spread
+        around the coast of the home island. Only hexes next to the sea hexes count as coast.'''
+        harbours = self.spread_along_coast(labels == main_island, n_players, sea)
+        homes = []
+        if home_island is not None:
+            homes = self.spread_along_coast(labels == home_island, n_players, sea)
+        for player in range(n_players):
+            owner = 'player' + str(player + 1)
+            if player < len(harbours):
+                self.put(harbours[player], 'harbour', owner)
+                # Pawns have to be able to walk to the harbour, so only search the main island for them.
+                on_island = lambda x: labels[x] == main_island
+                for index in self.nearest_free(harbours[player], on_island, 5, on_island):
+                    self.put(index, 'pawn', owner)
+                # Boats have to be able to sail to the harbour, so only search the sea next to it for them.
+                on_sea = lambda x: sea[x]
+                for index in self.nearest_free(harbours[player], on_sea, 2, on_sea):
+                    self.put(index, 'boat', owner)
+            if player < len(homes):
+                self.put(homes[player], 'home', owner)
+
+    def spread_along_coast(self, island, n, water):
+        '''Returns n free hexes of island next to the water hexes, evenly spread by angle around the island centre.'''
+        water_pad = numpy.append(water, False)
+        coast = numpy.flatnonzero(island & water_pad[self.neighbours].any(1))
+        coast = numpy.array([x for x in coast if not self.objects[x]], dtype=int)
+        if len(coast) == 0:
+            return []
+        row = coast // self.size_x
+        col = coast % self.size_x
+        angle = numpy.arctan2(row - row.mean(), col - col.mean())
+        coast = coast[numpy.argsort(angle)]
+        return [coast[int(i * len(coast) / n)] for i in range(min(n, len(coast)))]
+
+    def nearest_free(self, start, allowed, n, passable=None):
+        '''Breadth first search from start for the n nearest hexes without an object for which allowed(index) holds.
+        The search only passes through hexes for which passable(index) holds, by default any hex.'''
+        found = []
+        seen = {start}
+        queue = deque([start])
+        while queue and len(found) < n:
+            index = queue.popleft()
+            if index != start and not self.objects[index] and allowed(index):
+                found.append(index)
+            for neighbour in self.neighbours[index]:
+                if neighbour >= 0 and neighbour not in seen and (passable is None or passable(neighbour)):
+                    seen.add(neighbour)
+                    queue.append(neighbour)
+        return found
+
+    def put(self, index, object, owner):
+        self.objects[index] = object
+        self.owners[index] = owner
+
+    def write_board(self, file_name):
+        '''Writes the board in the csv format read by Grid.load_map.'''
+        with open(file_name, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f, delimiter=',')
+            writer.writerow(['index', 'tile', 'object', 'owner'])
+            writer.writerows(zip(range(self.n_hexes), self.tiles, self.objects, self.owners))
+        print('Board written to ' + file_name + '. Set hexes_x = ' + str(self.size_x) + ' and hexes_y = ' +
+              str(self.size_y) + ' in the [Grid] section of the config to play it.')
+
+
+if __name__ == '__main__':
+    import argparse
+    import contextlib
+    import io
+    import time
+
+    parser = argparse.ArgumentParser(description='Generate a random island board in the load_map csv format.')
+    parser.add_argument('size_x', type=int)
+    parser.add_argument('size_y', type=int)
+    parser.add_argument('output', nargs='?', help='board file to write, not needed with --check')
+    parser.add_argument('--islands', type=int, default=4)
+    parser.add_argument('--land', type=float, default=0.35, help='fraction of the board covered by land')
+    parser.add_argument('--players', type=int, default=0, help='number of players to place start positions for')
+    parser.add_argument('--no-home', action='store_true', help="don't turn the smallest island into the home island")
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--tiles', default='Land.ini')
+    parser.add_argument('--check', type=int, default=0, metavar='N',
+                        help='generate the boards of seeds 0 to N-1 (for 3 players unless --players is given) and '
+                             'check that Mapcheck finds no problems on any of them, instead of writing a board')
+    args = parser.parse_args()
+
+    if args.check:
+        from Mapcheck import check_map, report
+
+        start = time.perf_counter()
+        for seed in range(args.check):
+            generator = IslandGenerator(args.size_x, args.size_y, args.tiles, seed)
+            with contextlib.redirect_stdout(io.StringIO()):
+                generator.generate(args.islands, args.land, not args.no_home, args.players or 3)
+            result = check_map(generator.tiles, generator.objects, generator.owners, args.size_x, args.size_y)
+            result['board'] = 'generated seed ' + str(seed)
+            assert not result['problems'], report(result)
+        print(str(args.check) + ' generated boards checked in ' + str(round(time.perf_counter() - start, 3)) +
+              ' s, no problems')
+    elif args.output is None:
+        parser.error('the output file is needed unless --check is given')
+    else:
+        start = time.perf_counter()
+        generator = IslandGenerator(args.size_x, args.size_y, args.tiles, args.seed)
+        generator.generate(args.islands, args.land, not args.no_home, args.players)
+        print('Generation took ' + str(round(time.perf_counter() - start, 3)) + ' s')
+        generator.write_board(args.output)
@@ -0,0 +1,217 @@
+import os
+import json
+import math
+import time
+import asyncio
+from collections import defaultdict
+
+''' Counters, gauges and latency histograms of a running server, cheap enough to be always on. The code that is
+measured counts and records into the metrics object of this module; what is recorded is only summed up when it is
+looked at:
+    - over http: serve answers GET /metrics with the metrics as text, one "name value" line each, and /metrics.json
+      with them as json,
+    - in a file: dump_every writes them every interval seconds, as json if the file name ends in .json, else as text.
+
+Histograms keep their values in buckets like HdrHistogram does, so recording a value costs the same however many have
+been recorded and the percentiles come out within a set relative error. Gauges are functions, called when the
+metrics are looked at, e.g. the length of a queue.
+
+Everything runs in the thread of the event loop of the server, so nothing is locked. Like Timing, this module only
+uses the standard library. The game core does not import it: the server counts what the grids of its rooms report, see
+Server.Room.count_connections.'''
+
+QUANTILES = [50, 90, 99, 99.9]
+
+''' The kinds of actions, for the latency histograms. Clicks are told apart by what they did, see action_kind.'''
+ACTION_KINDS = {'EndTurn': 'end_turn', 'ShiftResources': 'shift', 'SelectFuel': 'fuel', 'FulfillAssignment': 'fulfil',
+                'StealResource': 'steal'}
+
+
+class Histogram:
+    '''Histogram of values from lowest to highest (seconds by default). The buckets double in width every
+    sub_buckets buckets, so every value is kept with a relative error of at most 1 / sub_buckets. Values below lowest
+    count in the first bucket, values above highest in the last; min, max and the mean are exact.'''
+
+    def __init__(self, lowest=1e-6, highest=100.0, sub_buckets=16):
+        self.lowest = lowest
+        self.sub_buckets = sub_buckets
+        self.counts = [0] * ((int(math.log2(highest / lowest)) + 1) * sub_buckets)
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def bucket(self, value):
+        if value < self.lowest:
+            return 0
+        # value / lowest = mantissa * 2 ** exponent with 0.5 <= mantissa < 1: the power of two and the position in it
+        mantissa, exponent = math.frexp(value / self.lowest)
+        return min((exponent - 1) * self.sub_buckets + int((mantissa - 0.5) * 2 * self.sub_buckets),
+                   len(self.counts) - 1)
+
+    def limit(self, bucket):
+        ''' Returns the upper limit of the values in bucket.'''
+        exponent, position = divmod(bucket, self.sub_buckets)
+        return self.lowest * 2 ** exponent * (1 + (position + 1) / self.sub_buckets)
+
+    def percentile(self, q):
+        ''' Returns the value below which q percent of the values are, None if nothing was recorded.'''
+        if not self.count:
+            return None
+        rank = max(1, math.ceil(self.count * q / 100))
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return min(max(self.limit(bucket), self.min), self.max)
+
+    def record(self, value):
+        self.count += 1
+        self.total += value
+        if value < self.min:
+            self.min = value
+        if value > self.max:
+            self.max = value
+        self.counts[self.bucket(value)] += 1
+
+    def summary(self):
+        ''' Returns the count, mean, min, max and the QUANTILES as a dict.'''
+        summary = {'count': self.count}
+        if self.count:
+            summary.update({'mean': self.total / self.count, 'min': self.min, 'max': self.max})
+            summary.update({'p' + str(q).replace('.', '_'): self.percentile(q) for q in QUANTILES})
+        return summary
+
+
+class Metrics:
+    '''The counters, gauges and histograms of one process, by name.'''
+
+    def __init__(self):
+        self.counters = defaultdict(int)
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def gauge(self, name, function):
+        ''' Adds a gauge: function is called for its value whenever the metrics are looked at.'''
+        self.gauges[name] = function
+
+    def observe(self, name, value):
+        ''' Records a value, e.g. a latency in seconds, in histogram name.'''
+        if name not in self.histograms:
+            self.histograms[name] = Histogram()
+        self.histograms[name].record(value)
+
+    def reset(self):
+        self.counters.clear()
+        self.histograms.clear()
+        self.started = time.time()
+
+    def snapshot(self):
+        ''' Returns all metrics as a dict: the counters, the current values of the gauges and the summaries of the
+        histograms.'''
+        return {'uptime': time.time() - self.started,
+                'counters': dict(self.counters),
+                'gauges': {name: function() for name, function in self.gauges.items()},
+                'histograms': {name: x.summary() for name, x in self.histograms.items()}}
+
+    def text(self):
+        ''' Returns all metrics as text, one "name value" line each, sorted by name. A histogram gives a line per
+        statistic: name_count, name_mean, name_p99 and so on.'''
+        snapshot = self.snapshot()
+        lines = ['uptime ' + str(round(snapshot['uptime'], 3))]
+        values = dict(snapshot['counters'])
+        values.update(snapshot['gauges'])
+        for name, summary in snapshot['histograms'].items():
+            values.update({name + '_' + key: value for key, value in summary.items()})
+        for name in sorted(values):
+            value = values[name]
+            lines.append(name + ' ' + (repr(round(value, 9)) if isinstance(value, float) else str(value)))
+        return '\n'.join(lines) + '\n'
+
+    def write(self, file_name):
+        ''' Writes the metrics to file_name, as json if it ends in .json and as text otherwise. The file is replaced
+        at once, so a reader never sees half of it.'''
+        with open(file_name + '.tmp', 'w') as f:
+            if file_name.endswith('.json'):
+                json.dump(self.snapshot(), f, indent=1)
+            else:
+                f.write(self.text())
+        os.replace(file_name + '.tmp', file_name)
+
+    async def dump_every(self, file_name, interval):
+        ''' Writes the metrics to file_name every interval seconds, until cancelled.'''
+        while True:
+            await asyncio.sleep(interval)
+            self.write(file_name)
+
+    async def serve(self, host, port):
+        ''' Starts answering http requests for /metrics (text) and /metrics.json on host and port. Returns the asyncio
+        server; bind it to localhost unless the metrics may be seen by anyone.'''
+        async def handle(reader, writer):
+            try:
+                request = (await reader.readline()).split()
+                while (await reader.readline()).strip():
+                    pass                    # The headers do not matter
+                path = request[1].decode() if len(request) > 1 else '/'
+                if path in ['/', '/metrics']:
+                    status, kind, body = '200 OK', 'text/plain', self.text().encode()
+                elif path == '/metrics.json':
+                    status, kind, body = '200 OK', 'application/json', json.dumps(self.snapshot()).encode()
+                else:
+                    status, kind, body = '404 Not Found', 'text/plain', b'Not found\n'
+                writer.write(('HTTP/1.0 ' + status + '\r\nContent-Type: ' + kind + '\r\nContent-Length: ' +
+                              str(len(body)) + '\r\n\r\n').encode() + body)
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                writer.close()
+
+        return await asyncio.start_server(handle, host, port)
+
+
+def action_kind(action, events):
+    ''' Returns the kind of an action, for its latency histogram: move, dig, board, unboard or select for clicks,
+    end_turn, shift, fuel, fulfil or steal for the other actions. What a click did is told by the events it emitted:
+    a piece moved, a card was dug up, a pawn was taken off the board into a boat or put back on it; otherwise it only
+    selected or deselected a piece.'''
+    name = type(action).__name__
+    if name != 'Click':
+        return ACTION_KINDS.get(name, name)
+    for event in events:
+        kind = type(event).__name__
+        if kind == 'PieceMoved':
+            return 'move'
+        elif kind == 'CardTransferred' and action.dig:
+            return 'dig'
+        elif kind == 'PieceRemoved' and 'team' in event.label:
+            return 'board'
+        elif kind == 'PiecePlaced' and 'team' in event.label:
+            return 'unboard'
+    return 'select'
+
+
+metrics = Metrics()     # The metrics of this process
+
+
+if __name__ == '__main__':
+    import random
+
+    # The cost of recording and how close the percentiles of a histogram come to the exact ones
+    rng = random.Random(1)
+    values = [rng.lognormvariate(-7, 1) for i in range(100000)]
+    histogram = Histogram()
+    start = time.perf_counter()
+    for value in values:
+        histogram.record(value)
+    seconds = time.perf_counter() - start
+    values.sort()
+    print('Recording takes ' + str(round(seconds / len(values) * 1e9)) + ' ns per value')
+    for q in QUANTILES:
+        exact = values[max(0, math.ceil(len(values) * q / 100) - 1)]
+        print('p' + str(q) + ': ' + str(round(histogram.percentile(q) * 1e6, 1)) + ' us, exact ' +
+              str(round(exact * 1e6, 1)) + ' us')
@@ -0,0 +1,457 @@
+import re
+import tkinter
+from collections import deque
+
+''' The five resource properties of a resource card, in the order they are shown.'''
+RESOURCE_TYPES = ['earth', 'wood', 'stone', 'metal', 'fuel']
+
+
+def wheel_step(event):
+    ''' Returns -1 for a mouse wheel movement up and 1 for down, on Windows/Mac (MouseWheel) and X11 (Button-4/5).'''
+    if event.num == 4 or getattr(event, 'delta', 0) > 0:
+        return -1
+    return 1
+
+
+class RowList:
+    '''A scrollable list which shows any number of items with a fixed set of widget rows.
+
+    Only n_rows rows of widgets are ever made. Scrolling doesn't move widgets around, it fills the same rows with the
+    next items. make_row(frame, row) creates and grids the widgets of widget row row and returns them as a list,
+    fill_row(row, item) configures the widgets of that row for an item and grids the ones it needs. Rows after the
+    last item are hidden. So a stack of hundreds of cards costs as many widgets as a stack of n_rows cards.'''
+
+    def __init__(self, parent, n_rows, make_row, fill_row):
+        self.frame = tkinter.Frame(parent)
+        self.n_rows = n_rows
+        self.fill_row = fill_row
+        self.rows = [make_row(self.frame, row) for row in range(n_rows)]
+        self.scrollbar = tkinter.Scrollbar(self.frame, orient='vertical', command=self.scroll)
+        self.scrollbar.grid(row=0, column=99, rowspan=n_rows, sticky='NS')
+        self.count = 0      # Number of items in the list
+        self.first = 0      # Item shown in the top row
+
+        ''' The mouse wheel scrolls the list when it is over any of the rows.'''
+        for widget in [self.frame] + [x for row in self.rows for x in row]:
+            for sequence in ['<MouseWheel>', '<Button-4>', '<Button-5>']:
+                widget.bind(sequence, lambda event: self.scroll('scroll', wheel_step(event), 'units'))
+
+    def item(self, row):
+        ''' Returns the item shown in widget row row.'''
+        return self.first + row
+
+    def refresh(self):
+        ''' Fills all rows with the items from self.first on.'''
+        for row, widgets in enumerate(self.rows):
+            if self.first + row < self.count:
+                self.fill_row(row, self.first + row)
+            else:
+                for widget in widgets:
+                    widget.grid_remove()
+        if self.count > self.n_rows:
+            self.scrollbar.grid()
+            self.scrollbar.set(self.first / self.count, (self.first + self.n_rows) / self.count)
+        else:
+            self.scrollbar.grid_remove()
+
+    def scroll(self, action, amount, unit='units'):
+        ''' Scrollbar command: ('moveto', fraction) or ('scroll', steps, 'units' or 'pages').'''
+        if action == 'moveto':
+            first = int(round(float(amount) * self.count))
+        elif unit == 'pages':
+            first = self.first + int(amount) * self.n_rows
+        else:
+            first = self.first + int(amount)
+        first = min(max(first, 0), max(self.count - self.n_rows, 0))
+        if first != self.first:
+            self.first = first
+            self.refresh()
+
+    def show(self, count):
+        ''' Shows items 0 to count-1, starting at the top.'''
+        self.count = count
+        self.first = 0
+        self.refresh()
+
+
+class Popup:
+    '''A popup window which is built once and after that only shown and hidden. Closing it with the window manager
+    hides it as well. While it is shown, index is the hex whose object it shows.'''
+
+    def __init__(self, visualiser):
+        self.visualiser = visualiser
+        self.window = tkinter.Toplevel(visualiser.master)
+        self.window.withdraw()
+        self.window.protocol('WM_DELETE_WINDOW', self.hide)
+        self.index = None
+
+    def hide(self):
+        if self.index is not None:
+            self.window.withdraw()
+            self.index = None
+
+    def open(self, index, title):
+        ''' Shows the window for the object on hex index, right of the board.'''
+        ''' TODO Position the popup in the corner furthest away from the clicked hex in order to prevent overlap with reachable hexes. '''
+        self.index = index
+        self.window.title(title)
+        master = self.visualiser.master
+        self.window.geometry('+' + str(master.winfo_width()) + '+' + str(master.winfo_y()))
+        self.window.deiconify()
+        self.window.lift()
+
+    def set_text(self, textbox, text):
+        textbox.delete('1.0', 'end')
+        textbox.insert('end', text)
+
+
+class PlayerPanel(Popup):
+    '''The resources of an object of the current player: buttons to move selected resources to the harbours, home
+    towns and boats next to it, the fuel choice of a boat and the assignment of a home town.'''
+
+    max_destinations = 6    # A hex has at most six neighbours
+
+    def __init__(self, visualiser, n_rows):
+        Popup.__init__(self, visualiser)
+        self.destinations = []      # Hexes the destination buttons move resources to
+        self.selected = []          # Per resource card whether it is checked for moving
+        self.fuel_values = []       # Fuel choices of the boat: -1 for rowing, otherwise the index of the fuel card
+        self.choices = []           # Per resource card the property used for the assignment, 'none' if not used
+        self.assignment = None
+
+        ''' Object info, destination buttons and the list of checkboxes for all resources.'''
+        resource_frame = tkinter.Frame(self.window)
+        resource_frame.grid(row=0, column=0, sticky='NW')
+        self.header = tkinter.Text(resource_frame, width=30, height=1, wrap=tkinter.WORD)
+        self.header.grid(row=0, column=0, sticky='W')
+        tkinter.Label(resource_frame, text='Move resources').grid(row=1, column=0, sticky='W')
+        self.destination_buttons = []
+        for i in range(self.max_destinations):
+            button = tkinter.Button(resource_frame, command=lambda i=i: self.shift(i))
+            button.grid(row=2 + i, column=0, sticky='W', pady=4)
+            self.destination_buttons.append(button)
+        self.check_vars = [tkinter.IntVar() for i in range(n_rows)]
+        self.resources = RowList(resource_frame, n_rows, self.make_check_row, self.fill_check_row)
+        self.resources.frame.grid(row=2 + self.max_destinations, column=0, sticky='W')
+
+        ''' Radiobuttons with the fuel resources of a boat. Changing the dial will change the moveable hexes.'''
+        self.fuel_frame = tkinter.Frame(self.window)
+        self.fuel_frame.grid(row=0, column=1, sticky='NW')
+        tkinter.Label(self.fuel_frame, text='Move options').grid(row=0, column=0, sticky='W')
+        self.fuel_var = tkinter.IntVar()
+        self.fuel = RowList(self.fuel_frame, n_rows, self.make_fuel_row, self.fill_fuel_row)
+        self.fuel.frame.grid(row=1, column=0, sticky='W')
+
+        ''' The assignment of a home town and a row of buttons per resource for fulfilling it.'''
+        self.assignment_frame = tkinter.Frame(self.window)
+        self.assignment_frame.grid(row=0, column=2, sticky='NW')
+        tkinter.Label(self.assignment_frame, text='Assignment').grid(row=0, column=0, sticky='W')
+        self.assignment_text = tkinter.Text(self.assignment_frame, width=30, height=20, wrap=tkinter.WORD)
+        self.assignment_text.grid(row=1, column=0, sticky='W')
+        self.b1 = tkinter.Button(self.assignment_frame, text='Fulfill stage one', state='disabled',
+                                 command=lambda: self.fulfill(self.visualiser.game.fulfill_tier1))
+        self.b1.grid(row=2, column=0, sticky='W')
+        self.b2 = tkinter.Button(self.assignment_frame, text='Fulfill stage two', state='disabled',
+                                 command=lambda: self.fulfill(self.visualiser.game.fulfill_tier2))
+        self.b2.grid(row=3, column=0, sticky='W')
+
+        self.choice_frame = tkinter.Frame(self.window)
+        self.choice_frame.grid(row=0, column=3, sticky='NW')
+        tkinter.Label(self.choice_frame, text='Choose resources for assignment').grid(row=0, column=0, sticky='W')
+        self.choice_vars = [tkinter.StringVar() for i in range(n_rows)]
+        self.resource_choices = RowList(self.choice_frame, n_rows, self.make_choice_row, self.fill_choice_row)
+        self.resource_choices.frame.grid(row=1, column=0, sticky='W')
+
+    def check(self, row):
+        ''' Stores the state of the checkbox in widget row row.'''
+        self.selected[self.resources.item(row)] = self.check_vars[row].get()
+
+    def choose(self, row):
+        ''' Stores the choice in widget row row and checks whether the choices fulfill the assignment.'''
+        self.choices[self.resource_choices.item(row)] = self.choice_vars[row].get()
+        tier1, tier2 = self.visualiser.game.check_assignment(self.index, self.choices, self.assignment)
+        self.b1.configure(state='normal' if tier1 else 'disabled')
+        self.b2.configure(state='normal' if tier2 else 'disabled')
+
+    def fulfill(self, method):
+        ''' Calls fulfill_tier1 or fulfill_tier2 of the game with the chosen resources. The panel is closed afterwards,
+        it is not up-to-date anymore and pressing the fulfill button again would cause problems.'''
+        method(self.index, self.choices, self.assignment)
+        self.visualiser.close_popup()
+
+    def fill_check_row(self, row, item):
+        card = self.visualiser.grid.objects[self.index].resources.stack[item]
+        desc = card.name + ' (ewsmf: ' + card.earth + ' ' + card.wood + ' ' + card.stone + ' ' + card.metal + ' ' + \
+               card.fuel + ' ' + card.collect + ')'
+        self.check_vars[row].set(self.selected[item])
+        check = self.resources.rows[row][0]
+        check.configure(text=desc)
+        check.grid()
+
+    def fill_choice_row(self, row, item):
+        card = self.visualiser.grid.objects[self.index].resources.stack[item]
+        widgets = self.resource_choices.rows[row]
+        self.choice_vars[row].set(self.choices[item])
+        ''' The button for not using the resource is always there, then a button for each resource type with a value
+        larger than 0 and one for the collectible.'''
+        widgets[0].configure(text="Don't use " + card.name)
+        widgets[0].grid()
+        for j, widget in zip(RESOURCE_TYPES, widgets[1:6]):
+            if int(getattr(card, j)) > 0:
+                widget.configure(text=getattr(card, j) + ' ' + j)
+                widget.grid()
+            else:
+                widget.grid_remove()
+        if card.collect != 'none':
+            widgets[6].configure(text=card.collect)
+            widgets[6].grid()
+        else:
+            widgets[6].grid_remove()
+
+    def fill_fuel_row(self, row, item):
+        value = self.fuel_values[item]
+        if value == -1:
+            text = 'Row'        # Only use basic moves, don't use fuel
+        else:
+            text = self.visualiser.grid.objects[self.index].resources.stack[value].name
+        self.fuel.rows[row][0].configure(text=text, value=value)
+        self.fuel.rows[row][0].grid()
+
+    def make_check_row(self, frame, row):
+        check = tkinter.Checkbutton(frame, variable=self.check_vars[row], command=lambda: self.check(row))
+        check.grid(row=row, column=0, sticky='W')
+        return [check]
+
+    def make_choice_row(self, frame, row):
+        widgets = []
+        for column, value in enumerate(['none'] + RESOURCE_TYPES + ['collect']):
+            button = tkinter.Radiobutton(frame, indicatoron=0, variable=self.choice_vars[row], value=value,
+                                         command=lambda: self.choose(row))
+            button.grid(row=row, column=column, sticky='W')
+            widgets.append(button)
+        return widgets
+
+    def make_fuel_row(self, frame, row):
+        button = tkinter.Radiobutton(frame, variable=self.fuel_var,
+                                     command=lambda: self.visualiser.game.boat_select_fuel(self.index, self.fuel_var.get()))
+        button.grid(row=row, column=0, sticky='W')
+        return [button]
+
+    def shift(self, i):
+        ''' Moves the checked resources to the object of destination button i.'''
+        self.visualiser.game.shift_resources(self.index, self.destinations[i], list(self.selected))
+        self.visualiser.close_popup()      # The panel is not up to date anymore
+
+    def show(self, index):
+        ''' Fills the panel with the object on hex index and shows it.'''
+        grid = self.visualiser.grid
+        game = self.visualiser.game
+        obj = grid.objects[index]
+        self.open(index, obj.label)
+
+        ''' First prepare a string to indicate whether the clicked object belongs to the active player.'''
+        isoccupied = ''
+        if hasattr(obj, 'occupying_pawn_label'):   # Only boats have this attribute
+            if len(obj.occupying_pawn_label) > 1:
+                isoccupied = '(pawn)'
+        self.set_text(self.header, obj.label + '(active)' + isoccupied + '\n')
+
+        ''' Get the indices of hexes one step removed from the active hex and find harbors, homebases and boats. For
+        each of them a destination button is shown.'''
+        self.destinations = grid.get_resource_destinations(index)
+        for i, button in enumerate(self.destination_buttons):
+            if i < len(self.destinations):
+                button.configure(text=grid.objects[self.destinations[i]].label)
+                button.grid()
+            else:
+                button.grid_remove()
+
+        stack = obj.resources.stack
+        self.selected = [0] * len(stack)
+        self.resources.show(len(stack))
+
+        ''' For boats belonging to the active player the fuel resources are shown.'''
+        if 'boat' in obj.label and game.current_player in obj.label and obj.occupying_pawn:
+            self.fuel_values = [-1] + [i for i in range(len(stack)) if int(stack[i].fuel) > 0]
+            self.fuel_var.set(obj.selected_fuel)    # Set the radiobutton variable to the selected fuel of the boat
+            self.fuel.show(len(self.fuel_values))
+            self.fuel_frame.grid()
+        else:
+            self.fuel_frame.grid_remove()
+
+        ''' For home bases belonging to the active player we add an overview of the assignment.'''
+        if 'home' in obj.label and game.current_player in obj.label:
+            self.assignment = game.get_current_player().assignment
+            self.show_assignment(self.assignment)
+            self.choices = ['none'] * len(stack)
+            self.resource_choices.show(len(stack))
+            self.assignment_frame.grid()
+            self.choice_frame.grid()
+        else:
+            self.assignment = None
+            self.assignment_frame.grid_remove()
+            self.choice_frame.grid_remove()
+
+    def show_assignment(self, assignment):
+        ''' Writes the description of the assignment card and disables the fulfill buttons until resources are chosen.'''
+        t = self.assignment_text
+        t.delete('1.0', 'end')
+        t.insert('end', assignment.name + ': ')
+        t.insert('end', assignment.description + '\n')
+        t.insert('end', 'Stage one description: ' + assignment.tier1_desc + ' After you finish stage one you can gain points from stage 2.' + '\n')
+        if assignment.tier1_fulfilled == '0':
+            t.insert('end', 'Required resources for stage one: ' "\n")
+            for resource in iter(['tier1_req_metal', 'tier1_req_fuel', 'tier1_req_earth', 'tier1_req_stone', 'tier1_req_wood']):
+                if getattr(assignment, str(resource)) != '0':
+                    t.insert('end', resource[10:] + ': ' + getattr(assignment, resource) + '\n')   # Print the required amount of the resource
+            t.insert('end', ' Select resources and press fulfill stage one \n')
+        else:
+            t.insert('end', 'Stage 1 fulfilled: ' "\n")
+
+        ''' Assignment stage 2 '''
+        t.insert('end', '\n Stage two description: ' + assignment.tier2_desc + "\n")
+        if assignment.tier1_fulfilled == '0':
+            t.insert('end', 'First complete stage 1')
+        t.insert('end', "\n" 'Collected:' "\n")   # Show the specials which are already added to the assignment
+        for i in range(0, assignment.tier2_stack.get_size()):
+            t.insert('end', assignment.tier2_stack.stack[i].name + '\n')
+        self.b1.configure(state='disabled')
+        self.b2.configure(state='disabled')
+
+
+class EnemyPanel(Popup):
+    '''The resources of an object of another player, with a button for every boat of the current player which can
+    steal one of them.'''
+
+    max_pirates = 6     # A hex has at most six neighbours
+
+    def __init__(self, visualiser, n_rows):
+        Popup.__init__(self, visualiser)
+        self.pirates = []       # Hexes of the boats the pirate buttons steal with
+
+        tkinter.Label(self.window, text='opponent resources').grid(row=0, column=0, columnspan=2, sticky='W')
+        self.header = tkinter.Text(self.window, width=30, height=1, wrap=tkinter.WORD)
+        self.header.grid(row=1, column=0, columnspan=2)
+
+        ''' Radio buttons for choosing the resource to steal.'''
+        self.steal_var = tkinter.IntVar()
+        self.resources = RowList(self.window, n_rows, self.make_row, self.fill_row)
+        self.resources.frame.grid(row=2, column=1, rowspan=self.max_pirates, sticky='NW')
+        self.pirate_buttons = []
+        for i in range(self.max_pirates):
+            button = tkinter.Button(self.window, command=lambda i=i: self.visualiser.steal_resource(
+                self.index, self.pirates[i], self.steal_var.get()))
+            button.grid(row=2 + i, column=0, sticky='W', pady=4)
+            self.pirate_buttons.append(button)
+
+    def fill_row(self, row, item):
+        button = self.resources.rows[row][0]
+        button.configure(text=self.visualiser.grid.objects[self.index].resources.stack[item].name, value=item)
+        button.grid()
+
+    def make_row(self, frame, row):
+        button = tkinter.Radiobutton(frame, variable=self.steal_var)
+        button.grid(row=row, column=0, sticky='W')
+        return [button]
+
+    def show(self, index):
+        ''' Fills the panel with the object on hex index and shows it.'''
+        grid = self.visualiser.grid
+        obj = grid.objects[index]
+        self.open(index, obj.label)
+
+        isoccupied = ''
+        if hasattr(obj, 'occupying_pawn'):     # Only boats have this attribute
+            if obj.occupying_pawn:
+                isoccupied = '(pawn)'
+        self.set_text(self.header, obj.label + isoccupied + '\n')
+
+        self.steal_var.set(0)
+        self.resources.show(obj.resources.get_size())
+
+        '''  If a current player ship with moves = 0 and stealing ability is adjacent show a button. '''
+        self.pirates = grid.get_pirates(index)
+        for i, button in enumerate(self.pirate_buttons):
+            if i < len(self.pirates):
+                button.configure(text=grid.objects[self.pirates[i]].label)
+                button.grid()
+            else:
+                button.grid_remove()
+
+
+class MessageLog:
+    '''The last capacity messages of a text panel, newest at the top.
+
+    Messages are kept in a ring buffer together with the spans of the player names in them, which are found once when
+    the message comes in. The text widget is updated at most every interval ms with all messages which came in since
+    the last update, and lines beyond capacity are cut off, so adding a message takes the same time however long the
+    game lasts. Without a widget only the ring buffer is kept. If history_file is given, every message is also
+    appended to that file.'''
+
+    def __init__(self, widget, capacity, interval=100, history_file=None):
+        self.widget = widget
+        self.capacity = capacity
+        self.interval = interval
+        self.buffer = deque(maxlen=capacity)    # (message, spans) of the last capacity messages
+        self.pending = []                       # Messages which are not in the widget yet
+        self.update_pending = None
+        self.pattern = None                     # Matches any player name, set by set_players
+        self.history = None
+        if history_file:
+            self.history = open(history_file, 'a', encoding='utf-8')
+
+    def add(self, message):
+        ''' Adds a message and schedules an update of the widget if none is scheduled yet.'''
+        entry = (message, self.spans(message))
+        self.buffer.append(entry)
+        if self.history:
+            self.history.write(message + '\n')
+        if self.widget is not None:
+            self.pending.append(entry)
+            if self.update_pending is None:
+                self.update_pending = self.widget.after(self.interval, self.update)
+
+    def close(self):
+        ''' Shows the pending messages and closes the history file.'''
+        if self.update_pending is not None:
+            self.widget.after_cancel(self.update_pending)
+            self.update()
+        if self.history:
+            self.history.close()
+            self.history = None
+
+    def messages(self):
+        ''' Returns the messages in the ring buffer, oldest first.'''
+        return [message for message, spans in self.buffer]
+
+    def set_players(self, colors):
+        ''' Sets the player names to highlight, colors maps each name to its color. Messages which came in before
+        this are not highlighted.'''
+        names = sorted(colors, key=len, reverse=True)  # Longest names first, so player10 is not found as player1
+        self.pattern = re.compile('|'.join(re.escape(name) for name in names))
+        if self.widget is not None:
+            for name in names:
+                self.widget.tag_config(name, foreground=colors[name])
+
+    def spans(self, message):
+        ''' Returns (player, start, end) for every player name in the message.'''
+        if self.pattern is None:
+            return ()
+        return tuple((match.group(), match.start(), match.end()) for match in self.pattern.finditer(message))
+
+    def update(self):
+        ''' Puts the pending messages at the top of the widget in one go and cuts off the lines beyond capacity.'''
+        self.update_pending = None
+        new = self.pending[-self.capacity:]
+        self.pending = []
+        if self.history:
+            self.history.flush()
+        self.widget.config(state='normal')     # Enable editing of text
+        self.widget.insert('1.0', ''.join(message + '\n' for message, spans in reversed(new)))
+        line = 1
+        for message, spans in reversed(new):
+            for player, start, end in spans:
+                self.widget.tag_add(player, str(line) + '.0+' + str(start) + 'c', str(line) + '.0+' + str(end) + 'c')
+            line += message.count('\n') + 1
+        self.widget.delete(str(self.capacity + 1) + '.0', 'end')
+        self.widget.config(state='disabled')   # Disable editing
@@ -0,0 +1,433 @@
+import zlib
+import struct
+import asyncio
+
+from Pawn import Pawn
+from Events import PiecePlaced, PieceRemoved, PieceMoved, PieceHighlighted, Highlighted, OptionShown, \
+    SelectionCleared, ObjectSelected, FuelSelected, CardTransferred, CardCountsChanged, TurnChanged, ScoresChanged, \
+    Message, GameOver
+
+''' Binary wire format for sending the game state to clients.
+
+A client first gets a snapshot frame with the whole state, then one delta frame per action with the events of that
+action. Everything is named by a number: the tiles, piece labels, stacks, cards and players are listed once in the
+catalog at the start of the snapshot and the deltas only send their positions in those lists, so a delta record is
+a handful of bytes. A delta only depends on what the action changed, never on the size of the board.
+
+Every frame has a sequence number; a client which misses one asks for a new snapshot. Every checksum_interval
+deltas a checksum of the state follows the records, which the client compares with the checksum of its own copy
+(see Mirror), so a client that went out of sync notices it and asks for a new snapshot too.
+
+Frames are length prefixed: a 4 byte length, then the frame, which starts with its kind and sequence number.
+Drawpiles are only sent as their size, the order of the cards in them stays on the server.
+
+Hexes, labels, stacks and cards are sent as 2 byte numbers and 0xffff means none, so a board can have at most 65534
+hexes; the Encoder refuses larger boards. Bigger boards, like the ones Mapgen makes for benchmarks, are for the
+headless tools only.'''
+
+FRAME_SNAPSHOT = 1
+FRAME_DELTA = 2
+FRAME_MESSAGE = 3       # A json message (welcome, errors, legal actions) in a binary stream
+NONE = 0xffff           # No hex, no stack
+
+HEADER = struct.Struct('>BI')                       # Frame kind, sequence number
+OPTIONS = ['dig', 'board', 'unboard', 'steal']
+HIGHLIGHTS = ['reachable', 'selected']
+
+''' The delta records: code, struct of the fixed fields, the event type. Moves, assignment and checksum records carry
+state which has no event of its own.'''
+RECORDS = {PiecePlaced: (1, struct.Struct('>HH')),
+           PieceRemoved: (2, struct.Struct('>HH')),
+           PieceMoved: (3, struct.Struct('>HHH')),
+           PieceHighlighted: (4, struct.Struct('>HHB')),
+           Highlighted: (5, struct.Struct('>BH')),          # Kind, number of hexes, then a H per hex
+           OptionShown: (6, struct.Struct('>HB')),
+           SelectionCleared: (7, struct.Struct('')),
+           ObjectSelected: (8, struct.Struct('>HHB')),
+           FuelSelected: (9, struct.Struct('>Hh')),
+           CardTransferred: (10, struct.Struct('>HHHh')),
+           CardCountsChanged: (11, struct.Struct('>HHHHH')),
+           TurnChanged: (12, struct.Struct('>BH')),
+           ScoresChanged: (13, struct.Struct('>B')),         # Number of players, then a h per player
+           Message: (14, struct.Struct('>H')),               # Length, then the utf-8 text
+           GameOver: (15, struct.Struct('>H'))}
+MOVES = 16, struct.Struct('>HB')                # Label, moves left
+ASSIGNMENT = 17, struct.Struct('>BB')           # Player, tier 1 fulfilled
+CHECKSUM = 18, struct.Struct('>I')
+CODES = {code: (kind, fmt) for kind, (code, fmt) in RECORDS.items()}
+
+
+def frame(kind, seq, payload):
+    ''' Returns a complete frame, length prefix included.'''
+    body = HEADER.pack(kind, seq) + payload
+    return struct.pack('>I', len(body)) + body
+
+
+def pack_strings(strings):
+    data = struct.pack('>H', len(strings))
+    for s in strings:
+        encoded = s.encode()
+        data += struct.pack('>B', len(encoded)) + encoded
+    return data
+
+
+def unpack_strings(data, offset):
+    count, = struct.unpack_from('>H', data, offset)
+    offset += 2
+    strings = []
+    for i in range(count):
+        length = data[offset]
+        strings.append(data[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+    return strings, offset
+
+
+class Catalog:
+    '''The names behind the numbers in the frames. Built once by the server when the game has been set up: cards are
+    never created or destroyed afterwards and pieces only move between the board and the boats.'''
+
+    def __init__(self, tiles, labels, stacks, cards, players):
+        self.tiles = tiles
+        self.labels = labels
+        self.stacks = stacks
+        self.cards = cards
+        self.players = players
+        self.tile_index = {x: i for i, x in enumerate(tiles)}
+        self.label_index = {x: i for i, x in enumerate(labels)}
+        self.stack_index = {x: i for i, x in enumerate(stacks)}
+        self.card_index = {x: i for i, x in enumerate(cards)}
+        self.player_index = {x: i for i, x in enumerate(players)}
+
+    @classmethod
+    def from_game(cls, grid, game):
+        labels = sorted(x for x, y in vars(game).items() if isinstance(y, Pawn))
+        stacks = [x for x in labels if hasattr(getattr(game, x), 'resources')]
+        stacks += [x + '_drawpile' for x in ['sand', 'forest', 'meadow', 'rock', 'swamp']]
+        stacks += [x + tier for x in game.player_order for tier in ['.tier1', '.tier2']]
+        cards = sorted(set(card.name for name in stacks for card in game.get_stack(name).stack))
+        return cls(sorted(set(grid.tiles)), labels, stacks, cards, list(game.player_order))
+
+    def pack(self):
+        return b''.join(pack_strings(x) for x in [self.tiles, self.labels, self.stacks, self.cards, self.players])
+
+    @classmethod
+    def unpack(cls, data, offset):
+        tables = []
+        for i in range(5):
+            table, offset = unpack_strings(data, offset)
+            tables.append(table)
+        return cls(*tables), offset
+
+
+def checksum(catalog, positions, moves, stacks, current, turn, scores, fulfilled):
+    ''' CRC32 of the state both sides keep: where every piece is and its moves, the cards in every stack (drawpiles
+    only by size), whose turn it is, the scores and which assignments have tier 1 fulfilled.'''
+    crc = zlib.crc32(struct.pack('>%dH' % len(positions), *positions))
+    crc = zlib.crc32(struct.pack('>%dB' % len(moves), *moves), crc)
+    for i, stack in enumerate(stacks):
+        if isinstance(stack, int):
+            crc = zlib.crc32(struct.pack('>H', stack), crc)
+        else:
+            crc = zlib.crc32(struct.pack('>H%dH' % len(stack), len(stack), *stack), crc)
+    crc = zlib.crc32(struct.pack('>BH', current, turn), crc)
+    crc = zlib.crc32(struct.pack('>%dh' % len(scores), *scores), crc)
+    crc = zlib.crc32(struct.pack('>%dB' % len(fulfilled), *fulfilled), crc)
+    return crc & 0xffffffff
+
+
+class Encoder:
+    '''Turns the events of a game into frames. Subscribe it to the event bus, then call delta() after every action for
+    the frame with the events of that action; every client gets the same bytes.
+
+    Besides the events the encoder keeps where each piece is, the moves last sent for each piece and the assignment
+    states, so after an action it only has to look at the pieces (not the hexes) for changed moves.'''
+
+    def __init__(self, grid, game, checksum_interval=16):
+        if grid.n_hexes >= NONE:
+            raise ValueError('A board of ' + str(grid.n_hexes) + ' hexes is too large for the binary protocol, it '
+                             'takes at most ' + str(NONE - 1))
+        self.grid = grid
+        self.game = game
+        self.catalog = Catalog.from_game(grid, game)
+        self.checksum_interval = checksum_interval
+        self.seq = 0
+        self.records = []
+        self.positions = [NONE] * len(self.catalog.labels)
+        for index, obj in enumerate(grid.objects):
+            if obj:
+                self.positions[self.catalog.label_index[obj.label]] = index
+        self.pieces = [getattr(game, x) for x in self.catalog.labels]
+        self.moves = self.piece_moves()
+        self.fulfilled = self.assignment_states()
+        grid.events.subscribe(self.add)
+
+    def add(self, event):
+        ''' Encodes an event into a record of the next delta.'''
+        c = self.catalog
+        code, fmt = RECORDS[type(event)]
+        if isinstance(event, (PiecePlaced, PieceRemoved)):
+            data = fmt.pack(event.index, c.label_index[event.label])
+            self.positions[c.label_index[event.label]] = event.index if isinstance(event, PiecePlaced) else NONE
+        elif isinstance(event, PieceMoved):
+            data = fmt.pack(c.label_index[event.label], event.source, event.destination)
+            self.positions[c.label_index[event.label]] = event.destination
+        elif isinstance(event, PieceHighlighted):
+            data = fmt.pack(event.index, c.label_index[event.label], event.highlighted)
+        elif isinstance(event, Highlighted):
+            data = fmt.pack(HIGHLIGHTS.index(event.kind), len(event.indices)) + \
+                   struct.pack('>%dH' % len(event.indices), *event.indices)
+        elif isinstance(event, OptionShown):
+            data = fmt.pack(event.index, OPTIONS.index(event.option))
+        elif isinstance(event, SelectionCleared):
+            data = b''
+        elif isinstance(event, ObjectSelected):
+            data = fmt.pack(event.index, c.label_index[event.label], event.own)
+        elif isinstance(event, FuelSelected):
+            data = fmt.pack(event.index, event.resource_index)
+        elif isinstance(event, CardTransferred):
+            destination = NONE if event.destination is None else c.stack_index[event.destination]
+            data = fmt.pack(c.stack_index[event.source], destination, c.card_index[event.card], event.index)
+        elif isinstance(event, CardCountsChanged):
+            data = fmt.pack(*event)
+        elif isinstance(event, TurnChanged):
+            data = fmt.pack(c.player_index[event.player], event.turn)
+        elif isinstance(event, ScoresChanged):
+            data = fmt.pack(len(event.scores)) + struct.pack('>%dh' % len(event.scores), *[x[1] for x in event.scores])
+        else:   # Message and GameOver
+            text = str(event[0]).encode()
+            data = fmt.pack(len(text)) + text
+        self.records.append(struct.pack('>B', code) + data)
+
+    def assignment_states(self):
+        return [int(getattr(self.game, x).assignment.tier1_fulfilled) for x in self.catalog.players]
+
+    def checksum(self):
+        return checksum(self.catalog, self.positions, self.moves, self.stack_contents(), self.current(),
+                        self.game.turn, [getattr(self.game, x).points for x in self.catalog.players], self.fulfilled)
+
+    def current(self):
+        return self.catalog.player_index.get(self.game.current_player, 0)
+
+    def delta(self):
+        ''' Returns the frame with the events since the last delta, plus the moves and assignment states that changed
+        and, every checksum_interval frames, a checksum. Returns None if nothing happened.'''
+        moves = self.piece_moves()
+        for i, (old, new) in enumerate(zip(self.moves, moves)):
+            if old != new:
+                self.records.append(struct.pack('>B', MOVES[0]) + MOVES[1].pack(i, new))
+        self.moves = moves
+        fulfilled = self.assignment_states()
+        for i, (old, new) in enumerate(zip(self.fulfilled, fulfilled)):
+            if old != new:
+                self.records.append(struct.pack('>B', ASSIGNMENT[0]) + ASSIGNMENT[1].pack(i, new))
+        self.fulfilled = fulfilled
+        if not self.records:
+            return None
+        self.seq += 1
+        if self.seq % self.checksum_interval == 0:
+            self.records.append(struct.pack('>B', CHECKSUM[0]) + CHECKSUM[1].pack(self.checksum()))
+        payload = struct.pack('>H', len(self.records)) + b''.join(self.records)
+        self.records = []
+        return frame(FRAME_DELTA, self.seq, payload)
+
+    def piece_moves(self):
+        return [min(max(x.moves, 0), 255) for x in self.pieces]
+
+    def snapshot(self):
+        ''' Returns a frame with the whole state. It has the sequence number of the last delta, so the deltas after it
+        follow on. Call delta() first: the snapshot already contains the events which are not in a delta yet.'''
+        c = self.catalog
+        stacks = self.stack_contents()
+        payload = c.pack()
+        payload += struct.pack('>HH', self.grid.size_x, self.grid.size_y)
+        payload += bytes(c.tile_index[x] for x in self.grid.tiles)
+        payload += struct.pack('>%dH' % len(self.positions), *self.positions)
+        payload += struct.pack('>%dB' % len(self.moves), *self.moves)
+        for stack in stacks:
+            if isinstance(stack, int):
+                payload += struct.pack('>BH', 1, stack)
+            else:
+                payload += struct.pack('>BH%dH' % len(stack), 0, len(stack), *stack)
+        scores = [getattr(self.game, x).points for x in c.players]
+        payload += struct.pack('>BH', self.current(), self.game.turn)
+        payload += struct.pack('>%dh' % len(scores), *scores)
+        payload += struct.pack('>%dB' % len(self.fulfilled), *self.fulfilled)
+        payload += struct.pack('>I', self.checksum())
+        return frame(FRAME_SNAPSHOT, self.seq, payload)
+
+    def stack_contents(self):
+        ''' The card numbers of every stack, only the size for drawpiles.'''
+        contents = []
+        for name in self.catalog.stacks:
+            stack = self.game.get_stack(name).stack
+            if name.endswith('_drawpile'):
+                contents.append(len(stack))
+            else:
+                contents.append([self.catalog.card_index[x.name] for x in stack])
+        return contents
+
+
+class OutOfSync(Exception):
+    '''Raised by Mirror when a frame is missing or the checksum differs; the client should ask for a snapshot.'''
+    pass
+
+
+class Mirror:
+    '''The client's copy of the game state, kept up to date from the frames. apply() returns the events of a frame
+    as the same namedtuples the game emits, so a client can feed them to the same code the local visualiser uses.'''
+
+    def __init__(self):
+        self.catalog = None
+        self.seq = None
+
+    def apply(self, data):
+        ''' Applies one frame (without the length prefix). Returns the events in it, a snapshot returns no events;
+        json messages are returned as their text. Raises OutOfSync when a delta doesn't follow on the last frame or
+        a checksum differs.'''
+        kind, seq = HEADER.unpack_from(data, 0)
+        offset = HEADER.size
+        if kind == FRAME_MESSAGE:
+            return [data[offset:].decode()]
+        if kind == FRAME_SNAPSHOT:
+            self.read_snapshot(data, offset)
+            self.seq = seq
+            return []
+        if self.seq is None or seq != self.seq + 1:
+            raise OutOfSync('Expected frame ' + str(None if self.seq is None else self.seq + 1) + ', got ' + str(seq))
+        self.seq = seq
+        return self.read_delta(data, offset)
+
+    def checksum(self):
+        return checksum(self.catalog, self.positions, self.moves, self.stacks, self.current, self.turn, self.scores,
+                        self.fulfilled)
+
+    def read_delta(self, data, offset):
+        c = self.catalog
+        count, = struct.unpack_from('>H', data, offset)
+        offset += 2
+        events = []
+        for i in range(count):
+            code = data[offset]
+            offset += 1
+            if code == MOVES[0]:
+                label, moves = MOVES[1].unpack_from(data, offset)
+                self.moves[label] = moves
+                offset += MOVES[1].size
+                continue
+            if code == ASSIGNMENT[0]:
+                player, fulfilled = ASSIGNMENT[1].unpack_from(data, offset)
+                self.fulfilled[player] = fulfilled
+                offset += ASSIGNMENT[1].size
+                continue
+            if code == CHECKSUM[0]:
+                expected, = CHECKSUM[1].unpack_from(data, offset)
+                offset += CHECKSUM[1].size
+                if expected != self.checksum():
+                    raise OutOfSync('Checksum differs after frame ' + str(self.seq))
+                continue
+            kind, fmt = CODES[code]
+            fields = fmt.unpack_from(data, offset)
+            offset += fmt.size
+            if kind in (PiecePlaced, PieceRemoved):
+                event = kind(fields[0], c.labels[fields[1]])
+                self.positions[fields[1]] = fields[0] if kind is PiecePlaced else NONE
+                self.objects[fields[0]] = fields[1] if kind is PiecePlaced else NONE
+            elif kind is PieceMoved:
+                event = kind(c.labels[fields[0]], fields[1], fields[2])
+                self.positions[fields[0]] = fields[2]
+                self.objects[fields[1]] = NONE
+                self.objects[fields[2]] = fields[0]
+            elif kind is PieceHighlighted:
+                event = kind(fields[0], c.labels[fields[1]], bool(fields[2]))
+            elif kind is Highlighted:
+                indices = struct.unpack_from('>%dH' % fields[1], data, offset)
+                offset += 2 * fields[1]
+                event = kind(indices, HIGHLIGHTS[fields[0]])
+            elif kind is OptionShown:
+                event = kind(fields[0], OPTIONS[fields[1]])
+            elif kind is ObjectSelected:
+                event = kind(fields[0], c.labels[fields[1]], bool(fields[2]))
+            elif kind is CardTransferred:
+                source, destination, card, index = fields
+                self.take(source, index)
+                if destination != NONE:
+                    self.give(destination, card)
+                event = kind(c.stacks[source], None if destination == NONE else c.stacks[destination], c.cards[card],
+                             index)
+            elif kind is TurnChanged:
+                self.current = fields[0]
+                self.turn = fields[1]
+                event = kind(c.players[fields[0]], fields[1])
+            elif kind is ScoresChanged:
+                self.scores = list(struct.unpack_from('>%dh' % fields[0], data, offset))
+                offset += 2 * fields[0]
+                event = kind(tuple(zip(c.players, self.scores)))
+            elif kind in (Message, GameOver):
+                event = kind(data[offset:offset + fields[0]].decode())
+                offset += fields[0]
+            else:       # SelectionCleared, FuelSelected and CardCountsChanged
+                event = kind(*fields)
+            events.append(event)
+        return events
+
+    def read_snapshot(self, data, offset):
+        self.catalog, offset = Catalog.unpack(data, offset)
+        c = self.catalog
+        self.size_x, self.size_y = struct.unpack_from('>HH', data, offset)
+        offset += 4
+        n_hexes = self.size_x * self.size_y
+        self.tiles = [c.tiles[x] for x in data[offset:offset + n_hexes]]
+        offset += n_hexes
+        n_labels = len(c.labels)
+        self.positions = list(struct.unpack_from('>%dH' % n_labels, data, offset))
+        offset += 2 * n_labels
+        self.moves = list(data[offset:offset + n_labels])
+        offset += n_labels
+        self.objects = [NONE] * n_hexes         # Label number on every hex
+        for label, index in enumerate(self.positions):
+            if index != NONE:
+                self.objects[index] = label
+        self.stacks = []
+        for i in range(len(c.stacks)):
+            sized, length = struct.unpack_from('>BH', data, offset)
+            offset += 3
+            if sized:
+                self.stacks.append(length)
+            else:
+                self.stacks.append(list(struct.unpack_from('>%dH' % length, data, offset)))
+                offset += 2 * length
+        self.current, self.turn = struct.unpack_from('>BH', data, offset)
+        offset += 3
+        n_players = len(c.players)
+        self.scores = list(struct.unpack_from('>%dh' % n_players, data, offset))
+        offset += 2 * n_players
+        self.fulfilled = list(data[offset:offset + n_players])
+        offset += n_players
+        expected, = struct.unpack_from('>I', data, offset)
+        if expected != self.checksum():
+            raise OutOfSync('Checksum of the snapshot differs')
+
+    def give(self, stack, card):
+        if isinstance(self.stacks[stack], int):
+            self.stacks[stack] += 1
+        else:
+            self.stacks[stack].append(card)
+
+    def take(self, stack, index):
+        if isinstance(self.stacks[stack], int):
+            self.stacks[stack] -= 1
+        else:
+            self.stacks[stack].pop(index)
+
+    def label_at(self, index):
+        ''' The label of the piece on hex index, None if there is none.'''
+        return None if self.objects[index] == NONE else self.catalog.labels[self.objects[index]]
+
+
+async def read_frame(reader):
+    ''' Reads one frame from an asyncio stream, without its length prefix. Returns None at the end of the stream.'''
+    try:
+        length, = struct.unpack('>I', await reader.readexactly(4))
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
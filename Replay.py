@@ -0,0 +1,220 @@
+import os
+import io
+import time
+import contextlib
+
+import Headless
+import Journal
+import State
+import Savegame
+
+''' Replays of recorded games. A recording is the state a game started from and the actions carried out in it, as
+(player, action): the journal of a game (see Journal) or a seed with the actions played after setting up the game
+with it. Replaying needs no randomness, the game only draws at random while it is set up.
+
+When a replay is loaded it plays the whole game once without showing it, and keeps a keyframe, a save of the state
+(see Savegame), every keyframe_interval actions and the action at which every turn starts. Going to any action then
+restores the keyframe before it and carries out fewer than keyframe_interval actions, however long the game is.
+
+python Replay.py journal/room3                      shows the replay in a window with controls to step, play and seek
+python Replay.py journal/room3 --to-turn 12 --save turn12.sav    goes to turn 12 without a window and saves the game
+'''
+
+
+class Replay:
+    '''Goes through a recorded game: start is the state the game started from, actions the list of (player, action)
+    carried out. self.grid and self.game are the game after self.position actions; seek replaces them by restored ones
+    when it goes back or far ahead.'''
+
+    def __init__(self, start, actions, config, keyframe_interval=50, visualiser=None):
+        self.start = start
+        self.actions = actions
+        self.config = config
+        self.keyframe_interval = keyframe_interval
+        self.visualiser = Headless.HeadlessVisualiser() if visualiser is None else visualiser
+        self.keyframes = {}             # Saves of the state after every keyframe_interval actions, by position
+        self.turns = {}                 # The position at which each turn starts, by turn number
+        self.index()
+        self.grid, self.game = State.restore(start, config, self.visualiser)
+        self.position = 0
+
+    def index(self):
+        ''' Plays the whole recording once without a visualiser, making the keyframes and noting the turns. Raises
+        ValueError if an action of the recording is not allowed in the game.'''
+        with contextlib.redirect_stdout(io.StringIO()):
+            grid, game = State.restore(self.start, self.config, Headless.HeadlessVisualiser())
+            self.turns[game.turn] = 0
+            self.keyframes[0] = Savegame.encode(self.start)
+            for n, (player, action) in enumerate(self.actions, 1):
+                Journal.replay(game, player, action, 'Action ' + str(n) + ' of the recording')
+                if game.turn not in self.turns:
+                    self.turns[game.turn] = n
+                if n % self.keyframe_interval == 0:
+                    self.keyframes[n] = Savegame.encode(State.capture(grid, game))
+
+    def seek(self, position):
+        ''' Goes to the game after position actions. Returns True if the grid and game were replaced by restored
+        ones, which then still have to be shown; otherwise the actions were carried out in the game as it was, with
+        their events.'''
+        position = max(0, min(position, len(self.actions)))
+        keyframe = position - position % self.keyframe_interval
+        restored = position < self.position or keyframe > self.position
+        if restored:
+            self.grid, self.game = State.restore(Savegame.decode(self.keyframes[keyframe]), self.config,
+                                                 self.visualiser)
+            self.position = keyframe
+        while self.position < position:
+            self.step()
+        return restored
+
+    def seek_turn(self, turn):
+        ''' Goes to the start of turn, or the end of the recording if the turn was not played. See seek.'''
+        return self.seek(self.turns.get(turn, len(self.actions)))
+
+    def step(self):
+        ''' Carries out the next action and returns it, None at the end of the recording.'''
+        if self.position >= len(self.actions):
+            return None
+        player, action = self.actions[self.position]
+        self.position += 1
+        Journal.replay(self.game, player, action, 'Action ' + str(self.position) + ' of the recording')
+        return action
+
+    def turn(self):
+        return self.game.turn
+
+    @classmethod
+    def from_journal(cls, directory, config, keyframe_interval=50, visualiser=None):
+        ''' Returns the replay of the game in a journal, from its first snapshot.'''
+        with open(os.path.join(directory, Journal.snapshot_name(0)), 'rb') as f:
+            start = Savegame.decode(f.read())
+        actions = [(player, action) for n, player, action in Journal.read_actions(directory)[0]]
+        return cls(start, actions, config, keyframe_interval, visualiser)
+
+    @classmethod
+    def from_seed(cls, seed, actions, config, keyframe_interval=50, visualiser=None):
+        ''' Returns the replay of actions in the game set up with seed (see Headless.new_game).'''
+        with contextlib.redirect_stdout(io.StringIO()):
+            grid, game = Headless.new_game(seed=seed, config=config)
+            start = State.capture(grid, game)
+            game.quit()
+        return cls(start, actions, config, keyframe_interval, visualiser)
+
+
+class ReplayControls:
+    '''Window with the controls of a replay shown in a MainTK window: step back and forward, go to the previous or
+    next turn, to the start or the end, play at a number of actions per second and seek with the slider.'''
+
+    def __init__(self, window, replay, speed=2):
+        import tkinter
+
+        self.window = window
+        self.replay = replay
+        self.playing = None             # Tk id of the next scheduled step while playing
+        self.top = tkinter.Toplevel(window.master)
+        self.top.title('Replay')
+        self.label = tkinter.Label(self.top, width=40)
+        self.label.grid(row=0, column=0, columnspan=7)
+        buttons = [('|<', lambda: self.go(0)), ('<<', lambda: self.go_turn(-1)),
+                   ('<', lambda: self.go(self.replay.position - 1)), ('>', self.forward),
+                   ('>>', lambda: self.go_turn(1)), ('>|', lambda: self.go(len(self.replay.actions)))]
+        for column, (text, command) in enumerate(buttons):
+            tkinter.Button(self.top, text=text, width=3, command=command).grid(row=1, column=column)
+        self.play_button = tkinter.Button(self.top, text='Play', width=5, command=self.toggle_play)
+        self.play_button.grid(row=1, column=len(buttons))
+        self.slider = tkinter.Scale(self.top, from_=0, to=len(replay.actions), orient='horizontal', showvalue=False,
+                                    length=300)
+        self.slider.bind('<ButtonRelease-1>', lambda event: self.go(self.slider.get()))
+        self.slider.grid(row=2, column=0, columnspan=7, sticky='ew')
+        tkinter.Label(self.top, text='Actions per second:').grid(row=3, column=0, columnspan=4, sticky='e')
+        self.speed = tkinter.Spinbox(self.top, values=(1, 2, 5, 10, 20, 50, 100), width=5)
+        self.speed.delete(0, 'end')
+        self.speed.insert(0, str(speed))
+        self.speed.grid(row=3, column=4, columnspan=3, sticky='w')
+        self.update()
+
+    def forward(self):
+        ''' Carries out the next action in the game shown, so its events show it like in a game.'''
+        action = self.replay.step()
+        if action is not None:
+            player = self.replay.actions[self.replay.position - 1][0]
+            self.window.message('Replay: ' + player + ' ' + type(action).__name__)
+        self.update()
+        return action
+
+    def go(self, position):
+        if self.replay.seek(position):
+            self.window.show_game(self.replay.grid, self.replay.game)
+        self.update()
+
+    def go_turn(self, step):
+        ''' Goes to the start of the next turn (step 1) or of the previous one (step -1); going back from within a turn
+        goes to its start first.'''
+        turn = self.replay.turn()
+        if step < 0 and self.replay.position > self.replay.turns.get(turn, 0):
+            step = 0
+        if self.replay.seek_turn(turn + step):
+            self.window.show_game(self.replay.grid, self.replay.game)
+        self.update()
+
+    def play(self):
+        if self.forward() is None:
+            self.toggle_play()
+            return
+        self.playing = self.top.after(int(1000 / float(self.speed.get())), self.play)
+
+    def toggle_play(self):
+        if self.playing is None:
+            self.play_button.configure(text='Pause')
+            self.playing = self.top.after(0, self.play)
+        else:
+            self.top.after_cancel(self.playing)
+            self.playing = None
+            self.play_button.configure(text='Play')
+
+    def update(self):
+        self.label.configure(text='Action ' + str(self.replay.position) + ' of ' + str(len(self.replay.actions)) +
+                                  ', turn ' + str(self.replay.turn()) + ', ' + self.replay.game.current_player)
+        self.slider.set(self.replay.position)
+
+
+def show(replay, config_file='Config.ini', speed=2):
+    ''' Shows a replay in a MainTK window with replay controls, until the window is closed.'''
+    from Visualize_tkinter import MainTK
+
+    window = MainTK(config_file, State.capture(replay.grid, replay.game), read_only=True)
+    replay.grid, replay.game, replay.visualiser = window.grid, window.game, window
+    controls = ReplayControls(window, replay, speed)
+    window.master.mainloop()
+    return controls
+
+
+if __name__ == '__main__':
+    import argparse
+    import configparser
+
+    parser = argparse.ArgumentParser(description='Replay the game recorded in a journal.')
+    parser.add_argument('journal', help='directory of the journal of the game')
+    parser.add_argument('--config', default='Config.ini', help='config file the game was played with')
+    parser.add_argument('--keyframes', type=int, default=50, help='actions between two keyframes')
+    parser.add_argument('--to', type=int, help='go to the game after this many actions, without a window')
+    parser.add_argument('--to-turn', type=int, help='go to the start of this turn, without a window')
+    parser.add_argument('--save', metavar='FILE', help='save the game gone to (see Savegame)')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read(args.config)
+    start = time.perf_counter()
+    replay = Replay.from_journal(args.journal, config, args.keyframes)
+    print('Indexed ' + str(len(replay.actions)) + ' actions and ' + str(len(replay.turns)) + ' turns in ' +
+          str(round(time.perf_counter() - start, 3)) + ' s')
+    if args.to is None and args.to_turn is None:
+        show(replay, args.config)
+    else:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            replay.seek(args.to) if args.to is not None else replay.seek_turn(args.to_turn)
+        print('Went to action ' + str(replay.position) + ', turn ' + str(replay.turn()) + ' in ' +
+              str(round((time.perf_counter() - start) * 1000, 1)) + ' ms')
+        if args.save:
+            Savegame.save(args.save, replay.grid, replay.game)
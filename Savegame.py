@@ -0,0 +1,117 @@
+import os
+import json
+import zlib
+import struct
+
+import State
+
+''' Save format of a whole game. A save holds the state of State.capture, so loading it gives a Grid and Game which
+play on exactly like the saved ones.
+
+A save is a header followed by the body:
+    header      magic b'LSAV', format version (B), state version (H), crc32 of the body (I)
+    body        the state as compact json, compressed with zlib
+The state is mostly the text of the cards, which zlib compresses well; a game takes about 3 kB.
+
+The state version is checked by State.restore, the format version here; a save of another version is refused rather
+than loaded wrong. Format version 1 had a binary body of its own, which came out larger than this.'''
+
+MAGIC = b'LSAV'
+FORMAT_VERSION = 2
+HEADER = struct.Struct('>4sBHI')
+
+
+def encode(state, level=6):
+    ''' Returns a state (as made by State.capture) as a save, compressed with zlib level. numpy numbers are saved as
+    plain numbers.'''
+    body = zlib.compress(json.dumps(state, separators=(',', ':'), default=lambda x: x.item()).encode(), level)
+    return HEADER.pack(MAGIC, FORMAT_VERSION, state['version'], zlib.crc32(body)) + body
+
+
+def decode(data):
+    ''' Returns the state in a save. Raises ValueError if data is no save, is damaged or has another format version.'''
+    if len(data) < HEADER.size:
+        raise ValueError('Save is too short')
+    magic, version, state_version, crc = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('Not a save')
+    if version != FORMAT_VERSION:
+        raise ValueError('Cannot load save format version ' + str(version) + ', expected ' + str(FORMAT_VERSION))
+    body = data[HEADER.size:]
+    if zlib.crc32(body) != crc:
+        raise ValueError('Save is damaged')
+    try:
+        state = json.loads(zlib.decompress(body).decode())
+    except (zlib.error, ValueError) as e:
+        raise ValueError('Save is damaged: ' + str(e))
+    if not isinstance(state, dict) or state.get('version') != state_version:
+        raise ValueError('Save is damaged: it does not hold one state')
+    return state
+
+
+def save(file_name, grid, game):
+    ''' Saves the game to file_name. The file is replaced at once, so a crash while saving leaves the previous save.'''
+    with open(file_name + '.tmp', 'wb') as f:
+        f.write(encode(State.capture(grid, game)))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(file_name + '.tmp', file_name)
+
+
+def load(file_name, config, visualiser):
+    ''' Returns a new grid and game from the save in file_name, see State.restore for config and visualiser.'''
+    with open(file_name, 'rb') as f:
+        return State.restore(decode(f.read()), config, visualiser)
+
+
+if __name__ == '__main__':
+    import io
+    import time
+    import random
+    import contextlib
+
+    import numpy
+
+    import Actions
+    import Headless
+
+    # Save and load a game every few actions while playing it, and check that the loaded game is the same game and
+    # plays on the same: the next actions are carried out in both and the states compared again.
+    rng = random.Random(2)
+    sizes, save_times, load_times, restore_times = [], [], [], []
+    with contextlib.redirect_stdout(io.StringIO()):
+        grid, game = Headless.new_game(seed=2)
+        for i in range(600):
+            state = State.capture(grid, game)
+            if i % 20 == 0:
+                start = time.perf_counter()
+                data = encode(state)
+                save_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                loaded = decode(data)
+                load_times.append(time.perf_counter() - start)
+                start = time.perf_counter()
+                grid2, game2 = State.restore(loaded, game.config, Headless.HeadlessVisualiser())
+                restore_times.append(time.perf_counter() - start)
+                assert loaded == json.loads(json.dumps(state, default=lambda x: x.item())), 'Different state loaded'
+                sizes.append(len(data))
+            action = rng.choice(Actions.legal_actions(game, game.current_player)) if rng.random() > 0.05 \
+                else Actions.EndTurn()
+            for g in [game, game2]:
+                try:
+                    Actions.apply(g, g.current_player, action)
+                except Actions.IllegalAction:
+                    pass
+            assert State.capture(grid2, game2) == State.capture(grid, game), 'Loaded game plays on differently'
+        game.quit()
+
+    # A damaged save is refused
+    for damaged in [data[:-5], data[:6] + bytes([data[6] ^ 1]) + data[7:], b'LSAV' + bytes(20)]:
+        try:
+            decode(damaged)
+            print('Damaged save loaded')
+        except ValueError:
+            pass
+    print(str(len(sizes)) + ' saves round tripped, ' + str(int(numpy.mean(sizes))) + ' bytes on average, save ' +
+          str(round(numpy.mean(save_times) * 1000, 2)) + ' ms, load ' + str(round(numpy.mean(load_times) * 1000, 2)) +
+          ' ms, restore ' + str(round(numpy.mean(restore_times) * 1000, 2)) + ' ms')
@@ -0,0 +1,934 @@
+import io
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import asyncio
+import itertools
+import tempfile
+import traceback
+import contextlib
+import tracemalloc
+import configparser
+from collections import deque
+
+import numpy
+
+import Actions
+import Headless
+import Protocol
+from Journal import Journal
+from Metrics import metrics, action_kind
+
+''' Authoritative game server. The server holds the only Grids and Games and runs them headless (see Headless); clients
+send actions (see Actions), the server validates and carries them out and sends every event the game emits to the
+clients of that game. Everything runs in one asyncio event loop: every connection waits for its next line and every
+client has a queue which a writer task empties, so nothing polls and a slow client never holds up the game.
+
+One server hosts many games at the same time, each in its own Room. A room only costs memory while nobody sends it
+anything: it has no tasks or timers of its own, except a timer to close it once it has been empty for a while. The
+rooms take turns: the actions of one room are handled in one go and the event loop then goes on with the next message,
+which may be for any room. Every room has its own random generators and its own copy of the config; what cannot
+differ between games (the parsed card files, the connectivity of the board) is read once and shared by all rooms, see
+Cards.read_ini, Hexgrid.shared_connections and Mapcompile.compiled_maps.
+
+Messages are json objects, one per line. Client to server:
+    {"type": "join", "name": ...}                 first message, the server answers with welcome and a snapshot;
+                                                  with "binary": true the server sends binary frames, see below;
+                                                  with "room": id the client joins that room, with "room": "new" a
+                                                  new one, otherwise the first room with a free seat
+    {"type": "action", "action": "Click", ...}    an action, see Actions.encode; illegal actions get an error
+    {"type": "legal"}                             asks for the actions the player can take now
+    {"type": "resync"}                            asks for a new snapshot, for binary clients which got out of sync
+    {"type": "stats"}                             asks for the resources used by the room, see Room.stats
+A join with "spectate": true makes the client a spectator of the room (or of the first open room): it gets the same
+snapshot and events as the players, but cannot take actions. See Spectator.
+Server to client:
+    {"type": "welcome", "player": ..., "room": id} the player label of the seat the client got (null for
+                                                  spectators) and the room
+    {"type": "snapshot", ...}                     the board and the scores, see Room.snapshot
+    {"type": "event", "event": "PieceMoved", ...} every event of the game, see Events
+    {"type": "legal", "actions": [...]}
+    {"type": "stats", ...}
+    {"type": "error", "reason": ...}
+
+Binary clients get the frames of Protocol instead: a snapshot after joining, then one delta frame per action with
+all its events, and the other messages as json message frames. The events of an action are encoded once, as one
+buffer for all json clients and one delta frame for all binary clients.
+
+The server counts what it does in Metrics: the time it takes to handle each kind of action, card transfers, the
+reachability cache of the boards and the lengths of the send queues. They can be read over http or written to a file,
+see the metrics setting in Config.ini.
+'''
+
+TEMP_FILES = ['sand_resources', 'forest_resources', 'meadow_resources', 'rock_resources', 'swamp_resources']
+
+
+def dump(message):
+    ''' Encodes a message as a json line. numpy numbers are sent as plain numbers.'''
+    return (json.dumps(message, default=lambda x: x.item()) + '\n').encode()
+
+
+class MalformedMessage(Exception):
+    '''A line from the other side which is not a json object. The clients are not trusted, so the server answers it
+    with an error rather than failing on it.'''
+
+
+async def read_message(reader):
+    ''' Returns the next message from a stream, None when the other side closed the connection. Raises
+    MalformedMessage if the line is not a json object.'''
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        message = json.loads(line.decode())
+    except ValueError:          # Also covers bytes which are not utf-8
+        raise MalformedMessage('Line is not json')
+    if not isinstance(message, dict):
+        raise MalformedMessage('Message is not a json object')
+    return message
+
+
+class Discard(io.TextIOBase):
+    '''Stands in for stdout while a room runs its game, unless the server is verbose: the game prints a lot, which
+    adds up with many rooms.'''
+
+    def write(self, text):
+        return len(text)
+
+
+discard = Discard()
+
+
+class Connection:
+    '''The sending side of a client connection. Messages are put in a queue and written by a separate task, so sending
+    never waits for the network.'''
+
+    def __init__(self, player, writer, binary=False):
+        self.player = player
+        self.writer = writer
+        self.binary = binary
+        self.bytes_sent = 0
+        self.queue = asyncio.Queue()
+        self.task = asyncio.ensure_future(self.pump())
+
+    def send(self, message):
+        if self.binary:
+            self.send_line(Protocol.frame(Protocol.FRAME_MESSAGE, 0, dump(message)))
+        else:
+            self.send_line(dump(message))
+
+    def send_line(self, line):
+        self.bytes_sent += len(line)
+        self.queue.put_nowait(line)
+
+    async def pump(self):
+        ''' Writes the queued lines until the connection is closed.'''
+        try:
+            while True:
+                line = await self.queue.get()
+                if line is None:
+                    break
+                self.writer.write(line)
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    async def close(self):
+        ''' Sends what is still queued and closes the connection.'''
+        self.queue.put_nowait(None)
+        await self.task
+
+
+class Feed:
+    '''The updates of a room for its spectators: the last size updates, each encoded once as a delta frame and as json
+    lines. Publishing an update takes the same time for one spectator as for thousands; every spectator reads the feed
+    at its own pace in its own task (see Spectator).'''
+
+    def __init__(self, size):
+        self.updates = deque(maxlen=size)              # (seq, delta frame, json lines), seq goes up by 1 per update
+        self.changed = asyncio.Event()
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+        self.changed.set()
+
+    def publish(self, seq, delta, lines):
+        self.updates.append((seq, delta, lines))
+        # Wake the spectators waiting for this update; the ones that come later wait for the next one. Waking takes
+        # time for every spectator, so it is done after the players have been sent the update.
+        asyncio.get_event_loop().call_soon(self.changed.set)
+        self.changed = asyncio.Event()
+
+    def since(self, seq):
+        ''' Returns the updates after seq, or None if some of them have already dropped out of the feed.'''
+        if not self.updates or seq >= self.updates[-1][0]:
+            return []
+        first = self.updates[0][0]
+        if seq + 1 < first:
+            return None
+        return list(itertools.islice(self.updates, seq + 1 - first, None))
+
+
+class Spectator:
+    '''A read-only client of a room. It has no queue: its task sends whatever the feed of the room has after the last
+    update it sent, all in one write, and then waits for the next. When the connection is so slow that updates drop
+    out of the feed before they are sent, it gets a fresh snapshot instead and goes on from there. So a slow spectator
+    only falls behind itself, and the room never waits for it or keeps anything for it.'''
+
+    def __init__(self, room, writer, binary=False):
+        self.player = None
+        self.room = room
+        self.writer = writer
+        self.binary = binary
+        self.seq = None                                 # Last update sent, None when the next thing to send is a snapshot
+        self.bytes_sent = 0
+        self.snapshots = 0                              # Snapshots sent because the spectator fell behind
+        self.task = asyncio.ensure_future(self.pump())
+
+    def send(self, message):
+        ''' Sends an answer to a message of the spectator.'''
+        line = dump(message)
+        if self.binary:
+            line = Protocol.frame(Protocol.FRAME_MESSAGE, 0, line)
+        self.write(line)
+
+    def write(self, data):
+        self.bytes_sent += len(data)
+        self.writer.write(data)
+
+    async def pump(self):
+        ''' Sends the updates of the feed until the room closes.'''
+        feed = self.room.feed
+        try:
+            while not feed.closed:
+                updates = feed.since(self.seq) if self.seq is not None else None
+                if updates is None:
+                    if self.seq is not None:
+                        self.snapshots += 1
+                    self.seq = self.room.encoder.seq
+                    self.write(self.room.snapshot_data(self.binary))
+                elif updates:
+                    self.seq = updates[-1][0]
+                    self.write(b''.join(x[1] if self.binary else x[2] for x in updates))
+                else:
+                    await feed.changed.wait()
+                    continue
+                await self.writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.writer.close()
+
+    async def close(self):
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+
+class Room:
+    '''One game on a server, for the players of the config. Clients get the seats in player order as they join; a
+    client which leaves frees its seat, and the next client to join takes over that player.
+
+    The game uses the global random generators of random and numpy.random, so the room keeps their states and swaps
+    them in whenever it runs game code (see running). That way the games of a server do not draw from each other's
+    random numbers, and a seeded room plays out the same whatever the other rooms do. The time and memory the game
+    code takes are counted per room at the same place.
+
+    Any number of spectators can follow the game besides the players. They read the updates from a Feed, which is
+    only made when the first spectator comes.
+
+    With a journal directory every action is recorded in a Journal there. If the directory already holds the journal
+    of an unfinished game, the room goes on with that game instead of setting up a new one.
+
+    States: waiting until all seats have been taken once, then playing, finished when the game is over or the room
+    was closed. on_finished is called with the room when it finishes.'''
+
+    def __init__(self, room_id, config, seed=None, verbose=False, on_finished=None, journal=None):
+        self.room_id = room_id
+        self.verbose = verbose
+        self.on_finished = on_finished
+        self.state = 'waiting'
+        self.clients = {}                               # Connection of every seated player by player label
+        self.spectators = []
+        self.feed = None                                # Updates for the spectators, see Feed
+        self.lines = []                                 # json lines of the events since the last flush
+        self.action_events = []                         # Events of the action being handled, see Metrics.action_kind
+        self.snapshots = (None, {})                     # The snapshots of the current update, by binary or not
+        self.idle = None                                # Timer which closes the room when it stays empty
+        # Resources used by the room, see stats
+        self.actions = 0
+        self.cpu_time = 0.0
+        self.memory = 0
+        self.bytes_sent = 0                             # By clients which have left, the others count their own
+        self.spectator_snapshots = 0                    # Of spectators which have left, see Spectator.snapshots
+        # The random generators of the room, seeded from the room seed
+        self.random_state = random.Random(seed).getstate()
+        self.numpy_state = numpy.random.RandomState(seed).get_state()
+        # A copy of the config which writes the temp files of the game into a directory of its own
+        self.temp_dir = tempfile.mkdtemp(prefix='room' + str(room_id) + '_')
+        self.config = configparser.ConfigParser()
+        self.config.read_dict(config)
+        for option in TEMP_FILES:
+            self.config.set('Game', option, os.path.join(self.temp_dir, os.path.basename(config.get('Game', option))))
+        self.journal = None
+        with self.running():
+            if journal is not None and os.path.isdir(journal) and Journal.unfinished(journal):
+                self.journal, self.grid, self.game = Journal.recover(
+                    journal, self.config, Headless.HeadlessVisualiser(verbose),
+                    self.config.getint('Server', 'journal_snapshots'), self.config.getfloat('Server', 'journal_sync'))
+                self.state = 'playing'
+            else:
+                self.grid, self.game = Headless.new_game(config=self.config, verbose=verbose)
+                if journal is not None:
+                    self.journal = Journal(journal, self.config.getint('Server', 'journal_snapshots'),
+                                           self.config.getfloat('Server', 'journal_sync'))
+                    self.journal.start(self.grid, self.game)
+            self.grid.events.subscribe(self.broadcast)
+            self.grid.on_connections = self.count_connections
+            self.encoder = Protocol.Encoder(self.grid, self.game, self.config.getint('Server', 'checksum_interval'))
+        self.setup_time = self.cpu_time                 # Part of cpu_time it took to set up the game
+        self.feed_size = self.config.getint('Server', 'spectator_updates')
+
+    def broadcast(self, event):
+        ''' Encodes an event of the game for the json clients. It is sent to all of them by flush.'''
+        message = {'type': 'event', 'event': type(event).__name__}
+        message.update(event._asdict())
+        self.lines.append(dump(message))
+        self.action_events.append(event)
+        if type(event).__name__ == 'CardTransferred':
+            metrics.count('card_transfers')
+        if type(event).__name__ == 'GameOver' and self.state != 'finished':
+            self.state = 'finished'
+            if self.on_finished is not None:
+                self.on_finished(self)
+
+    async def close(self, end_game=True):
+        ''' Ends the game if it is still going, closes all connections and removes the temp files. Without end_game a
+        game with a journal is left as it is, to be recovered later.'''
+        if self.idle is not None:
+            self.idle.cancel()
+            self.idle = None
+        if self.state != 'finished':
+            self.state = 'finished'
+            if end_game or self.journal is None:
+                self.quit()
+        if self.journal is not None:
+            self.journal.close()
+        for connection in list(self.clients.values()):
+            await connection.close()
+        self.clients = {}
+        if self.feed is not None:
+            self.feed.close()
+        if self.spectators:
+            # Give the spectators a moment to receive the end of the game, but not wait for the slow ones
+            await asyncio.wait([x.task for x in self.spectators], timeout=1)
+            for spectator in self.spectators:
+                await spectator.close()
+        self.spectators = []
+        shutil.rmtree(self.temp_dir, ignore_errors=True)
+
+    def count_connections(self, source):
+        ''' Counts where the grid found a connectivity matrix (see Hexgrid.get_connections): in its cache, or else
+        shared by another board, in the compiled map or generated. Mostly they should be found right away.'''
+        if source == 'cache':
+            metrics.count('reachability_cache_hits')
+        else:
+            metrics.count('reachability_cache_misses')
+            metrics.count('reachability_' + source)
+
+    def flush(self):
+        ''' Sends the events of the last action to the players, the delta frame to the binary clients and the json lines
+        in one buffer to the others, and puts them in the feed for the spectators.'''
+        delta = self.encoder.delta()
+        lines = b''.join(self.lines)
+        self.lines = []
+        if delta is None:
+            return
+        for connection in self.clients.values():
+            if connection.binary:
+                connection.send_line(delta)
+            elif lines:
+                connection.send_line(lines)
+        if self.feed is not None:
+            self.feed.publish(self.encoder.seq, delta, lines)
+
+    def free_seats(self):
+        return [x for x in self.game.player_order if x not in self.clients]
+
+    def leave(self, connection):
+        ''' Frees the seat of a connection. Returns True when the room has no players now.'''
+        if connection in self.spectators:
+            self.spectators.remove(connection)
+            self.bytes_sent += connection.bytes_sent
+            self.spectator_snapshots += connection.snapshots
+        elif self.clients.get(connection.player) is connection:
+            del self.clients[connection.player]
+            self.bytes_sent += connection.bytes_sent
+        return not self.clients
+
+    def log(self, message):
+        if self.verbose:
+            print('Room ' + str(self.room_id) + ': ' + message)
+
+    def quit(self):
+        ''' Ends the game; the clients get the GameOver event.'''
+        with self.running():
+            self.game.quit()
+            self.flush()
+        if self.journal is not None:
+            self.journal.close(finished=True)
+
+    def receive(self, connection, message):
+        ''' Handles a message of a client.'''
+        if message.get('type') in ['legal', 'action'] and connection.player is None:
+            connection.send({'type': 'error', 'reason': 'Spectators cannot take actions'})
+        elif message.get('type') == 'action' and self.state == 'finished':
+            connection.send({'type': 'error', 'reason': 'The game is over'})
+        elif message.get('type') == 'legal':
+            start = time.perf_counter()
+            with self.running():
+                actions = Actions.legal_actions(self.game, connection.player)
+            connection.send({'type': 'legal', 'actions': [Actions.encode(x) for x in actions]})
+            metrics.observe('legal_seconds', time.perf_counter() - start)
+        elif message.get('type') == 'action':
+            start = time.perf_counter()
+            self.action_events = []
+            with self.running():
+                self.actions += 1
+                action = None
+                try:
+                    action = Actions.decode(message)
+                    Actions.apply(self.game, connection.player, action)
+                except Actions.IllegalAction as e:
+                    action = None
+                    metrics.count('illegal_actions')
+                    connection.send({'type': 'error', 'reason': str(e)})
+                except Exception:
+                    # A bug in the game must not take the server down; the client gets an error and the trace is logged.
+                    metrics.count('action_errors')
+                    print(traceback.format_exc(), file=sys.stderr)
+                    connection.send({'type': 'error', 'reason': 'Server error'})
+                # Illegal actions did not change anything, the others are recorded (even if the game failed on them)
+                if action is not None and self.journal is not None:
+                    self.journal.record(connection.player, action)
+                self.flush()
+            if action is not None:
+                metrics.observe('action_' + action_kind(action, self.action_events) + '_seconds',
+                                time.perf_counter() - start)
+            self.action_events = []
+            # The last turn of the end phase has been played
+            if self.game.turns_till_end == 0 and self.state != 'finished':
+                self.quit()
+        elif message.get('type') == 'resync':
+            if connection.player is None:
+                connection.seq = None       # The task of the spectator sends the snapshot
+            else:
+                self.flush()
+                self.send_snapshot(connection)
+        elif message.get('type') == 'stats':
+            answer = {'type': 'stats'}
+            answer.update(self.stats())
+            connection.send(answer)
+        else:
+            connection.send({'type': 'error', 'reason': 'Unknown message type ' + str(message.get('type'))})
+
+    @contextlib.contextmanager
+    def running(self):
+        ''' Runs the code in the with block as this room: with the random generators of the room and (unless verbose)
+        without printing. Counts the processor time and, when tracemalloc is tracing, the memory it takes.'''
+        random.setstate(self.random_state)
+        numpy.random.set_state(self.numpy_state)
+        tracing = tracemalloc.is_tracing()
+        memory = tracemalloc.get_traced_memory()[0] if tracing else 0
+        start = time.process_time()
+        try:
+            with contextlib.redirect_stdout(sys.stdout if self.verbose else discard):
+                yield
+        finally:
+            self.cpu_time += time.process_time() - start
+            if tracing:
+                self.memory += tracemalloc.get_traced_memory()[0] - memory
+            self.random_state = random.getstate()
+            self.numpy_state = numpy.random.get_state()
+
+    def seat(self, connection):
+        ''' Gives a connection the player seat it was made for and sends it the welcome and the snapshot.'''
+        if self.idle is not None:
+            self.idle.cancel()
+            self.idle = None
+        self.flush()        # A new binary client starts from a snapshot without pending events
+        self.clients[connection.player] = connection
+        if self.state == 'waiting' and not self.free_seats():
+            self.state = 'playing'
+        connection.send({'type': 'welcome', 'player': connection.player, 'room': self.room_id})
+        self.send_snapshot(connection)
+
+    def spectate(self, writer, binary):
+        ''' Adds a spectator; its task sends it the welcome and the snapshot.'''
+        if self.feed is None:
+            self.feed = Feed(self.feed_size)
+        self.flush()
+        spectator = Spectator(self, writer, binary)
+        spectator.send({'type': 'welcome', 'player': None, 'room': self.room_id})
+        self.spectators.append(spectator)
+        return spectator
+
+    def send_snapshot(self, connection):
+        connection.send_line(self.snapshot_data(connection.binary))
+
+    def snapshot_data(self, binary):
+        ''' The snapshot as it is sent: a frame for binary clients, a json line for the others. Every update of the game
+        is made into a snapshot only once, however many clients ask for it.'''
+        seq, data = self.snapshots
+        if seq != self.encoder.seq:
+            data = {}
+            self.snapshots = (self.encoder.seq, data)
+        if binary not in data:
+            data[binary] = self.encoder.snapshot() if binary else dump(self.snapshot())
+        return data[binary]
+
+    def snapshot(self):
+        ''' The state of the game a client needs to draw the board; everything after it arrives as events.'''
+        grid = self.grid
+        game = self.game
+        return {'type': 'snapshot',
+                'size': [grid.size_x, grid.size_y],
+                'tiles': list(grid.tiles),
+                'objects': [x.label if x else None for x in grid.objects],
+                'moves': [x.moves if x else 0 for x in grid.objects],
+                'players': [[x, getattr(game, x).color] for x in game.player_order],
+                'current_player': game.current_player,
+                'turn': game.turn,
+                'scores': [[x, getattr(game, x).points] for x in game.player_order]}
+
+    def stats(self):
+        ''' The resources used by the room. arrays are the bytes of the numpy arrays of its own board; the arrays shared
+        with other rooms are read-only and are not counted. memory is only counted while tracemalloc is tracing.'''
+        arrays = sum(x.nbytes for x in vars(self.grid).values()
+                     if isinstance(x, numpy.ndarray) and x.flags.writeable and x.flags.owndata)
+        return {'room': self.room_id,
+                'state': self.state,
+                'players': sorted(self.clients),
+                'spectators': len(self.spectators),
+                'spectator_snapshots': self.spectator_snapshots + sum(x.snapshots for x in self.spectators),
+                'turn': self.game.turn,
+                'actions': self.actions,
+                'cpu_time': round(self.cpu_time, 4),
+                'setup_time': round(self.setup_time, 4),
+                'memory': self.memory,
+                'arrays': arrays,
+                'bytes_sent': self.bytes_sent + sum(x.bytes_sent for x in list(self.clients.values()) + self.spectators)}
+
+
+class GameServer:
+    '''Hosts the rooms of one server process and sends every joining client to a room (see the join message). A room
+    is opened when a client needs one, closed when its game is over, and closed when it has had no clients for
+    idle_timeout seconds (config section Server). No more than max_rooms rooms are open at once.
+
+    With a seed every room gets a seed drawn from it, so the rooms play out the same in every run.
+
+    With a journal directory (config section Server) every room keeps a journal in a directory of its own there. The
+    unfinished games found there when the server starts are recovered into rooms, which their players can join again by
+    room id. Stopping the server leaves these games unfinished.'''
+
+    def __init__(self, config_file='Config.ini', seed=None, host='127.0.0.1', port=0, verbose=False):
+        self.host = host
+        self.port = port
+        self.verbose = verbose
+        self.config = configparser.ConfigParser()
+        self.config.read(config_file)
+        self.idle_timeout = self.config.getfloat('Server', 'idle_timeout')
+        self.max_rooms = self.config.getint('Server', 'max_rooms')
+        self.journal = self.config.get('Server', 'journal')
+        self.journal = None if self.journal == 'no' else self.journal
+        self.seeds = random.Random(seed) if seed is not None else None
+        self.rooms = {}                                 # Open rooms by room id
+        self.next_room = 0
+        self.closed_rooms = deque(maxlen=1000)          # Stats of the last rooms which have been closed
+        self.server = None
+        self.finished = asyncio.Event()                 # Set when the server stops
+        self.metrics = self.config.get('Server', 'metrics')
+        self.metrics_server = None
+        self.metrics_task = None
+        for name, function in self.gauges().items():
+            metrics.gauge(name, function)
+
+    def close_room(self, room):
+        ''' Closes a room and forgets it. Called when its game is over and when it stayed empty for too long.'''
+        if self.rooms.get(room.room_id) is not room:
+            return
+        del self.rooms[room.room_id]
+        asyncio.ensure_future(self.end_room(room))
+
+    async def end_room(self, room, end_game=True):
+        metrics.count('rooms_closed')
+        await room.close(end_game)
+        self.closed_rooms.append(room.stats())
+        self.log('Closed room ' + str(room.room_id) + ', ' + str(len(self.rooms)) + ' rooms left')
+
+    def connections(self):
+        ''' Yields the connections of all players and spectators.'''
+        for room in self.rooms.values():
+            yield from room.clients.values()
+            yield from room.spectators
+
+    def find_room(self, hello):
+        ''' Returns the room for a join message, opening a new one if needed, or None if there is none to join.'''
+        wanted = hello.get('room')
+        if not (wanted is None or wanted == 'new' or type(wanted) is int):
+            return None             # The room ids are ints, anything else cannot be looked up
+        if hello.get('spectate'):
+            rooms = [x for x in self.rooms.values() if x.state != 'finished' and wanted in [None, x.room_id]]
+            return rooms[0] if rooms else None
+        if wanted is None:
+            rooms = [x for x in self.rooms.values() if x.state != 'finished' and x.free_seats()]
+            # Fill the rooms which are still waiting for players before taking over a seat in a running game
+            rooms.sort(key=lambda x: x.state != 'waiting')
+            if rooms:
+                return rooms[0]
+        elif wanted != 'new':
+            room = self.rooms.get(wanted)
+            return room if room is not None and room.state != 'finished' and room.free_seats() else None
+        return self.new_room()
+
+    async def handle(self, reader, writer):
+        ''' Runs one client connection: a join, then actions until the client leaves.'''
+        try:
+            hello = await read_message(reader)
+        except (MalformedMessage, ConnectionError, ValueError):
+            hello = None        # ValueError: the line is longer than the stream buffer
+        room = self.find_room(hello) if hello and hello.get('type') == 'join' else None
+        if room is None:
+            writer.write(dump({'type': 'error', 'reason': 'No room to join' if hello else 'Expected join'}))
+            writer.close()
+            return
+        if hello.get('spectate'):
+            connection = room.spectate(writer, bool(hello.get('binary')))
+            name = 'spectator ' + str(hello.get('name'))
+        else:
+            connection = Connection(room.free_seats()[0], writer, bool(hello.get('binary')))
+            room.seat(connection)
+            name = connection.player
+        room.log(str(hello.get('name')) + ' joined as ' + name)
+        try:
+            while True:
+                try:
+                    message = await read_message(reader)
+                except MalformedMessage:
+                    connection.send({'type': 'error', 'reason': 'Malformed message'})
+                    continue
+                if message is None:
+                    break
+                room.receive(connection, message)
+        except (ConnectionError, ValueError) as e:
+            room.log(name + ' disconnected: ' + str(e))
+        finally:
+            if room.leave(connection) and room.state != 'finished' and room.idle is None:
+                room.idle = asyncio.get_event_loop().call_later(self.idle_timeout, self.close_room, room)
+            await connection.close()
+            room.log(name + ' left')
+
+    def gauges(self):
+        ''' The gauges of the server for Metrics: the rooms and clients, and how much is waiting to be sent: the
+        messages in the send queues of the players, the bytes the sockets could not take yet and the updates the
+        spectators are behind.'''
+        return {'rooms': lambda: len(self.rooms),
+                'players': lambda: sum(len(x.clients) for x in self.rooms.values()),
+                'spectators': lambda: sum(len(x.spectators) for x in self.rooms.values()),
+                'send_queue_messages': lambda: sum(x.queue.qsize() for x in self.connections() if x.player),
+                'send_queue_max': lambda: max([x.queue.qsize() for x in self.connections() if x.player] + [0]),
+                'write_buffer_bytes': lambda: sum(x.writer.transport.get_write_buffer_size()
+                                                  for x in self.connections()),
+                'spectator_backlog': lambda: sum(x.room.encoder.seq - x.seq for x in self.connections()
+                                                 if x.player is None and x.seq is not None)}
+
+    def journal_of(self, room_id):
+        return None if self.journal is None else os.path.join(self.journal, 'room' + str(room_id))
+
+    def log(self, message):
+        if self.verbose:
+            print(message)
+
+    def new_room(self):
+        ''' Opens a new room, or returns None if the server already has max_rooms rooms.'''
+        if len(self.rooms) >= self.max_rooms:
+            return None
+        room_id = self.next_room
+        self.next_room += 1
+        seed = self.seeds.getrandbits(32) if self.seeds is not None else None
+        room = Room(room_id, self.config, seed, self.verbose, self.close_room, self.journal_of(room_id))
+        self.rooms[room_id] = room
+        metrics.count('rooms_opened')
+        self.log('Opened room ' + str(room_id) + ', ' + str(len(self.rooms)) + ' rooms open')
+        return room
+
+    def recover_rooms(self):
+        ''' Opens a room for every unfinished game in the journal directory. Room ids go on after the highest found.'''
+        os.makedirs(self.journal, exist_ok=True)
+        ids = sorted(int(x[4:]) for x in os.listdir(self.journal) if x.startswith('room') and x[4:].isdigit())
+        self.next_room = max(ids + [self.next_room - 1]) + 1
+        for room_id in ids:
+            if Journal.unfinished(self.journal_of(room_id)):
+                room = Room(room_id, self.config, None, self.verbose, self.close_room, self.journal_of(room_id))
+                self.rooms[room_id] = room
+                room.idle = asyncio.get_event_loop().call_later(self.idle_timeout, self.close_room, room)
+                self.log('Recovered room ' + str(room_id) + ' at turn ' + str(room.game.turn))
+
+    async def start(self):
+        ''' Recovers the games of the journal if there is one and starts listening; with port 0 a free port is picked,
+        self.port tells which.'''
+        if self.journal is not None:
+            self.recover_rooms()
+        self.server = await asyncio.start_server(self.handle, self.host, self.port)
+        self.port = self.server.sockets[0].getsockname()[1]
+        self.log('Serving on ' + self.host + ':' + str(self.port))
+        # The metrics are served on localhost only: they are for the people running the server, not for the players
+        if self.metrics.isdigit():
+            self.metrics_server = await metrics.serve('127.0.0.1', int(self.metrics))
+            self.log('Metrics on http://127.0.0.1:' + str(self.metrics_server.sockets[0].getsockname()[1]) +
+                     '/metrics')
+        elif self.metrics != 'no':
+            self.metrics_task = asyncio.ensure_future(
+                metrics.dump_every(self.metrics, self.config.getfloat('Server', 'metrics_interval')))
+
+    def stats(self):
+        ''' The stats of all rooms, open and closed, by room id (see Room.stats).'''
+        stats = list(self.closed_rooms) + [x.stats() for x in self.rooms.values()]
+        return sorted(stats, key=lambda x: x['room'])
+
+    async def stop(self):
+        ''' Closes all rooms and stops listening.'''
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+            self.server = None
+        rooms = list(self.rooms.values())
+        self.rooms = {}
+        for room in rooms:
+            await self.end_room(room, False)
+        if self.metrics_server is not None:
+            self.metrics_server.close()
+            await self.metrics_server.wait_closed()
+            self.metrics_server = None
+        if self.metrics_task is not None:
+            self.metrics_task.cancel()
+            self.metrics_task = None
+            metrics.write(self.metrics)
+        self.finished.set()
+
+
+class Client:
+    '''A minimal client, used as stand-in player for trying out and load testing the server over loopback. Messages
+    other than answers are collected in self.events.'''
+
+    def __init__(self, name, binary=False):
+        self.name = name
+        self.binary = binary
+        self.mirror = Protocol.Mirror() if binary else None
+        self.bytes_received = 0
+        self.player = None
+        self.room = None
+        self.reader = None
+        self.writer = None
+        self.events = []
+        self.pending = []       # Messages of binary frames which have not been returned yet
+        self.snapshot = None
+        self.resyncs = 0        # Times the mirror got out of sync
+        self.arrivals = None    # Set to a dict to record when each delta frame arrived, by sequence number
+
+    async def connect(self, host, port, room=None, spectate=False):
+        ''' Joins a room of the server at host and port: room id, 'new' or None for any room with a free seat. A
+        spectator gets None as player.'''
+        self.reader, self.writer = await asyncio.open_connection(host, port)
+        hello = {'type': 'join', 'name': self.name, 'binary': self.binary, 'spectate': spectate}
+        if room is not None:
+            hello['room'] = room
+        self.writer.write(dump(hello))
+        welcome = await self.read()
+        if welcome is None or welcome['type'] != 'welcome':
+            raise ConnectionError('Could not join: ' + str(welcome))
+        self.player = welcome['player']
+        self.room = welcome['room']
+        self.snapshot = await self.read()
+        if self.binary:
+            self.snapshot = {'type': 'snapshot', 'current_player': self.mirror.catalog.players[self.mirror.current]}
+
+    async def read(self):
+        ''' Returns the next message from the server. For binary clients the frames are applied to the mirror and
+        every event is returned as the message a json client would get.'''
+        if not self.binary:
+            return await read_message(self.reader)
+        while not self.pending:
+            data = await Protocol.read_frame(self.reader)
+            if data is None:
+                return None
+            self.bytes_received += len(data) + 4
+            try:
+                for event in self.mirror.apply(data):
+                    if isinstance(event, str):
+                        self.pending.append(json.loads(event))
+                    else:
+                        message = {'type': 'event', 'event': type(event).__name__}
+                        message.update(event._asdict())
+                        self.pending.append(message)
+                if data[0] == Protocol.FRAME_SNAPSHOT:
+                    self.pending.append({'type': 'snapshot'})
+                elif data[0] == Protocol.FRAME_DELTA and self.arrivals is not None:
+                    self.arrivals[self.mirror.seq] = time.perf_counter()
+            except Protocol.OutOfSync:
+                self.resyncs += 1
+                self.writer.write(dump({'type': 'resync'}))
+        return self.pending.pop(0)
+
+    async def receive(self, kinds):
+        ''' Waits for the next message of one of the kinds, collecting the events that arrive before it. Returns None
+        when the server closed the connection.'''
+        while True:
+            message = await self.read()
+            if message is None or message['type'] in kinds:
+                return message
+            self.events.append(message)
+
+    async def request(self, message, kinds):
+        self.writer.write(dump(message))
+        await self.writer.drain()
+        return await self.receive(kinds)
+
+    async def legal_actions(self):
+        answer = await self.request({'type': 'legal'}, ['legal'])
+        return [] if answer is None else answer['actions']
+
+    async def send_action(self, action):
+        ''' Sends an action (a dict as made by Actions.encode) without waiting for its result.'''
+        message = {'type': 'action'}
+        message.update(action)
+        self.writer.write(dump(message))
+        await self.writer.drain()
+
+    def close(self):
+        self.writer.close()
+
+
+async def play_randomly(client, rng, turns, latencies=None):
+    ''' Lets a stand-in client play random legal actions until it has ended turns turns. It waits for its turn by
+    reading the events, so it only talks to the server when it is its move.
+
+    With a list as latencies, the round trip of every action but EndTurn is added to it as (time sent, seconds): the
+    time until the answer to the next legal request, which the server handles right after the action.'''
+    ended = 0
+    sent = None
+    my_turn = client.snapshot['current_player'] == client.player
+    while ended < turns:
+        if not my_turn:
+            message = await client.receive(['event'])
+            if message is None:
+                return ended
+            my_turn = message['event'] == 'TurnChanged' and message['player'] == client.player
+            continue
+        actions = await client.legal_actions()
+        if sent is not None and latencies is not None:
+            latencies.append((sent, time.perf_counter() - sent))
+        sent = None
+        if not actions:
+            my_turn = False
+            continue
+        # End the turn now and then, otherwise pick any other action
+        action = rng.choice(actions) if rng.random() > 0.1 else {'action': 'EndTurn'}
+        if action['action'] != 'EndTurn':
+            sent = time.perf_counter()
+        await client.send_action(action)
+        if action['action'] == 'EndTurn':
+            ended += 1
+            my_turn = False
+    return ended
+
+
+async def watch(client):
+    ''' Lets a spectator client read all it gets until the server closes the connection. Returns the number of
+    messages.'''
+    messages = 0
+    while await client.read() is not None:
+        messages += 1
+    return messages
+
+
+async def run_local(n_clients, turns, seed, verbose, binary=False, n_rooms=1, n_spectators=0):
+    ''' Runs a server with n_rooms games of n_clients stand-in clients each over loopback and reports what
+    happened. n_spectators spectators follow every game.'''
+    server = GameServer(seed=seed, verbose=verbose)
+    await server.start()
+    clients = []
+    for room in range(n_rooms):
+        # The first client opens a room, the others join it
+        first = Client('bot' + str(room) + '.0', binary)
+        await first.connect(server.host, server.port, 'new')
+        clients.append(first)
+        for i in range(1, n_clients):
+            client = Client('bot' + str(room) + '.' + str(i), binary)
+            await client.connect(server.host, server.port, first.room)
+            clients.append(client)
+    spectators = []
+    for client in clients[::n_clients]:
+        for i in range(n_spectators):
+            spectator = Client('spectator' + str(client.room) + '.' + str(i), binary)
+            await spectator.connect(server.host, server.port, client.room, True)
+            spectators.append(spectator)
+    watching = [asyncio.ensure_future(watch(x)) for x in spectators]
+    rng = random.Random(seed)
+    start = time.perf_counter()
+    results = await asyncio.gather(*[play_randomly(x, random.Random(rng.random()), turns) for x in clients])
+    elapsed = time.perf_counter() - start
+    for client, ended in zip(clients, results):
+        print('Room ' + str(client.room) + ', ' + client.player + ': ' + str(ended) + ' turns, ' +
+              str(len(client.events)) + ' events received' +
+              (', ' + str(client.bytes_received) + ' bytes' if binary else ''))
+    for client in clients:
+        client.close()
+    await server.stop()
+    await asyncio.gather(*watching)
+    for stats in server.stats():
+        print('Room ' + str(stats['room']) + ': ' + str(stats['actions']) + ' actions, ' +
+              str(stats['cpu_time']) + ' s cpu, ' + str(stats['arrays']) + ' bytes of arrays, ' +
+              str(stats['memory']) + ' bytes allocated, ' + str(stats['bytes_sent']) + ' bytes sent, ' +
+              str(stats['spectator_snapshots']) + ' catch-up snapshots for spectators')
+    print(str(n_rooms) + ' rooms played in ' + str(round(elapsed, 2)) + ' s')
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Run the authoritative game server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=0, help='port to listen on, 0 picks a free one')
+    parser.add_argument('--seed', type=int, help='seed for the maps and the drawpiles of the rooms')
+    parser.add_argument('--local', type=int, default=0, metavar='N',
+                        help='play games with N stand-in clients each over loopback instead of serving')
+    parser.add_argument('--rooms', type=int, default=1, help='number of games played at once with --local')
+    parser.add_argument('--turns', type=int, default=5, help='turns per stand-in client with --local')
+    parser.add_argument('--spectators', type=int, default=0, help='spectators per game with --local')
+    parser.add_argument('--binary', action='store_true', help='stand-in clients use the binary protocol')
+    parser.add_argument('--trace-memory', action='store_true', help='count the memory allocated by every room')
+    parser.add_argument('--metrics', help='port for the metrics on localhost or file to write them to, see Config.ini')
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    if args.trace_memory:
+        tracemalloc.start()
+    loop = asyncio.get_event_loop()
+    if args.local:
+        loop.run_until_complete(run_local(args.local, args.turns, args.seed, args.verbose, args.binary, args.rooms,
+                                        args.spectators))
+    else:
+        game_server = GameServer(seed=args.seed, host=args.host, port=args.port, verbose=True)
+        if args.metrics:
+            game_server.metrics = args.metrics
+        loop.run_until_complete(game_server.start())
+        loop.run_until_complete(game_server.finished.wait())
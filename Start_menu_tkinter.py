@@ -1,11 +1,124 @@
 import tkinter                          # Package for usie io
 import configparser                     # Package for handling the input/output from/to config ini files.
-import Visualize_tkinter as visualiser  # Runs the main program using tkinter io
+import Timing                           # Startup timing and lazy imports
 import re                               # Regular expression module for checking inputs
 import socket                           # Socket package for client/server communication
 import threading                        # Multithreading for the socket wait loops
+import selectors                        # Waiting for many sockets at once, for the lobby
+import queue                            # Thread safe queue between the lobby thread and tkinter
+import json                             # The join messages are json lines, like those of the game server
 from time import sleep                  # Wait function for the server and client while loops
 
+visualiser = Timing.lazy_import('Visualize_tkinter')  # Runs the main program using tkinter io, imported when the game starts
+
+
+class Lobby:
+    '''Lets players join a game hosted here. A player connects and sends a join message, a json line like
+    {"type": "join", "name": "bob"}, and gets {"type": "welcome", "seat": 2} back, or an error when the game is full.
+
+    A thread waits for the connections and their join messages with a selector, so any number of players can be
+    joining at the same time, and puts every player that joined in the joins queue. The selector blocks until a socket
+    is ready: nothing is polled and the thread takes no processor time while nobody joins. stop wakes it through a
+    socket pair. tkinter widgets may only be touched from the thread of the tkinter loop, so the lobby never touches
+    them; the start menu empties the queue from that thread (see Start_menu.poll_lobby).'''
+
+    def __init__(self, server_socket, seats):
+        self.server_socket = server_socket
+        self.seats = seats                              # Number of players that can still join
+        self.joins = queue.Queue()                      # (address, name) of every player that joined
+        self.players = []                               # Sockets of the players that joined, in the order they joined
+        self.pending = {}                               # Data received so far from connections which did not join yet
+        self.selector = selectors.DefaultSelector()
+        self.wakeup, self.wakeup_sender = socket.socketpair()
+        server_socket.setblocking(False)
+        self.selector.register(server_socket, selectors.EVENT_READ, self.accept)
+        self.selector.register(self.wakeup, selectors.EVENT_READ, None)
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def accept(self, server_socket):
+        try:
+            connection, address = server_socket.accept()
+        except BlockingIOError:
+            return                                      # Another join was faster
+        connection.setblocking(False)
+        self.pending[connection] = (address, b'')
+        self.selector.register(connection, selectors.EVENT_READ, self.read)
+
+    def drop(self, connection, reason=None):
+        ''' Closes a connection which did not join, telling it why if reason is given.'''
+        self.selector.unregister(connection)
+        del self.pending[connection]
+        if reason is not None:
+            self.send(connection, {'type': 'error', 'reason': reason})
+        connection.close()
+
+    def read(self, connection):
+        ''' Reads from a connection until its join message is complete, then seats the player.'''
+        address, data = self.pending[connection]
+        try:
+            received = connection.recv(4096)
+        except BlockingIOError:
+            return
+        except OSError:
+            received = b''
+        if not received:
+            self.drop(connection)
+            return
+        data += received
+        if b'\n' not in data:
+            if len(data) > 4096:
+                self.drop(connection, 'Expected join')
+            else:
+                self.pending[connection] = (address, data)
+            return
+        try:
+            hello = json.loads(data.split(b'\n')[0].decode())
+        except ValueError:
+            hello = None
+        # Only a join message with a name in it seats a player
+        name = hello.get('name') if isinstance(hello, dict) and hello.get('type') == 'join' else None
+        if not isinstance(name, str) or not name.strip():
+            self.drop(connection, 'Expected join')
+            return
+        name = name.strip()
+        if self.seats <= 0:
+            self.drop(connection, 'The game is full')
+            return
+        self.selector.unregister(connection)
+        del self.pending[connection]
+        self.seats -= 1
+        self.players.append(connection)
+        self.send(connection, {'type': 'welcome', 'seat': len(self.players) + 1})   # The host has seat 1
+        self.joins.put((address, name))
+
+    def run(self):
+        ''' Runs in the lobby thread: handles whatever socket is ready until stop is called.'''
+        while True:
+            for key, mask in self.selector.select():
+                if key.data is None:                    # Woken up by stop
+                    for connection in list(self.pending):
+                        self.drop(connection)
+                    self.selector.close()
+                    self.wakeup.close()
+                    return
+                key.data(key.fileobj)
+
+    def send(self, connection, message):
+        try:
+            connection.sendall((json.dumps(message) + '\n').encode())
+        except OSError:
+            pass
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        ''' Stops accepting players and waits for the lobby thread to end. The sockets of the players stay open.'''
+        self.wakeup_sender.send(b'x')
+        self.thread.join()
+        self.wakeup_sender.close()
+
+
 class Start_menu:
     def __init__(self):
         ''' Shows a startup menu with options to start or join a game and to provide player information. '''
@@ -81,7 +194,9 @@ class Start_menu:
             self.host_port_warning.set('')
 
         self.make_server_socket(1)                                                                              # Create a server socket
-        self.make_client_socket(self.host_IP_field.get(1.0,'end'),int(self.host_port_field.get(1.0,'end')))     # Bind to host
+        self.make_client_socket(self.host_IP_field.get(1.0,'end').strip(),int(self.host_port_field.get(1.0,'end')))     # Bind to host
+        # Join the game of the host, see Lobby
+        self.client_socket.sendall((json.dumps({'type': 'join', 'name': self.name_box.get(1.0, 'end').strip()}) + '\n').encode())
 
 
 
@@ -99,7 +214,7 @@ class Start_menu:
         hostname = socket.gethostname()                                         # Get the name of the computer
         self.IP = socket.gethostbyname(hostname)                                # Get IP adress
         self.port = self.server_socket.getsockname()[1]                         # Store the port number for later reference
-        self.server_socket.listen(5)                                            # Allow number of players minus yourself to connect
+        self.server_socket.listen(socket.SOMAXCONN)                             # Let every join through, the lobby turns players away when the game is full
 
     def start_screen(self):
         ''' Check the provided name'''
@@ -133,26 +248,28 @@ class Start_menu:
             port_box.insert('end', self.port)
             port_box.config(state='disabled', background="light grey")  # Disable editing
 
-            self.open_pressed = False
             #self.open_button = tkinter.Button(self.master, text='Open game', command=lambda: self.set_open_pressed())
             self.open_button = tkinter.Button(self.master, text='Open game', command=lambda: self.open_game())
             self.open_button.grid(row=8, column=0)
 
-    def wait_for_connections(self):
-        ''' Detect players connecting'''
-        while not self.open_pressed:            # Open_pressed in is connected to the open button
-            # accept connections from outside
-            self.server_socket.settimeout(1)    # Set a timeout of 1 s. The loop will keep trying to pick up conditions until the open button is pressed.
-            try:
-                (clientsocket, address) = self.server_socket.accept()                               # Try to accept an incoming connection
-                self.player_list[self.n_connected].config(state='normal', background="light grey")  # Enable the new player text field
-                self.player_list[self.n_connected].delete('1.0', 'end')                             # Emtpy the old contents
-                self.player_list[self.n_connected].insert('end',address)                            # Put the new player in the text field
-                self.player_list[self.n_connected].config(state='disabled', background="light grey")# Disable the text field for further manipulation
-                self.n_connected += 1                                                               # Increase the number of connected players
+    def poll_lobby(self):
+        ''' Shows the players that joined since the last call and checks again a little later, until the game starts.
+        Runs in the tkinter loop, the lobby thread only puts the joins in its queue.'''
+        self.show_joins()
+        self.lobby_poll = self.master.after(50, self.poll_lobby)
 
-            except:
-                pass
+    def show_joins(self):
+        ''' Shows the players in the join queue of the lobby and counts them as connected.'''
+        while True:
+            try:
+                address, name = self.lobby.joins.get_nowait()
+            except queue.Empty:
+                break
+            self.player_list[self.n_connected].config(state='normal', background="light grey")  # Enable the new player text field
+            self.player_list[self.n_connected].delete('1.0', 'end')                             # Emtpy the old contents
+            self.player_list[self.n_connected].insert('end', name + ' ' + address[0])           # Put the new player in the text field
+            self.player_list[self.n_connected].config(state='disabled', background="light grey")# Disable the text field for further manipulation
+            self.n_connected += 1                                                               # Increase the number of connected players
 
     def open_game(self):
         self.open_button.destroy()
@@ -177,14 +294,17 @@ class Start_menu:
             self.player_list[i].insert('end', '...waiting...')
             self.player_list[i].config(state='disabled', background="light grey")  # Disable editing
 
-        thread = threading.Thread(target=self.wait_for_connections)
-        thread.start()
+        self.lobby = Lobby(self.server_socket, int(self.n_players.get()) - 1)   # Accepts the players in a thread of its own
+        self.lobby.start()
+        self.poll_lobby()
 
         self.start_button = tkinter.Button(self.master, text='Start game', command=lambda: self.start_game())
         self.start_button.grid(row=20, column=0)
 
     def start_game(self):
-        self.open_pressed = True  # Make the server wait loop finish
+        self.master.after_cancel(self.lobby_poll)
+        self.lobby.stop()       # No more players can join
+        self.show_joins()       # Players may have joined after the last poll, they got their welcome already
 
         self.game_config.set('Players', 'n_players', str(self.n_players.get()))
         self.game_config.set('Self', 'name', self.name_box.get(1.0, 'end'))
@@ -0,0 +1,154 @@
+import numpy
+
+import Cards
+from Pawn import Pawn, Boat, Harbour, Home
+from Grid import Grid
+from Game import Game
+
+''' The whole state of a game as plain lists, dicts, strings and numbers, and back. capture takes it from a Grid and
+Game, restore makes a new Grid and Game from it which play on exactly like the originals. Everything the game set up
+at random (the board, the drawpiles, the player order) is in the state, so restoring needs neither the seed nor the
+temp ini files of the game. Used for the snapshots of the journal (see Journal).
+
+Cards are numbered by object: the copies of a card in a stack are one object, and the same card drawn from two
+drawpiles are two objects (with a different number of copies), so the state keeps a table of card objects and the
+stacks refer to it.'''
+
+VERSION = 1
+PIECES = {x.__name__: x for x in [Pawn, Boat, Harbour, Home]}
+STACKS = {x.__name__: x for x in [Cards.Stack, Cards.DrawPile, Cards.SizedStack]}
+DRAWPILES = ['sand_drawpile', 'forest_drawpile', 'meadow_drawpile', 'rock_drawpile', 'swamp_drawpile',
+             'assignment_stack']
+GAME_ATTRIBUTES = ['n_players', 'player_colors', 'player_order', 'turn', 'player_index', 'current_player',
+                   'turns_till_end']
+
+
+def capture(grid, game):
+    ''' Returns the state of grid and game.'''
+    cards = []
+    numbers = {}
+
+    def card_number(card):
+        if id(card) not in numbers:
+            numbers[id(card)] = len(cards)
+            # The tier stacks of assignments are stored with the players
+            cards.append({x: y for x, y in vars(card).items() if not isinstance(y, Cards.Stack)})
+        return numbers[id(card)]
+
+    def stack(cards_in):
+        data = {x: y for x, y in vars(cards_in).items() if x != 'stack'}
+        data['class'] = type(cards_in).__name__
+        data['cards'] = [card_number(x) for x in cards_in.stack]
+        return data
+
+    positions = {x.label: i for i, x in enumerate(grid.objects) if x}
+    pieces = []
+    for label in sorted(x for x, y in vars(game).items() if isinstance(y, Pawn)):
+        piece = getattr(game, label)
+        data = {x: y for x, y in vars(piece).items() if x not in ['resources', 'occupying_pawn']}
+        data['class'] = type(piece).__name__
+        data['index'] = positions.get(label, -1)
+        if hasattr(piece, 'resources'):
+            data['resources'] = stack(piece.resources)
+        if isinstance(piece, Boat):
+            data['occupying_pawn'] = piece.occupying_pawn.label if piece.occupying_pawn else None
+        pieces.append(data)
+
+    players = []
+    for label in sorted(game.player_order):
+        player = getattr(game, label)
+        players.append({'name': player.name, 'label': player.label, 'color': player.color, 'points': player.points,
+                        'assignment': card_number(player.assignment),
+                        'tier1': stack(player.assignment.tier1_stack),
+                        'tier2': stack(player.assignment.tier2_stack),
+                        'pawn_list': [x.label for x in player.pawn_list],
+                        'boat_list': [x.label for x in player.boat_list]})
+
+    selected = grid.selected if grid.selected == [] else int(grid.selected)
+    return {'version': VERSION,
+            'board': game.config.get('Game', 'board'),
+            'grid': {'size_x': grid.size_x, 'size_y': grid.n_hexes // grid.size_x,
+                     'tiles': list(grid.tiles), 'objects_init': list(grid.objects_init),
+                     'selected': selected, 'select_reachable': [int(x) for x in grid.select_reachable],
+                     'dig': bool(getattr(grid, 'dig', False))},
+            'game': {x: getattr(game, x) for x in GAME_ATTRIBUTES},
+            'drawpiles': {x: stack(getattr(game, x)) for x in DRAWPILES},
+            'pieces': pieces,
+            'players': players,
+            'cards': cards}
+
+
+def restore(state, config, visualiser):
+    ''' Returns a new grid and game with the state. config and visualiser are used like by a new Game; the files in
+    the config are not read, except for a compiled map of the board.'''
+    if state['version'] != VERSION:
+        raise ValueError('Cannot restore state version ' + str(state['version']) + ', expected ' + str(VERSION))
+
+    cards = []
+    for data in state['cards']:
+        card = lambda: 0
+        for key, value in data.items():
+            setattr(card, key, value)
+        cards.append(card)
+
+    def stack(data):
+        cards_out = STACKS[data['class']].__new__(STACKS[data['class']])
+        for key, value in data.items():
+            if key not in ['class', 'cards']:
+                setattr(cards_out, key, value)
+        cards_out.stack = [cards[x] for x in data['cards']]
+        return cards_out
+
+    data = state['grid']
+    grid = Grid(data['size_x'], data['size_y'], visualiser)
+    grid.tiles = list(data['tiles'])
+    grid.objects_init = list(data['objects_init'])
+    grid.set_connectivity(state['board'])
+
+    # The game is not set up again, it gets the state as it was
+    game = Game.__new__(Game)
+    game.grid = grid
+    game.visualiser = visualiser
+    game.events = grid.events
+    game.config = config
+    game.game_config = Cards.read_ini('Game.ini')
+    for key, value in state['game'].items():
+        setattr(game, key, value)
+    for key, value in state['drawpiles'].items():
+        setattr(game, key, stack(value))
+
+    for data in state['pieces']:
+        piece = PIECES[data['class']].__new__(PIECES[data['class']])
+        for key, value in data.items():
+            if key not in ['class', 'index', 'resources', 'occupying_pawn']:
+                setattr(piece, key, value)
+        if 'resources' in data:
+            piece.resources = stack(data['resources'])
+        setattr(game, piece.label, piece)
+        if data['index'] >= 0:
+            grid.objects[data['index']] = piece
+    for data in state['pieces']:
+        if 'occupying_pawn' in data:
+            getattr(game, data['label']).occupying_pawn = getattr(game, data['occupying_pawn']) \
+                if data['occupying_pawn'] else None
+
+    for data in state['players']:
+        def player(): return 0
+        player.name = data['name']
+        player.label = data['label']
+        player.color = data['color']
+        player.points = data['points']
+        player.assignment = cards[data['assignment']]
+        player.assignment.tier1_stack = stack(data['tier1'])
+        player.assignment.tier2_stack = stack(data['tier2'])
+        player.pawn_list = [getattr(game, x) for x in data['pawn_list']]
+        player.boat_list = [getattr(game, x) for x in data['boat_list']]
+        setattr(game, player.label, player)
+
+    data = state['grid']
+    grid.selected = data['selected']
+    grid.select_reachable = numpy.array(data['select_reachable'], dtype=int)
+    grid.dig = data['dig']
+    grid.game = game
+    return grid, game
+
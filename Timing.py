@@ -0,0 +1,212 @@
+import csv
+import sys
+import time
+import json
+import functools
+import importlib
+import tracemalloc
+from collections import deque
+from contextlib import contextmanager
+
+process_start = time.perf_counter()     # Reference point for the start times of all recorded phases
+
+
+class Recorder:
+    '''Records the wall time and memory allocations of named phases. Phases can be nested, the report indents them.
+
+    Allocations are only recorded when tracemalloc is running. Start python with PYTHONTRACEMALLOC=1 (or call
+    tracemalloc.start() yourself) to include them; tracing makes everything slower, so the wall times will be higher.'''
+
+    def __init__(self, name):
+        self.name = name
+        self.phases = []        # One dict per finished phase, in the order they started
+        self.depth = 0
+        self.enabled = True
+
+    @contextmanager
+    def phase(self, name):
+        '''Context manager which times the code inside it as phase name.'''
+        if not self.enabled:
+            yield None
+            return
+        record = {'name': name, 'depth': self.depth, 'start': time.perf_counter() - process_start}
+        self.phases.append(record)
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            memory_before = tracemalloc.get_traced_memory()[0]
+        self.depth += 1
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            record['seconds'] = time.perf_counter() - start
+            self.depth -= 1
+            if tracing:
+                memory_after, peak = tracemalloc.get_traced_memory()
+                record['allocated_kb'] = (memory_after - memory_before) / 1024
+                record['peak_kb'] = peak / 1024
+
+    def report(self):
+        '''Returns the recorded phases as a readable table.'''
+        lines = [self.name + ' (' + str(round((time.perf_counter() - process_start) * 1000)) + ' ms since start)']
+        for record in self.phases:
+            line = '  ' * (record['depth'] + 1) + record['name']
+            line = line.ljust(44) + str(round(record.get('seconds', 0) * 1000, 1)).rjust(9) + ' ms'
+            if 'allocated_kb' in record:
+                line += str(round(record['allocated_kb'])).rjust(9) + ' kB'
+            lines.append(line)
+        if not tracemalloc.is_tracing():
+            lines.append('  (allocations not recorded, run with PYTHONTRACEMALLOC=1 to include them)')
+        return '\n'.join(lines)
+
+    def as_dict(self):
+        return {'name': self.name, 'tracing_allocations': tracemalloc.is_tracing(), 'phases': self.phases}
+
+    def dump_json(self, file_name):
+        with open(file_name, 'w') as f:
+            json.dump(self.as_dict(), f, indent=1)
+
+    def close(self):
+        '''Stops recording. Code that is timed during startup can run many more times later on (e.g. a server creating
+        games), this keeps the list of phases from growing.'''
+        self.enabled = False
+
+    def output(self, setting):
+        '''Prints the report or writes it as json, depending on setting: 'no', 'print' or the name of a .json file.
+        Recording stops after this, the startup is over.'''
+        self.close()
+        if setting == 'print':
+            print(self.report())
+        elif setting.endswith('.json'):
+            self.dump_json(setting)
+            print('Startup timings written to ' + setting)
+
+
+startup = Recorder('Startup')  # Phases from launching main.py until the game board is shown
+
+
+class Interactions:
+    '''Records the latency of interactions with the user interface, e.g. clicks on the board, split into sections.
+
+    begin() starts an interaction and end() finishes it. Code that runs inside section(name) during an interaction
+    counts towards that section, minus the time of the sections nested inside it, so the sections add up to the
+    total. A section nested in itself (recursion) counts once. Outside an interaction, or when recording is not
+    enabled, section() does next to nothing, so instrumented code can stay in place. The last keep interactions are
+    kept for the percentiles and the csv export.'''
+
+    def __init__(self, keep=10000):
+        self.records = deque(maxlen=keep)
+        self.current = None     # Record of the interaction in progress
+        self.stack = []         # Names of the sections in progress, innermost last
+        self.columns = ['interaction', 'start', 'total']    # Then the other keys in the order they first appeared
+        self.times = ['start', 'total']     # Keys which hold times, the sections are added when they first run
+        self.enabled = False
+
+    def begin(self, name):
+        if self.enabled:
+            self.current = {'interaction': name, 'start': time.perf_counter() - process_start}
+            self.started = time.perf_counter()
+            self.stack = []
+
+    def end(self):
+        '''Finishes the interaction in progress and returns its record, None if there is none.'''
+        record = self.current
+        if record is not None:
+            record['total'] = time.perf_counter() - self.started
+            self.records.append(record)
+            self.current = None
+            for key in record:
+                if key not in self.columns:
+                    self.columns.append(key)
+        return record
+
+    def note(self, **info):
+        '''Adds information to the record of the interaction in progress, e.g. the clicked hex.'''
+        if self.current is not None:
+            self.current.update(info)
+
+    @contextmanager
+    def section(self, name):
+        '''Context manager which adds the time of the code inside it to section name of the current interaction.'''
+        if self.current is None or name in self.stack:
+            yield
+            return
+        record = self.current
+        self.stack.append(name)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+            self.stack.pop()
+            record[name] = record.get(name, 0) + seconds
+            if name not in self.times:
+                self.times.append(name)
+            record[name + '_calls'] = record.get(name + '_calls', 0) + 1
+            if self.stack:
+                parent = self.stack[-1]
+                record[parent] = record.get(parent, 0) - seconds
+
+    def timed(self, name):
+        '''Decorator which times every call of a function as section name.'''
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if self.current is None:
+                    return function(*args, **kwargs)
+                with self.section(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def percentiles(self, key='total', window=200, q=(50, 95, 99)):
+        '''Returns the percentiles q of key over the last window interactions, None if there are none. Percentiles are
+        interpolated between the nearest values, like numpy.percentile does. Timing is imported before anything else, so
+        it doesn't import numpy itself.'''
+        values = sorted(record.get(key, 0) for record in list(self.records)[-window:])
+        if not values:
+            return None
+        result = []
+        for percentile in q:
+            position = (len(values) - 1) * percentile / 100
+            low = int(position)
+            high = min(low + 1, len(values) - 1)
+            result.append(values[low] + (values[high] - values[low]) * (position - low))
+        return result
+
+    def dump_csv(self, file_name):
+        '''Writes all kept interactions to a csv file, one row each, with the times in ms.'''
+        seconds = self.times
+        with open(file_name, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow([key + '_ms' if key in seconds else key for key in self.columns])
+            for record in self.records:
+                writer.writerow([round(record[key] * 1000, 3) if key in seconds and key in record
+                                 else record.get(key, '') for key in self.columns])
+        print(str(len(self.records)) + ' interaction timings written to ' + file_name)
+
+
+interactions = Interactions()   # Clicks on the board and other user interactions
+
+
+class LazyModule:
+    '''Stand-in for a module which is only imported when one of its attributes is used. The import is recorded as a
+    phase of the recorder. Code paths which never touch the module (e.g. headless tools) don't pay for importing it.'''
+
+    def __init__(self, name, recorder):
+        self.__dict__['_name'] = name
+        self.__dict__['_recorder'] = recorder
+
+    def _load(self):
+        module = sys.modules.get(self._name)
+        if module is None:
+            with self._recorder.phase('import ' + self._name):
+                module = importlib.import_module(self._name)
+        return module
+
+    def __getattr__(self, attribute):
+        return getattr(self._load(), attribute)
+
+
+def lazy_import(name, recorder=startup):
+    return LazyModule(name, recorder)
@@ -0,0 +1,78 @@
+import math
+
+import numpy
+
+
+class Viewport:
+    '''The part of the board that is shown on the canvas, and at which zoom.
+
+    Positions on the board are in world pixels: the x_pix/y_pix coordinates of the hex centres at zoom 1. The canvas
+    draws everything at world pixels times zoom; left and top are the canvas coordinates of the top left corner of the
+    view. Everything here only depends on the size of the view, never on the number of hexes, so boards of any size
+    can be shown.'''
+
+    zoom_levels = [0.25, 0.35, 0.5, 0.7, 1, 1.4, 2]
+
+    def __init__(self, x_pix, y_pix, size_x, hex_size, width, height, margin=2):
+        self.x_pix = numpy.asarray(x_pix)
+        self.y_pix = numpy.asarray(y_pix)
+        self.size_x = size_x
+        self.size_y = len(self.x_pix) // size_x
+        self.hex_size = hex_size
+        self.width = width          # Size of the view in screen pixels
+        self.height = height
+        self.margin = margin        # Number of hexes around the view which are treated as visible
+        self.zoom_index = self.zoom_levels.index(1)
+        self.left = 0
+        self.top = 0
+        # Odd rows are shifted right by half a hex
+        self.stagger = self.x_pix[size_x] - self.x_pix[0] if self.size_y > 1 else 0
+
+    @property
+    def zoom(self):
+        return self.zoom_levels[self.zoom_index]
+
+    def board_size(self):
+        '''Width and height of the whole board in canvas pixels at the current zoom.'''
+        return (int(math.ceil((self.size_x + 0.5) * self.hex_size * self.zoom)),
+                int(math.ceil((self.size_y + 0.35) * self.hex_size * 0.75 * self.zoom)))
+
+    def to_world(self, canvas_x, canvas_y):
+        return canvas_x / self.zoom, canvas_y / self.zoom
+
+    def visible_hexes(self):
+        '''Returns the indices of the hexes which are (partly) in view, plus margin hexes on all sides.'''
+        row_step = 0.75 * self.hex_size
+        world_left, world_top = self.to_world(self.left, self.top)
+        world_right, world_bottom = self.to_world(self.left + self.width, self.top + self.height)
+        first_row = int(math.floor((world_top - self.y_pix[0] - 0.5 * self.hex_size) / row_step)) - self.margin
+        last_row = int(math.ceil((world_bottom - self.y_pix[0] + 0.5 * self.hex_size) / row_step)) + self.margin
+        first_col = int(math.floor((world_left - self.x_pix[0] - self.stagger - 0.5 * self.hex_size) / self.hex_size))
+        last_col = int(math.ceil((world_right - self.x_pix[0] + 0.5 * self.hex_size) / self.hex_size))
+        rows = numpy.arange(max(first_row, 0), min(last_row, self.size_y - 1) + 1)
+        cols = numpy.arange(max(first_col - self.margin, 0), min(last_col + self.margin, self.size_x - 1) + 1)
+        return (rows[:, None] * self.size_x + cols[None, :]).ravel()
+
+    def visible_tiles(self, tile_size):
+        '''Returns left, top, width and height of the tiles of tile_size canvas pixels which cover the view. Tiles on
+        the right and bottom edge of the board are cut off at the board size.'''
+        board_width, board_height = self.board_size()
+        tiles = []
+        for top in range(max(int(self.top // tile_size), 0) * tile_size,
+                         int(math.ceil(min(self.top + self.height, board_height))), tile_size):
+            for left in range(max(int(self.left // tile_size), 0) * tile_size,
+                              int(math.ceil(min(self.left + self.width, board_width))), tile_size):
+                tiles.append((left, top, min(tile_size, board_width - left), min(tile_size, board_height - top)))
+        return tiles
+
+    def zoom_at(self, step, screen_x, screen_y):
+        '''Zooms step levels in (positive) or out (negative), keeping the board pixel under screen_x, screen_y in the
+        same place. Returns False if the zoom is already at its limit.'''
+        new_index = min(max(self.zoom_index + step, 0), len(self.zoom_levels) - 1)
+        if new_index == self.zoom_index:
+            return False
+        world_x, world_y = self.to_world(self.left + screen_x, self.top + screen_y)
+        self.zoom_index = new_index
+        self.left = world_x * self.zoom - screen_x
+        self.top = world_y * self.zoom - screen_y
+        return True
@@ -1,49 +1,130 @@
 import tkinter
 import configparser
+import time
+from collections import OrderedDict
 
 import numpy
 
+import Boardimage
+import State
+from Panels import PlayerPanel, EnemyPanel, MessageLog
+from Viewport import Viewport
 from Grid import Grid
 from Game import Game
+from Timing import startup, interactions
+from Events import PiecePlaced, PieceRemoved, PieceMoved, PieceHighlighted, Highlighted, OptionShown, \
+    SelectionCleared, ObjectSelected, FuelSelected, CardCountsChanged, TurnChanged, ScoresChanged, Message, GameOver
 
 class MainTK:
-    def __init__(self,config_file):
+    def __init__(self, config_file, state=None, read_only=False):
+        ''' Sets up a new game, or shows the game in state (see State) if given. A read only window only shows the
+        game, e.g. for a replay (see Replay): clicks on the board, the end turn button and the resource popups are
+        off.'''
 
         ''' Load game config file '''
         self.log('Retrieving config from  ' + config_file)
         config = configparser.ConfigParser()
         config.read(config_file)
+        ''' The last lines of the log are kept in memory and, if configured, the whole log is written to a file.'''
+        self.log_history = MessageLog(None, config.getint('Visualiser', 'message_lines'),
+                                      history_file=self.history_file(config.get('Debug', 'log_history')))
 
         self.hex_size = config.getint('Visualiser','hex_size') #Horizontal hex size in pixels
 
-        '''Inititalize the functional part of the board grid '''
-        self.grid =  Grid(config.getint('Grid','hexes_x'), config.getint('Grid','hexes_y'), self)
-
-        ''' Convert the coordinates of the hex centers to coordinates in pixels'''
-        self.x_pix = (self.grid.x_coords+1)*self.hex_size/2
-        self.y_pix = (self.grid.y_coords*0.75+1)*self.hex_size/2 # Hex centers in y dir are actually 0.75 apart
+        self.read_only = read_only
 
-        ''' TKinter reference to the visualisations of currently selected hexes '''
-        self.sel_items = []
-
-        ''' List of links to movable items shapes and texts drawn on the board. There can be one object per hex. '''
-        self.objects_shape = [None] * self.grid.n_hexes
-        self.objects_text = [None] * self.grid.n_hexes
+        '''Inititalize the functional part of the board grid '''
+        with startup.phase('Hexgrid.__init__'):
+            if state is None:
+                self.grid =  Grid(config.getint('Grid','hexes_x'), config.getint('Grid','hexes_y'), self)
+            else:
+                self.grid, self.game = State.restore(state, config, self)   # Board and game as they were
+        ''' Grid and Game don't call the visualiser, they emit events for every change of the game state and the
+        visualiser turns them into changes of the board (see handle_event).'''
+        self.grid.events.subscribe(self.handle_event)
+        self.time_reachability(self.grid)
+
+        ''' What should be shown on each hex on top of the terrain: the piece as (shape, color, highlighted), the outline
+        color of a hex highlight and the option icons. The game only changes these states; redraw() then updates the
+        canvas for the hexes in self.dirty whose state differs from what is currently drawn on them. A change of
+        state schedules a frame (see request_frame), so all changes made while handling one click or button end up
+        in a single redraw. '''
+        self.piece_state = [None] * self.grid.n_hexes
+        self.highlight_state = [None] * self.grid.n_hexes
+        self.option_state = [()] * self.grid.n_hexes
+        self.drawn_state = [(None, None, ())] * self.grid.n_hexes   # The states the canvas items on each hex show
+        self.hex_items = [None] * self.grid.n_hexes  # Pool of canvas items of each hex in view, see create_hex_items
+        self.free_items = []        # Pools of hexes which went out of view, ready to be reused
+        self.n_pools = 0            # Number of pools created
+        self.in_view = set()        # Hexes in view (plus a margin) when the view was last updated
+        self.view_dirty = True      # The view moved or zoomed since the last frame
+        self.view_zoomed = True     # All pools have to be placed again
+        self.tiles_shown = {}       # Canvas image items of the terrain tiles in view by left, top
+        self.tile_images = OrderedDict()    # Recently used terrain tile images by zoom, left, top
+        self.dirty = set()          # Hexes whose state was set since the last redraw
+        self.selected_hexes = set() # Hexes with a highlight or option icons, cleared by remove_selected_items
+        self.frame_interval = 1 / config.getfloat('Visualiser', 'fps')  # Minimum time between two frames
+        self.frame_pending = None   # Tk id of the scheduled frame, None if no frame is scheduled
+        self.frame_requests = 0     # State changes since the last frame
+        self.last_frame = 0         # perf_counter time of the last frame
+        self.print_frames = config.get('Debug', 'frame_stats') == 'print'
+        self.frame_stats = {'frames': 0, 'requests': 0, 'hexes': 0, 'seconds': 0, 'max_seconds': 0}
 
         ''' Create the main screen'''
-        self.master = tkinter.Tk()           # The Tkinter master process
-        self.board = tkinter.Canvas(self.master, width=(self.grid.size_x+0.5)*self.hex_size, height=(self.grid.size_y+0.35)*self.hex_size*0.75, bd=0,highlightthickness=0) # Canvas for the play board
-        self.board.configure(bg="white")    # Set the background color for the playing board
-        self.board.grid(column=0,rowspan=8) # Make the height of the board extend over all rows if the rest of the interface as initialized below
+        with startup.phase('create main window'):
+            self.master = tkinter.Tk()           # The Tkinter master process
 
         #self.grid.grow_land(config.getint('Grid','n_land'),config.get('Grid', 'tile_file'))    # Create a random map
-        self.grid.load_map(config)          # Load map from file
+        if state is None:
+            with startup.phase('load_map'):
+                self.grid.load_map(config)          # Load map from file
+
+        ''' Convert the coordinates of the hex centers to coordinates in pixels. A compiled map already has them.'''
+        centres = self.grid.compiled.pixel_centres(self.hex_size) if self.grid.compiled else None
+        if centres:
+            self.x_pix, self.y_pix = centres
+        else:
+            self.x_pix = (self.grid.x_coords+1)*self.hex_size/2
+            self.y_pix = (self.grid.y_coords*0.75+1)*self.hex_size/2 # Hex centers in y dir are actually 0.75 apart
+
+        ''' The board is shown in a scrollable, zoomable view which is never larger than the configured size. Only the
+        hexes in view get canvas items, so the board can be much larger than the screen. '''
+        board_width = (self.grid.size_x+0.5)*self.hex_size
+        board_height = (self.grid.size_y+0.35)*self.hex_size*0.75
+        self.view = Viewport(self.x_pix, self.y_pix, self.grid.size_x, self.hex_size,
+                             int(min(board_width, config.getint('Visualiser', 'view_width'))),
+                             int(min(board_height, config.getint('Visualiser', 'view_height'))),
+                             config.getint('Visualiser', 'view_margin'))
+        board_frame = tkinter.Frame(self.master)
+        board_frame.grid(column=0,rowspan=8) # Make the height of the board extend over all rows if the rest of the interface as initialized below
+        self.board = tkinter.Canvas(board_frame, width=self.view.width, height=self.view.height, bd=0,highlightthickness=0) # Canvas for the play board
+        self.board.configure(bg="white")    # Set the background color for the playing board
+        x_scroll = tkinter.Scrollbar(board_frame, orient='horizontal', command=self.board.xview)
+        y_scroll = tkinter.Scrollbar(board_frame, orient='vertical', command=self.board.yview)
+        self.board.configure(scrollregion=(0, 0) + self.view.board_size(), xscrollincrement=1, yscrollincrement=1,
+                             xscrollcommand=lambda first, last: self.scrolled(x_scroll, first, last),
+                             yscrollcommand=lambda first, last: self.scrolled(y_scroll, first, last))
+        self.board.grid(column=0, row=0)
+        x_scroll.grid(column=0, row=1, sticky='ew')
+        y_scroll.grid(column=1, row=0, sticky='ns')
+
+        ''' Latency overlay: the timings of every click on the board, shown on top of the board (toggle with F3) and,
+        if latency_csv is set, written to a csv file when the game ends.'''
+        self.hud = tkinter.Label(board_frame, justify='left', anchor='nw', font='courier 9', bg='lightyellow')
+        self.hud_visible = False
+        self.latency_csv = config.get('Debug', 'latency_csv')
+        interactions.enabled = self.latency_csv != 'no'
+        if config.getboolean('Debug', 'latency_hud'):
+            self.toggle_hud()
+        self.master.bind('<F3>', lambda event: self.toggle_hud())
 
         self.tile_color = self.assign_tile_colors(config)   # Assign colors depending on the terrain type.
-        self.visualise_grid(config.get('Debug','show_index'))                               # Draw the map.
+        with startup.phase('visualise_grid'):
+            self.visualise_grid(config.get('Debug','show_index'), config.get('Visualiser','terrain_image'))  # Draw the map.
 
         ''' Add end-of-turn button'''
-        self.end_turn = tkinter.Button(self.master, text='End turn', command = lambda: self.game.end_player_turn(), anchor='e', justify='left', padx=2) # End of turn
+        self.end_turn = tkinter.Button(self.master, text='End turn', command = lambda: self.game.end_player_turn(), anchor='e', justify='left', padx=2,
+                                       state='disabled' if read_only else 'normal') # End of turn
         self.end_turn.grid(column=1,row=0)
 
         ''' Add a quit botton all the way at the bottom far away from the end turn button.'''
@@ -58,9 +139,17 @@ class MainTK:
         tkinter.Label(self.master,text='Messages:', font=('bold')).grid(column=1, row=5, sticky='ws')
         self.message_field = tkinter.Text(self.master, width=30, height=10, state='disabled')
         self.message_field.grid(columnspan=2, column=1, row=6, sticky='nw')
-
-        self.game = Game(config,self.grid,self)             # Initialize the game manager
-        self.grid.game = self.game                          # Set the grid's link to the game class, could not do that on grid init
+        self.message_log = MessageLog(self.message_field, config.getint('Visualiser', 'message_lines'),
+                                      config.getint('Visualiser', 'message_interval'),
+                                      self.history_file(config.get('Debug', 'message_history')))
+
+        if state is None:
+            with startup.phase('Game.__init__'):
+                self.game = Game(config,self.grid,self)             # Initialize the game manager
+            self.grid.game = self.game                          # Set the grid's link to the game class, could not do that on grid init
+        player_colors = {player: getattr(self.game, player).color for player in self.game.player_order}
+        self.message_log.set_players(player_colors)         # Player names in messages are shown in their color
+        self.log_history.set_players(player_colors)
 
         ''' Add score indicators for the players. '''
         tkinter.Label(self.master,text='Player points:', font=('bold')).grid(column=1, row=1, sticky='sw')
@@ -68,11 +157,33 @@ class MainTK:
         self.score_field.grid(columnspan=2, column=1, row=2, sticky='nw')
         self.game.update_points()       # Put info in the points field
         self.game.update_card_counts()  # Put info in the resource count field
-
-        self.board.bind("<Button 1>", lambda event: self.click(event))  # Mouse click event for the game map
+        if state is not None:
+            self.show_pieces()          # A restored game placed its pieces without events
+        self.redraw()                   # Draw the pieces placed by the game
+
+        if not read_only:
+            self.board.bind("<Button 1>", lambda event: self.click(event))  # Mouse click event for the game map
+        ''' Drag with the right mouse button to pan, use the mouse wheel to zoom. '''
+        self.board.bind("<ButtonPress-3>", lambda event: self.board.scan_mark(event.x, event.y))
+        self.board.bind("<B3-Motion>", lambda event: self.board.scan_dragto(event.x, event.y, gain=1))
+        self.board.bind("<MouseWheel>", lambda event: self.zoom(1 if event.delta > 0 else -1, event.x, event.y))
+        self.board.bind("<Button-4>", lambda event: self.zoom(1, event.x, event.y))     # Mouse wheel on X11
+        self.board.bind("<Button-5>", lambda event: self.zoom(-1, event.x, event.y))
         self.popup = []         # Iniitialize reference variable to popup windows so we can destroy them from everywhere.
+        ''' The resource popups are built once and only filled and shown on a click. They show popup_rows resources at
+        a time and scroll through the rest.'''
+        self.player_panel = PlayerPanel(self, config.getint('Visualiser', 'popup_rows'))
+        self.enemy_panel = EnemyPanel(self, config.getint('Visualiser', 'popup_rows'))
+
+        startup.output(config.get('Debug', 'startup_report'))   # Report where the startup time went, if configured
         #tkinter.mainloop()      # Start the tkinter loop
 
+    def add_option(self, index, option):
+        ''' Adds an option icon to hex index: dig, board (arrow into a boat), unboard (arrow out of a boat) or steal.'''
+        if option not in self.option_state[index]:
+            self.set_state(self.option_state, index, self.option_state[index] + (option,))
+        self.selected_hexes.add(index)
+
     def add_player_tag(self, textbox, message):
         ''' Adds formatting to a text field which highlights the player's name in his color. '''
         if hasattr(self, 'game'): # Prevent the next from running on messages during game init.
@@ -85,19 +196,19 @@ class MainTK:
             start = -1
         return start
 
-    def ass_enable_1(self, isenabled):
-        ''' Enabled the fulfill button for tier 1 assignment.'''
-        if isenabled:
-            self.b1.config(state='normal')
-        else:
-            self.b1.config(state='disabled')
-
-    def ass_enable_2(self, isenabled):
-        ''' Enabled the fulfill button for tier 2 assignment.'''
-        if isenabled:
-            self.b2.config(state='normal')
-        else:
-            self.b2.config(state='disabled')
+    def arrow_coords(self, index, down):
+        ''' Returns the corners of the option arrow on hex index, pointing down into a boat or up out of it.'''
+        x_pix = self.x_pix[index] * self.view.zoom
+        y_pix = self.y_pix[index] * self.view.zoom
+        hex_size = self.hex_size * self.view.zoom
+        tail = -0.3 if down else 0.3        # The tail is above the centre for down arrows, below it for up arrows
+        return [x_pix + 0.15*hex_size, y_pix + tail*hex_size,
+                x_pix - 0.15*hex_size, y_pix + tail*hex_size,
+                x_pix - 0.15*hex_size, y_pix,
+                x_pix - 0.25 * hex_size, y_pix,
+                x_pix, y_pix - 2/3*tail * hex_size,
+                x_pix + 0.25 * hex_size, y_pix,
+                x_pix + 0.15*hex_size, y_pix]
 
     def assign_tile_colors(self,config):
         ''' Assigns colors to each hex based on the terrain type. Replace with graphics later.'''
@@ -133,126 +244,171 @@ class MainTK:
         ''' Function to be called when the player clicks anywhere on the map. Retrieve the index of the clicked hex 
         based on the x,y coordinates by choosing the hex with shortest distance to center. '''
 
-        if self.popup:          # If a popup window is open, destroy it first.
+        interactions.begin('click')     # Only records anything if the latency overlay or csv is switched on
+        with interactions.section('draw'):
+            self.close_popup()      # If a popup window is open, close it first.
+
+        ''' Find the index of the clicked hex. The click is converted to board pixels at zoom 1 first, then only the
+        hexes in the two rows around it are tested.'''
+        with interactions.section('pick'):
+            x, y = self.view.to_world(self.board.canvasx(event.x), self.board.canvasy(event.y))
+            index = int(Boardimage.hex_at(x, y, self.x_pix, self.y_pix, self.grid.size_x, self.hex_size)[0])
+            ''' Check whether the clicked pixel is inside the possible location of the "dig" option box '''
+            if self.x_pix[index] - 0.3 * self.hex_size < x < self.x_pix[index] + 0.3 * self.hex_size and self.y_pix[
+                index] - 0.3 * self.hex_size < y < self.y_pix[index]:
+                self.grid.dig = True
+            else:
+                self.grid.dig = False
+        interactions.note(hex=index)
+
+        with interactions.section('logic'):
+            self.grid.activate_hex(index)    # Activate the grid in the grid manager.
+
+        ''' When the click is recorded, its frame is drawn and flushed to the screen right away instead of in the
+        scheduled frame, so all the time it takes until the result is on screen is part of the click.'''
+        if interactions.current is not None:
+            with interactions.section('draw'):
+                self.redraw()
+            with interactions.section('flush'):
+                self.master.update_idletasks()
+            interactions.note(canvas_items=len(self.board.find_all()))
+            record = interactions.end()
+            if self.hud_visible:
+                self.show_hud(record)
+
+    def close_popup(self):
+        ''' Hides the resource popups and destroys any other popup window.'''
+        self.player_panel.hide()
+        self.enemy_panel.hide()
+        if self.popup:
             self.popup.destroy()
             self.popup = []
 
-        ''' Find the index of the clicked hex '''
-        ''' I'll use the squared distances rather than actual distances. This safes a number of square root calculations and the ordering will not be affected.'''
-        dist = (self.x_pix - event.x)**2 + (self.y_pix - event.y)**2
-        index = numpy.argmin(dist)
-        ''' Check whether the clicked pixel is inside the possible location of the "dig" option box '''
-        if self.x_pix[index] - 0.3 * self.hex_size < event.x < self.x_pix[index] + 0.3 * self.hex_size and self.y_pix[
-            index] - 0.3 * self.hex_size < event.y < self.y_pix[index]:
-            self.grid.dig = True
-        else:
-            self.grid.dig = False
-
-        self.grid.activate_hex(index)    # Activate the grid in the grid manager.
-
-    def draw_hex(self,index,line_color,line_width,fill_color):
-        ''' Draws a hex at the specified location. The location and size of the hex is determined by configurable parameters in de grid class '''
-        ''' A list of pointers to the drawn objects is returned which can be used to later remove them if necessary. '''
-
-        x_pix = self.x_pix[index]
-        y_pix = self.y_pix[index]
-
-        return self.board.create_polygon(x_pix-0.5*self.hex_size+0.5*line_width/2, y_pix-0.25*self.hex_size+0.87*line_width/2,
-                                         x_pix-0.5*self.hex_size+0.5*line_width/2, y_pix+0.25*self.hex_size-0.866*line_width/2,
-                                         x_pix, y_pix+0.5*self.hex_size-line_width/2,
-                                         x_pix+0.5*self.hex_size-0.5*line_width/2, y_pix+0.25*self.hex_size-0.87*line_width/2,
-                                         x_pix+0.5*self.hex_size-0.5*line_width/2, y_pix-0.25*self.hex_size+0.87*line_width/2,
-                                         x_pix, y_pix-0.5*self.hex_size+line_width/2,
-                                         outline=line_color,width=line_width, fill=fill_color)
-        self.board.update()
+    def create_hex_items(self):
+        ''' Creates a pool of canvas items for showing a hex: when the terrain is not an image the terrain polygon and
+        index, then the highlight, a shape for each kind of piece, the dig option and the option arrow. All are created
+        hidden, from bottom to top, and are only reconfigured from then on; place_hex_items puts them on a hex. All
+        items of the pool share a tag, so they can be hidden in one go. Returns a dict with the items by name.'''
+        tag = 'pool' + str(self.n_pools)
+        self.n_pools += 1
+        hex_corners = [0] * 12
+        items = {'tag': tag}
+        if self.terrain_cache == 'no':
+            items['terrain'] = self.board.create_polygon(*hex_corners, outline='grey', width=2, state='hidden', tags=tag)
+            if self.print_index:
+                items['index'] = self.board.create_text(0, 0, state='hidden', tags=tag)
+        items['highlight'] = self.board.create_polygon(*hex_corners, width=4, fill='', state='hidden', tags=tag)    # Outline only, the terrain shows through
+        items['boat'] = self.board.create_rectangle(0, 0, 0, 0, state='hidden', tags=(tag, 'piece'))
+        items['pawn'] = self.board.create_oval(0, 0, 0, 0, state='hidden', tags=(tag, 'piece'))
+        items['town'] = self.board.create_polygon(0, 0, 0, 0, 0, 0, state='hidden', tags=(tag, 'piece'))
+        items['dig'] = self.board.create_polygon(0, 0, 0, 0, 0, 0, 0, 0, outline = 'black', fill='white', state='hidden',
+                                                 tags=(tag, 'option'))
+        items['dig_text'] = self.board.create_text(0, 0, text='Dig', state='hidden', tags=(tag, 'option'))
+        items['arrow'] = self.board.create_polygon(*self.arrow_coords(0, True), outline = 'black', fill='white',
+                                                   state='hidden', tags=(tag, 'option'))
+        return items
 
     def draw_object(self, index, object, option='normal'):
-        '''Draws an object on the canvas at hex index, either normal or highlighted'''
-        obj_x = self.x_pix[index] - 0.2 * self.hex_size
-        obj_y = self.y_pix[index] + 0.2 * self.hex_size
-        obj_x1 = obj_x
-        obj_y1 = obj_y
-        obj_x2 = obj_x + self.hex_size * 0.2
-        obj_y2 = obj_y + self.hex_size * 0.2
-
-        if option == 'highlight' and 'boat' in object.label:
-            self.objects_shape[index] = self.board.create_rectangle(obj_x1, obj_y1, obj_x2, obj_y2, fill=object.color, outline='pink', width=5)
-        elif 'boat' in object.label:
-            self.objects_shape[index] = self.board.create_rectangle(obj_x1, obj_y1, obj_x2, obj_y2, fill=object.color)
-        elif option == 'highlight' and 'team' in object.label:
-            self.objects_shape[index] = self.board.create_oval(obj_x1, obj_y1, obj_x2, obj_y2, fill=object.color, outline='pink', width=5)
+        '''Sets the object shown at hex index, either normal or highlighted. It is drawn on the next redraw.'''
+        if 'boat' in object.label:
+            shape = 'boat'
         elif 'team' in object.label:
-            self.objects_shape[index] = self.board.create_oval(obj_x1, obj_y1, obj_x2, obj_y2, fill=object.color)
+            shape = 'pawn'
         elif 'harbour' in object.label or 'home' in object.label:
-            ''' Draws the player's harbour at index'''
-            x_pix = self.x_pix[index]
-            y_pix = self.y_pix[index]
-            if option == 'highlight':
-                self.objects_shape[index] = self.board.create_polygon(x_pix - 0.4 * self.hex_size, y_pix - 0.3 * self.hex_size,
-                                          x_pix + 0.4 * self.hex_size, y_pix - 0.3 * self.hex_size,
-                                          x_pix, y_pix + 0.3 * self.hex_size,
-                                          fill=object.color, outline='pink', width=5)
-            else:
-                self.objects_shape[index] = self.board.create_polygon(x_pix - 0.4 * self.hex_size, y_pix - 0.3 * self.hex_size,
-                                          x_pix + 0.4 * self.hex_size, y_pix - 0.3 * self.hex_size,
-                                          x_pix, y_pix + 0.3 * self.hex_size,
-                                          outline='black', fill=object.color)
-
+            shape = 'town'
         else:
             self.log('Error, cannot draw ' + object.label)
+            return
+        self.set_state(self.piece_state, index, (shape, object.color, option == 'highlight'))
 
     def enemy_resources_popup(self, index):
         '''Prints an overview of the resources in the stack belonging to an object on the board.'''
-        self.popup = tkinter.Toplevel(self.master)      # Create a popup window and wait for it to close)
-
-        self.popup.title(self.grid.objects[index].label )
-
-        tkinter.Label(self.popup, text = 'opponent resources').grid(row=0, sticky='W')
-
-        isoccupied = ''
-        if hasattr(self.grid.objects[index],'occupying_pawn'): # Only boats have this attribute
-            if self.grid.objects[index].occupying_pawn:
-                isoccupied = '(pawn)'
-
-        t = tkinter.Text(self.popup, width=30, height=1)
-        t.config(wrap=tkinter.WORD)
-        t.grid(columnspan=2, row=1)
-        t.insert('end',self.grid.objects[index].label + isoccupied + '\n')
-
-
-        ''' Create radio buttons for stealing one resource.'''
-        rows = 2 # Count the number of rows in the popup window
-        keep_i = 0 # Dummy for counting the number of resources and updating the total nr of rows in the widget later.
-        self.steal_resource_var = tkinter.IntVar()
-        for i in range(rows,self.grid.objects[index].resources.get_size()+rows):
-            tkinter.Radiobutton(self.popup, text=self.grid.objects[index].resources.stack[i - rows].name, variable=self.steal_resource_var, value=i - rows).grid(row=rows + keep_i, column=1, stick='W')
-            keep_i = i
-        rows = keep_i
-
-        '''  If a current player ship with moves = 0 and stealing ability is adjacent show a button. '''
-        has_objects = self.grid.get_reachable_object_indices('all', index, 1)
-        boats = [x for x in has_objects if (self.game.current_player + 'boat') in self.grid.objects[x].label]  # Find current players ships one removed
-        pirates = [x for x in boats if self.grid.objects[x].moves == 0 and self.grid.objects[x].can_steal]     # Only keep enemy ships that have moves = 0 and can steal = True
-
-        for i in pirates:
-            tkinter.Button(self.popup, text=self.grid.objects[i].label, command=lambda i=i: self.steal_resource(index, i, self.steal_resource_var)).grid(row = rows+i+1, column=0, sticky='W', pady=4)
-            rows = rows + 1
-
-        self.master.wait_window(self.popup)  # Create a popup window and wait for it to close
-
+        with interactions.section('draw'):
+            self.redraw()                               # The board has to be up to date while the popup is open
+            self.close_popup()
+            self.enemy_panel.show(index)
+
+    def hex_corners(self, indices, line_width):
+        ''' Returns the canvas coordinates of the six corners of the hexes in indices as rows of x1, y1, ..., x6, y6. The
+        corners are moved inwards by half the line width, so the outline stays inside the hex. All hexes are done at
+        once on whole arrays.'''
+        x_pix = numpy.asarray(self.x_pix)[indices] * self.view.zoom
+        y_pix = numpy.asarray(self.y_pix)[indices] * self.view.zoom
+        hex_size = self.hex_size * self.view.zoom
+        # Offsets of the corners from the hex centre, starting at the top left and going round anti-clockwise
+        dx = numpy.array([-0.5*hex_size+0.5*line_width/2, -0.5*hex_size+0.5*line_width/2, 0,
+                          0.5*hex_size-0.5*line_width/2, 0.5*hex_size-0.5*line_width/2, 0])
+        dy = numpy.array([-0.25*hex_size+0.87*line_width/2, 0.25*hex_size-0.866*line_width/2,
+                          0.5*hex_size-line_width/2, 0.25*hex_size-0.87*line_width/2,
+                          -0.25*hex_size+0.87*line_width/2, -0.5*hex_size+line_width/2])
+        corners = numpy.empty((len(x_pix), 12))
+        corners[:, 0::2] = x_pix[:, None] + dx
+        corners[:, 1::2] = y_pix[:, None] + dy
+        return corners.tolist()
+
+    def handle_event(self, event):
+        ''' Shows an event emitted by Grid or Game. Board changes only set the states of the hexes, they are drawn in
+        the next frame.'''
+        if isinstance(event, PiecePlaced):
+            self.draw_object(event.index, self.grid.objects[event.index])
+        elif isinstance(event, PieceHighlighted):
+            self.draw_object(event.index, self.grid.objects[event.index],
+                             'highlight' if event.highlighted else 'normal')
+        elif isinstance(event, PieceRemoved):
+            self.remove_object(event.index)
+        elif isinstance(event, PieceMoved):
+            self.remove_object(event.source)
+            self.draw_object(event.destination, self.grid.objects[event.destination])
+        elif isinstance(event, Highlighted):
+            for i in event.indices:
+                self.highlight_hex(i, event.kind)
+        elif isinstance(event, OptionShown):
+            self.add_option(event.index, event.option)
+        elif isinstance(event, SelectionCleared):
+            self.remove_selected_items()
+        elif isinstance(event, ObjectSelected):
+            # Towns and boats open their resource popup, pawns have no resources
+            if 'team' not in event.label and not self.read_only:
+                if event.own:
+                    self.player_resources_popup(event.index)
+                else:
+                    self.enemy_resources_popup(event.index)
+        elif isinstance(event, FuelSelected):
+            self.close_popup()      # The boat's resource popup
+        elif isinstance(event, CardCountsChanged):
+            self.update_card_counts(*event)
+        elif isinstance(event, (TurnChanged, ScoresChanged)):
+            self.update_scores()
+        elif isinstance(event, Message):
+            self.message(event.text)
+        elif isinstance(event, GameOver):
+            self.kill(event.scores)
 
     def highlight_hex(self,index,type):
-        '''Runs draw_hex and adds the reference to the objects to the sel_hex list'''
+        '''Highlights hex index with a red (reachable by the selected piece) or green (the selected piece) outline'''
 
-        if type == 'pawn':
-            refs = self.draw_hex(index,'red',4, self.tile_color[index])
+        if type == 'reachable':
+            self.set_state(self.highlight_state, index, 'red')
         else:
-            refs = self.draw_hex(index,'green',4, self.tile_color[index])
+            self.set_state(self.highlight_state, index, 'green')
+        self.selected_hexes.add(index)
 
-        self.sel_items = self.sel_items + [refs]
+    def history_file(self, setting):
+        ''' Returns the file name of a history file setting, None if it is set to no.'''
+        if setting == 'no':
+            return None
+        return setting
 
     def kill(self,message):
         ''' Displays a popup with who won the game. When this is closed, the programm is killed. '''
+        self.redraw()
+        self.log('Rendering: ' + self.frame_report())
+        if interactions.records:
+            self.log('Click latency: ' + self.latency_report())
+        if self.latency_csv != 'no':
+            interactions.dump_csv(self.latency_csv)
+        self.message_log.close()            # Show the last messages and write the history files
+        self.log_history.close()
 
         self.popup = tkinter.Toplevel(self.master)
         t = tkinter.Text(self.popup,width = 30, height = 10)
@@ -263,8 +419,7 @@ class MainTK:
 
     def kill_choice(self):
         ''' Displays a yes/no option when the quit button is pressed and then acts accourdingly.'''
-        if self.popup:
-            self.popup.destroy()
+        self.close_popup()
 
         self.popup = tkinter.Toplevel(self.master)
         msg = tkinter.Label(self.popup, text='Are you sure you want to quit?')
@@ -275,275 +430,238 @@ class MainTK:
         yes.grid(row=1,column=0)
         no.grid(row=1,column=1)
 
+    def latency_report(self):
+        ''' Returns the rolling percentiles of the click latency as a line of text.'''
+        p50, p95, p99 = interactions.percentiles()
+        return ('p50/p95/p99 ' + str(round(p50 * 1000, 1)) + '/' + str(round(p95 * 1000, 1)) + '/' +
+                str(round(p99 * 1000, 1)) + ' ms over the last ' + str(min(len(interactions.records), 200)) + ' clicks')
+
     def log(self, message):
-        ''' Logging function. For now it just prints to the command line, but a logfile might be handy at some point.'''
+        ''' Logging function. Prints to the command line and keeps the message in the log history.'''
         print(message)
+        if hasattr(self, 'log_history'):   # The first message is logged before the config is read
+            self.log_history.add(message)
 
     def message(self, message):
-        ''' Prints a message to the message screen on the user interface. '''
+        ''' Prints a message to the message screen on the user interface. The screen is updated by the message log a
+        few times per second at most and only shows the last message_lines messages.'''
         self.log(message)                                   # All messages are sent to the log too
-        #self.message_field.tag_config('player', foreground = 'blue')
-        self.message_field.config(state = 'normal')         # Enable editing of text
-        self.message_field.insert(1.0, message + '\n')      # Add the message at the top of the box
-        self.add_player_tag(self.message_field, message)
-        self.message_field.config(state = 'disabled')       # Disable editing
+        self.message_log.add(message)
+
+    def place_hex_items(self, items, index):
+        ''' Moves the items of a pool onto hex index at the current zoom. The arrow is placed when it is shown.'''
+        coords = self.board.coords
+        x_pix = self.x_pix[index] * self.view.zoom
+        y_pix = self.y_pix[index] * self.view.zoom
+        hex_size = self.hex_size * self.view.zoom
+        obj_x = x_pix - 0.2 * hex_size
+        obj_y = y_pix + 0.2 * hex_size
+        if 'terrain' in items:
+            coords(items['terrain'], *self.hex_corners([index], 2)[0])
+            self.board.itemconfigure(items['terrain'], fill=self.tile_color[index], state='normal')
+        if 'index' in items:
+            coords(items['index'], x_pix, y_pix)
+            self.board.itemconfigure(items['index'], text=str(index), state='normal')
+        coords(items['highlight'], *self.hex_corners([index], 4)[0])
+        coords(items['boat'], obj_x, obj_y, obj_x + hex_size * 0.2, obj_y + hex_size * 0.2)
+        coords(items['pawn'], obj_x, obj_y, obj_x + hex_size * 0.2, obj_y + hex_size * 0.2)
+        coords(items['town'], x_pix - 0.4 * hex_size, y_pix - 0.3 * hex_size,
+               x_pix + 0.4 * hex_size, y_pix - 0.3 * hex_size,
+               x_pix, y_pix + 0.3 * hex_size)
+        coords(items['dig'], x_pix - 0.3*hex_size, y_pix,
+               x_pix + 0.3*hex_size, y_pix,
+               x_pix + 0.3*hex_size, y_pix-0.3*hex_size,
+               x_pix - 0.3*hex_size, y_pix-0.3*hex_size)
+        coords(items['dig_text'], x_pix-0.1*hex_size, y_pix-0.12*hex_size)
 
     def player_resources_popup(self, index):
         '''Prints an overview of the resources in the stack belonging to an object on the board.'''
-        self.popup = tkinter.Toplevel(self.master)      # Create a popup window and wait for it to close)
-
-        ''' Show object info'''
-        ''' First prepare a string to indicate whether the clicked object belongs to the active player.'''
-        isoccupied = ''
-        if hasattr(self.grid.objects[index],'occupying_pawn_label'): # Only boats have this attribute
-            if len(self.grid.objects[index].occupying_pawn_label) > 1:
-                isoccupied = '(pawn)'
-
-        t = tkinter.Text(self.popup,width=30,height=1)
-        t.config(wrap=tkinter.WORD)
-        t.grid(column=0, row=0, columnspan=5)
-        t.insert('end',self.grid.objects[index].label + '(active)' + isoccupied + '\n')
-
-        tkinter.Label(self.popup, text = 'Move resources').grid(column=0, row=1, sticky='W')
-
-        ''' Create buttons for shifting resources to neigboring objects if any are present. '''
-        ''' Get the indices of hexes one step removed from the active hex and find harbors, homebases and boats.'''
-        has_object = self.grid.get_reachable_object_indices('all', index, 1)
-
-        dest_harbour = [x for x in has_object if (self.game.current_player + 'harbour') in self.grid.objects[x].label]
-        dest_home = [x for x in has_object if (self.game.current_player + 'home') in self.grid.objects[x].label]
-        dest_boat = [x for x in has_object if (self.game.current_player + 'boat') in self.grid.objects[x].label]
-
-        rows = 2
-        ''' For each harbour, home base and boat 1 step removed, add a button for shifting resources.'''
-        for i in dest_harbour:
-            tkinter.Button(self.popup, text=self.grid.objects[i].label, command=lambda i=i: self.game.shift_resources(index, i, vars)).grid(row=rows, column=0, sticky='W', pady=4)
-            rows = rows + 1
-
-        for i in dest_home:
-            tkinter.Button(self.popup, text=self.grid.objects[i].label, command=lambda i=i: self.game.shift_resources(index, i, vars)).grid(row=rows, column=0, sticky='W', pady=4)
-            rows = rows + 1
-
-        for i in dest_boat:
-            # tkinter.Button(popup, text=grid.objects[i], command=print('boat'+str(i))).grid(row=rows+i+1, sticky='W', pady=4)
-            tkinter.Button(self.popup, text=self.grid.objects[i].label, command=lambda i=i: self.game.shift_resources(index, i, vars)).grid(row=rows,
-                                                                                               column=0, sticky='W', pady=4)
-            rows = rows + 1
-
-        ''' TODO Position the popup in the corner furthest away from the clicked hex in order to prevent overlap with reachable hexes. '''
-        ''' For now I just position the window right of the board.'''
-        y_main = self.master.winfo_y()
-        w_main = self.master.winfo_width()
-        self.popup.geometry('+' + str(w_main) + '+' + str(y_main))
-
-
-
-        t = tkinter.Text(self.popup,width=30,height=1)
-        t.config(wrap=tkinter.WORD)
-        t.grid(column=0,row=rows)
-
-        ''' Create a list of checkboxes for all resources'''
-        rows = 1 # Count the number of rows in the popup window
-        keep_i = 0 # Dummy for counting the number of resources and updating the total nr of rows in the widget later.
-        checks = [] # Declare the list of checkboxes
-        vars = [] # Declare the list of variables belonging to the checkboxes
-        for i in range(rows,self.grid.objects[index].resources.get_size()+rows):
-            vars.append(tkinter.IntVar())   # Add a variable to the list
-            desc = self.grid.objects[index].resources.stack[i-rows].name + ' (ewsmf: ' + self.grid.objects[index].resources.stack[i-rows].earth + ' ' + \
-                   self.grid.objects[index].resources.stack[i - rows].wood + ' ' + self.grid.objects[index].resources.stack[i - rows].stone + ' ' + \
-                   self.grid.objects[index].resources.stack[i - rows].metal + ' ' + self.grid.objects[index].resources.stack[i-rows].fuel + ' ' + \
-                   self.grid.objects[index].resources.stack[i - rows].collect + ')'
-
-            checks.append([tkinter.Checkbutton(t, text = desc,variable = vars[i-rows]).grid(row = i, column=0,sticky='w')])
-            keep_i = i
-        rows = keep_i
-
-
-
-        ''' For boats belonging to the active player we add a radiobutton with the fuel resources. Changing the dial will change the moveable hexes.'''
-        if 'boat' in self.grid.objects[index].label and self.game.current_player in self.grid.objects[index].label and self.grid.objects[index].occupying_pawn:
-            tkinter.Label(self.popup, text='Move options').grid(row=1, column= 1, sticky='W')
-            t = tkinter.Text(self.popup, width=30)
-            t.config(wrap=tkinter.WORD)
-            t.grid(row=2, rowspan=4, column=1, sticky='W')
-
-            ''' Create a list of radiobuttons for all resources'''
-            self.burn_resource_var = tkinter.IntVar()
-            self.burn_resource_var.set(self.grid.objects[index].selected_fuel)  # Set the radiobutton variable to the selected fuel indicator of the boat object
-            tkinter.Radiobutton(t, text='Row', variable = self.burn_resource_var, value = -1, command = lambda: self.game.boat_select_fuel(index, self.burn_resource_var.get())).grid(row=1, column=1, stick = 'W')# 0: only use basic moves, don't use fuel
-            rows = 2  # Count the number of rows in the popup window
-            keep_i = 0
-            for i in range(rows, self.grid.objects[index].resources.get_size() + rows):
-                if int(self.grid.objects[index].resources.stack[i - rows].fuel) > 0:
-                    tkinter.Radiobutton(t, text=self.grid.objects[index].resources.stack[i - rows].name, variable=self.burn_resource_var, value = i - rows, command = lambda: self.game.boat_select_fuel(index, self.burn_resource_var.get())).grid(row=rows+keep_i, column=1, stick='W')
-                    keep_i = keep_i+1  # Count the number of rows in the popup window
-
-        ''' For home bases belonging to the active player we add an overview of the assignment.'''
-        if 'home' in self.grid.objects[index].label and self.game.current_player in self.grid.objects[index].label:
-            # Retrieve the active player assignment
-            assignment = self.game.get_current_player().assignment               # Also used for call by checkbuttons!
-            self.show_assignment(index, self.popup, assignment, vars)
-            self.show_resource_choices(index,self.popup,assignment)
-
-        self.master.wait_window(self.popup)  # Create a popup window and wait for it to close
+        with interactions.section('draw'):
+            self.redraw()                               # The board has to be up to date while the popup is open
+            self.close_popup()
+            self.player_panel.show(index)
+
+    def frame_report(self):
+        ''' Returns the frame statistics as a line of text.'''
+        stats = self.frame_stats
+        frames = max(stats['frames'], 1)
+        return (str(stats['frames']) + ' frames, ' + str(round(stats['requests'] / frames, 1)) + ' state changes and ' +
+                str(round(stats['hexes'] / frames, 1)) + ' hexes per frame, ' +
+                str(round(stats['seconds'] / frames * 1000, 2)) + ' ms per frame on average, ' +
+                str(round(stats['max_seconds'] * 1000, 2)) + ' ms at most')
+
+    def redraw(self):
+        ''' Draws a frame: updates the canvas for the hexes in the dirty set. Nothing is deleted or created: the pooled
+        items of a hex (see create_hex_items) are shown, hidden or recoloured, and only for the parts of which the state
+        differs from what is drawn. Normally this runs from the frame scheduled by request_frame; calling it directly
+        (e.g. before a popup blocks the board) draws the frame right away. Returns the number of changed hexes.'''
+        if self.frame_pending is not None:
+            self.master.after_cancel(self.frame_pending)
+            self.frame_pending = None
+        start = time.perf_counter()
+        if self.view_dirty:
+            self.update_view()
+        redrawn = 0
+        configure = self.board.itemconfigure
+        for index in self.dirty:
+            piece, highlight, options = state = (self.piece_state[index], self.highlight_state[index], self.option_state[index])
+            drawn_piece, drawn_highlight, drawn_options = self.drawn_state[index]
+            if state == self.drawn_state[index] or index not in self.in_view:
+                continue        # Hexes out of view are drawn when they come into view
+            if not self.hex_items[index]:
+                self.use_hex_items(index)
+            items = self.hex_items[index]
+
+            if highlight != drawn_highlight:
+                if highlight:
+                    configure(items['highlight'], outline=highlight, state='normal')
+                else:
+                    configure(items['highlight'], state='hidden')
+
+            if piece != drawn_piece:
+                if drawn_piece and (not piece or piece[0] != drawn_piece[0]):
+                    configure(items[drawn_piece[0]], state='hidden')
+                if piece:
+                    shape, color, highlighted = piece
+                    if highlighted:
+                        configure(items[shape], fill=color, outline='pink', width=5, state='normal')
+                    else:
+                        configure(items[shape], fill=color, outline='black', width=1, state='normal')
+
+            if options != drawn_options:
+                if ('dig' in options) != ('dig' in drawn_options):
+                    dig_state = 'normal' if 'dig' in options else 'hidden'
+                    configure(items['dig'], state=dig_state)
+                    configure(items['dig_text'], state=dig_state)
+                # A hex shows at most one arrow, the last one added
+                arrow = ([None] + [x for x in options if x != 'dig'])[-1]
+                drawn_arrow = ([None] + [x for x in drawn_options if x != 'dig'])[-1]
+                if arrow != drawn_arrow:
+                    if arrow:
+                        self.board.coords(items['arrow'], *self.arrow_coords(index, arrow == 'board'))
+                        configure(items['arrow'], fill='red' if arrow == 'steal' else 'white', state='normal')
+                    else:
+                        configure(items['arrow'], state='hidden')
+
+            self.drawn_state[index] = state
+            redrawn += 1
+        self.dirty = set()
+
+        ''' Frame statistics '''
+        self.last_frame = time.perf_counter()
+        seconds = self.last_frame - start
+        stats = self.frame_stats
+        stats['frames'] += 1
+        stats['requests'] += self.frame_requests
+        stats['hexes'] += redrawn
+        stats['seconds'] += seconds
+        stats['max_seconds'] = max(stats['max_seconds'], seconds)
+        if self.print_frames:
+            self.log('Frame ' + str(stats['frames']) + ': ' + str(self.frame_requests) + ' state changes, ' +
+                     str(redrawn) + ' hexes redrawn in ' + str(round(seconds * 1000, 2)) + ' ms')
+        self.frame_requests = 0
+        return redrawn
+
+    def release_hex_items(self, index):
+        ''' Hides the pool of items of hex index and keeps it for reuse by another hex.'''
+        items = self.hex_items[index]
+        self.board.itemconfigure(items['tag'], state='hidden')
+        self.free_items.append(items)
+        self.hex_items[index] = None
+        self.drawn_state[index] = (None, None, ())
 
     def remove_object(self,index):
         ''' Removes the object marker at hex index '''
-        self.board.delete(self.objects_shape[index])
-        self.board.delete(self.objects_text[index])
-        self.objects_shape[index] = [None]
-        self.objects_text[index] = [None]
+        self.set_state(self.piece_state, index, None)
 
     def remove_selected_items(self):
-        ''' Removes all highlighted hexes '''
-        for i in self.sel_items:
-            self.board.delete(i)
-        self.sel_items = []
-
-    def show_assignment(self, index, target_canvas, assignment, vars):
-        '''Creates a description of the assignment card object in the target_canvas'''
-        tkinter.Label(target_canvas, text = 'Assignment').grid(row=0, column=1, sticky='W')
-        t = tkinter.Text(target_canvas,width = 30)
-        t.config(wrap=tkinter.WORD)
-        t.grid(row=1,rowspan=4, column= 2, sticky='W')
-        t.insert('end', assignment.name + ': ')
-        t.insert('end', assignment.description + '\n')
-        t.insert('end', 'Stage one description: ' + assignment.tier1_desc + ' After you finish stage one you can gain points from stage 2.' + '\n')
-        if assignment.tier1_fulfilled == '0':
-            t.insert('end', 'Required resources for stage one: ' "\n")
-            for resource in iter(['tier1_req_metal', 'tier1_req_fuel', 'tier1_req_earth','tier1_req_stone', 'tier1_req_wood']):
-                if getattr(assignment,str(resource)) != '0':
-                    t.insert('end', resource[10:] + ': ' + getattr(assignment,resource) + '\n') # Print the required amount of the resource
-            t.insert('end',' Select resources and press fulfill \n')
-        else:
-            t.insert('end', 'Stage 1 fulfilled: ' "\n")
-
-        self.b1 = tkinter.Button(t, text='Fulfill',state='disabled', command=lambda: self.game.fulfill_tier1(index, self.res_vars, assignment, target_canvas))
-        t.window_create('end', window=self.b1)
-
-        ''' Assignment stage 2 '''
-        t.insert('end', '\n Stage two description: ' + assignment.tier2_desc + "\n")
-        if assignment.tier1_fulfilled == '0':
-            t.insert('end', 'First complete stage 1')
-
-        self.b2 = tkinter.Button(t, text='Fulfill',state='disabled', command=lambda: self.game.fulfill_tier2(index, self.res_vars, assignment, target_canvas))
-        t.window_create('end', window=self.b2)
-        t.insert('end', "\n" 'Collected:' "\n") # Show the specials which are already added to the assignment
-        for i in range(0,assignment.tier2_stack.get_size()):
-            t.insert('end', assignment.tier2_stack.stack[i].name + '\n')
-
-        #return b1, b2 # The handle to the button can be used to activate/deactive it based on the selected resources.
-
-    def show_resource_choices(self,index,target_canvas,assignment):
-        ''' Displays a row of buttons for each resource in a home town. To be used for fulfilling assigments.'''
-
-        ''' Give a title and make a new panel in the popup.'''
-        tkinter.Label(target_canvas, text = 'Choose resources for assignment').grid(row=0, column=2, sticky='W')
-        t = tkinter.Text(target_canvas,width = 30)
-        t.config(wrap=tkinter.WORD)
-        t.grid(row=1, column= 3, sticky='W')
-
-        ''' Loop over all resources in the home town and all resource types to create the appropriate buttons.'''
-        res_labels = ['earth','wood','stone','metal','fuel']
-        self.res_vars = []  # Variable for the button presses (has to be persistent).
-        for i in range(0,self.grid.objects[index].resources.get_size()):
-            self.res_vars.append(tkinter.StringVar())   # Create a new variable for the resource.
-            self.res_vars[i].set('none')                # Set the default value to don't use resource.
-
-            ''' Create the button for not using the resource. This is the default value.'''
-            tkinter.Radiobutton(t, text="Don't use " + self.grid.objects[index].resources.stack[i].name, indicatoron = 0, variable = self.res_vars[i], command=lambda i=i: self.game.check_assignment(index, self.res_vars,assignment), value = 'none' ).grid(row=i, column=0, stick = 'W')# 0: only use basic moves, don't use fuel
-
-            ''' Loop over the five resource types and create a button if it has a value larger than 0 for this resource. '''
-            for j,k in zip(res_labels,range(0,5)):
-                if int(getattr(self.grid.objects[index].resources.stack[i],j)) > 0:
-                    tkinter.Radiobutton(t, text= getattr(self.grid.objects[index].resources.stack[i], j) + ' ' + j, indicatoron = 0, variable = self.res_vars[i], command=lambda i=i: self.game.check_assignment(index, self.res_vars,assignment), value = j ).grid(row=i, column=k+1, stick = 'W')# 0: only use basic moves, don't use fuel
-
-            ''' Add a final button for the collectible.'''
-            if getattr(self.grid.objects[index].resources.stack[i],'collect') != 'none':
-                tkinter.Radiobutton(t, text=self.grid.objects[index].resources.stack[i].collect, indicatoron=0, variable=self.res_vars[i],command=lambda i=i: self.game.check_assignment(index, self.res_vars, assignment), value='collect').grid(row=i, column=6,stick='W')  # 0: only use basic moves, don't use fuel
-
+        ''' Removes all highlighted hexes and option icons '''
+        for i in self.selected_hexes:
+            self.set_state(self.highlight_state, i, None)
+            self.set_state(self.option_state, i, ())
+        self.selected_hexes = set()
+
+    def request_frame(self):
+        ''' Schedules a frame with master.after unless one is scheduled already, so a burst of state changes is drawn
+        once. Frames are at least frame_interval apart (the fps setting).'''
+        self.frame_requests += 1
+        if self.frame_pending is None:
+            delay = self.last_frame + self.frame_interval - time.perf_counter()
+            self.frame_pending = self.master.after(max(int(delay * 1000), 0), self.redraw)
+
+    def scrolled(self, scrollbar, first, last):
+        ''' Called by the canvas whenever the view moves, by the scrollbars or by dragging. Updates the scrollbar and
+        schedules a frame in which the items are moved along with the view.'''
+        scrollbar.set(first, last)
+        self.view_moved()
+
+    def set_state(self, states, index, value):
+        ''' Sets the state of hex index in one of the state lists and marks the hex as dirty if it changed.'''
+        if states[index] != value:
+            states[index] = value
+            self.dirty.add(index)
+            self.request_frame()
 
     def steal_resource(self, source_index, destination_index, resource_index):
-        ''' Translates the list checkboxes into an index list relating to the resource stack in the source object.
-        The list and objects are then passed to game.shift_resources to move the selected resources from source to destination.'''
-        pirate = self.grid.objects[destination_index]
-        victim = self.grid.objects[source_index]
-        pirate.steal_resource_from_boat(victim, resource_index.get())
-        self.popup.destroy()
-
-    def show_inactive_hex(self,index):
-        '''Draws an an unactivated hex on the board '''
-        self.draw_hex(index, 'grey', 2, self.tile_color[index])
-
-    def show_boat_options(self, index):
-        ''' Shows the options for a selected boat'''
-
-        ''' Show the tiles on a which an occupying pawn, if present, can disembark.'''
-        if self.grid.objects[index].occupying_pawn and self.grid.objects[index].moves > 0:
-            ''' Find all unoccupied land tiles within moveable distance of the pawn on the boat.'''
-            reachable_land = self.grid.get_reachable_land(index)
-            ''' Draw a down arrow on all reachable hexes for the pawn'''
-            for i in reachable_land:
-                x_pix = self.x_pix[i]
-                y_pix = self.y_pix[i]
-                self.sel_items.append(self.board.create_polygon(x_pix + 0.15*self.hex_size, y_pix+0.3*self.hex_size,
-                                x_pix - 0.15*self.hex_size, y_pix+0.3*self.hex_size,
-                                x_pix - 0.15*self.hex_size, y_pix,
-                                x_pix - 0.25 * self.hex_size, y_pix,
-                                x_pix, y_pix - 0.2 * self.hex_size,
-                                x_pix + 0.25 * self.hex_size, y_pix,
-                                x_pix + 0.15*self.hex_size, y_pix,
-                                outline = 'black', fill='white'))
-
-        ''' Show enemy ships which can be boarded and which have something to loot'''
-        if self.grid.objects[index].moves == 0 and self.grid.objects[index].can_steal: # Boat already moved and hasn't stolen in this turn
-            reachable_sea = self.grid.get_connections([index],'water_conn',1) # Get all sea hexes one removed. Boat can only steal from neighbouring hexes
-            for i in reachable_sea:
-                if self.grid.objects[i]: # First see if there is an object there at all
-                    if 'boat' in self.grid.objects[i].label and self.game.current_player not in self.grid.objects[i].owner: # Identify enemy ships
-                        if getattr(self.game,self.grid.objects[i]).resources.get_size() > 0:         # Check if there's anything to steal
-                            x_pix = self.x_pix[i]
-                            y_pix = self.y_pix[i]
-                            self.sel_items.append(
-                                self.board.create_polygon(x_pix + 0.15 * self.hex_size, y_pix + 0.3 * self.hex_size,
-                                                  x_pix - 0.15 * self.hex_size, y_pix + 0.3 * self.hex_size,
-                                                  x_pix - 0.15 * self.hex_size, y_pix,
-                                                  x_pix - 0.25 * self.hex_size, y_pix,
-                                                  x_pix, y_pix - 0.2 * self.hex_size,
-                                                  x_pix + 0.25 * self.hex_size, y_pix,
-                                                  x_pix + 0.15 * self.hex_size, y_pix,
-                                                  outline='black', fill='red'))
-
-    def show_pawn_options(self,index):
-        '''Display the dig and move options in the hex'''
-        # Only show options if pawn has at least 1 move left and if the resource stack for the occupied landscape type still has cards
-        if self.grid.objects[index].moves > 0 and self.grid.get_landscape_stack_size_by_index(index) > 0:
-            x_pix = self.x_pix[index]
-            y_pix = self.y_pix[index]
-
-            '''Draw the dig option. Add the reference to the dig object to the sel_items list.'''
-            self.sel_items.append(self.board.create_polygon(x_pix - 0.3*self.hex_size, y_pix,
-                                 x_pix + 0.3*self.hex_size, y_pix,
-                                 x_pix + 0.3*self.hex_size, y_pix-0.3*self.hex_size,
-                                 x_pix - 0.3*self.hex_size, y_pix-0.3*self.hex_size,
-                                 outline = 'black', fill='white'))
-            self.sel_items.append(self.board.create_text(x_pix-0.1*self.hex_size,y_pix-0.12*self.hex_size,text='Dig'))
-
-            ''' Draw the boarding option '''
-            ''' First, we need to determine if a ship owned by the player is located 1. next to land, 2. within walkable reach and 3. unoccupied.'''
-            boats = self.grid.get_reachable_boats(index)
-            '''Draw an arrow on the reachable boats'''
-            for i in boats:
-                x_pix = self.x_pix[i]
-                y_pix = self.y_pix[i]
-                self.sel_items.append(self.board.create_polygon(x_pix + 0.15*self.hex_size, y_pix-0.3*self.hex_size,
-                                x_pix - 0.15*self.hex_size, y_pix-0.3*self.hex_size,
-                                x_pix - 0.15*self.hex_size, y_pix,
-                                x_pix - 0.25 * self.hex_size, y_pix,
-                                x_pix, y_pix + 0.2 * self.hex_size,
-                                x_pix + 0.25 * self.hex_size, y_pix,
-                                x_pix + 0.15*self.hex_size, y_pix,
-                                outline = 'black', fill='white'))
+        ''' Lets the boat on destination_index steal the resource chosen in the enemy popup from the boat on
+        source_index and closes the popup.'''
+        self.grid.steal_resource(source_index, destination_index, resource_index)
+        self.close_popup()
+
+    def show_game(self, grid, game):
+        ''' Shows another game on the same board instead of the current one, e.g. one restored from a saved state.'''
+        self.close_popup()
+        self.grid.events.unsubscribe(self.handle_event)
+        self.grid = grid
+        self.game = game
+        grid.visualiser = game.visualiser = self
+        grid.events.subscribe(self.handle_event)
+        self.time_reachability(grid)
+        self.show_pieces()
+        self.game.update_points()
+        self.game.update_card_counts()
+
+    def show_pieces(self):
+        ''' Sets the state of every hex from the grid as it is, including the selected piece and where it can go.'''
+        self.remove_selected_items()
+        for index, obj in enumerate(self.grid.objects):
+            if obj:
+                self.draw_object(index, obj)
+            else:
+                self.remove_object(index)
+        if self.grid.selected != []:
+            for index in self.grid.select_reachable:
+                self.highlight_hex(int(index), 'reachable')
+            self.highlight_hex(self.grid.selected, 'selected')
+
+    def show_hud(self, record):
+        ''' Shows the timings of a click in the latency overlay, together with the rolling percentiles.'''
+        def ms(key):
+            return str(round(record.get(key, 0.0) * 1000, 1)).rjust(6) + ' ms'
+        self.hud.config(text='click hex ' + str(record.get('hex')) + ':' + ms('total') + '\n' +
+                             '  pick       ' + ms('pick') + '\n' +
+                             '  logic      ' + ms('logic') + '\n' +
+                             '  reachable  ' + ms('reachability') + ' (' + str(record.get('reachability_calls', 0)) + ' queries)\n' +
+                             '  draw       ' + ms('draw') + '\n' +
+                             '  flush      ' + ms('flush') + '\n' +
+                             self.latency_report().replace(' over', '\nover') + '\n' +
+                             str(record.get('canvas_items')) + ' canvas items')
+
+    def time_reachability(self, grid):
+        ''' Times the reachability queries of grid as a section of the click in progress, so they show up separately
+        in the latency overlay. Only the grid shown here is wrapped, the grid classes themselves are not timed.'''
+        grid.get_connections = interactions.timed('reachability')(grid.get_connections)
+
+    def toggle_hud(self):
+        ''' Shows or hides the latency overlay in the top left corner of the board. Clicks are recorded from the moment
+        it is first shown.'''
+        self.hud_visible = not self.hud_visible
+        if self.hud_visible:
+            interactions.enabled = True
+            self.hud.config(text='Click the board to measure')
+            self.hud.place(x=4, y=4)
+        else:
+            self.hud.place_forget()
 
     def update_card_counts(self, sand, forest, meadow, rock, swamp):
         ''' Updates the visualisations of the card counts for the five landscape types.'''
@@ -579,15 +697,104 @@ class MainTK:
                     self.score_field.tag_add('current', '1.' + str(start), '1.' + str(start + len(player) + 1))
             self.score_field.config(state = 'disabled')         # Disable editing of text
 
-    def visualise_grid(self,show_index):
+    def update_tiles(self):
+        ''' Shows the terrain image tiles which cover the view and removes the others. Tiles are rendered by Boardimage
+        and cached on disk per zoom; the most recently used tile images are also kept in memory.'''
+        tile_size = 256
+        zoom = self.view.zoom
+        needed = self.view.visible_tiles(tile_size)
+        wanted = set()
+        for left, top, width, height in needed:
+            wanted.add((left, top))
+            if (left, top) in self.tiles_shown:
+                continue
+            key = (zoom, left, top)
+            image = self.tile_images.pop(key, None)
+            if image is None:
+                file_name = Boardimage.terrain_tile(self.terrain_cache, self.map_key, self.x_pix, self.y_pix,
+                                                    self.grid.size_x, self.hex_size, self.tile_rgb, zoom, left, top,
+                                                    width, height, self.print_index)
+                image = tkinter.PhotoImage(file=file_name)
+            self.tile_images[key] = image       # Most recently used at the end
+            item = self.board.create_image(left, top, anchor='nw', image=image, tags='terrain')
+            self.board.tag_lower(item)
+            self.tiles_shown[(left, top)] = item
+        for position in list(self.tiles_shown):
+            if position not in wanted:
+                self.board.delete(self.tiles_shown.pop(position))
+        while len(self.tile_images) > max(4 * len(needed), 16):
+            self.tile_images.popitem(last=False)
+
+    def update_view(self):
+        ''' Makes the canvas items follow the view. Hexes that went out of view give their pool of items back, hexes
+        that came into view get one if there is anything to show on them. After a zoom all pools are placed again.'''
+        self.view_dirty = False
+        if self.view_zoomed:
+            for index in self.in_view:
+                if self.hex_items[index]:
+                    self.release_hex_items(index)
+            self.in_view = set()
+            for item in self.tiles_shown.values():
+                self.board.delete(item)
+            self.tiles_shown = {}
+            self.view_zoomed = False
+
+        visible = set(self.view.visible_hexes().tolist())
+        for index in self.in_view - visible:
+            if self.hex_items[index]:
+                self.release_hex_items(index)
+        for index in visible - self.in_view:
+            if self.terrain_cache == 'no':
+                self.use_hex_items(index)
+            if self.piece_state[index] or self.highlight_state[index] or self.option_state[index]:
+                self.dirty.add(index)
+        self.in_view = visible
+        if self.terrain_cache != 'no':
+            self.update_tiles()
+
+    def use_hex_items(self, index):
+        ''' Gives hex index a pool of items, reusing one of a hex that went out of view if there is one.'''
+        items = self.free_items.pop() if self.free_items else self.create_hex_items()
+        self.place_hex_items(items, index)
+        self.hex_items[index] = items
+        self.drawn_state[index] = (None, None, ())
+
+    def view_moved(self):
+        ''' Takes over the position of the canvas view and schedules a frame to update the items in view.'''
+        self.view.left = self.board.canvasx(0)
+        self.view.top = self.board.canvasy(0)
+        self.view_dirty = True
+        self.request_frame()
+
+    def visualise_grid(self,show_index,terrain_image='no'):
         ''' Draws the playing board. If show_index is set to "yes", the hex numbers are printed.'''
-        if show_index == 'yes':
-            print_index = True
-        else:
-            print_index = False
-
-        for i in range(0,self.grid.n_hexes):
-            self.show_inactive_hex(i)
-            if print_index:
-                self.board.create_text(self.x_pix[i],self.y_pix[i],text=str(i))
-
+        ''' The terrain never changes during a game. Unless terrain_image is "no", it is rendered into image tiles
+        which are cached in the terrain_image directory (see Boardimage) and shown as a few canvas items, so Tk doesn't
+        have to keep hundreds of polygons around. Otherwise each hex in view gets a terrain polygon. Pieces and
+        highlights are drawn on top as separate items. Only the part of the board in view is drawn, in one pass, and
+        the canvas is flushed once at the end.'''
+        self.print_index = show_index == 'yes'
+        self.terrain_cache = terrain_image
+        if terrain_image != 'no':
+            # Tk color names to RGB, winfo_rgb returns 16 bit values
+            rgb = {color: [x // 256 for x in self.master.winfo_rgb(color)] for color in set(self.tile_color)}
+            self.tile_rgb = [rgb[color] for color in self.tile_color]
+            self.map_key = Boardimage.map_key(self.grid.tiles, self.tile_rgb, self.grid.size_x, self.hex_size,
+                                              self.print_index)
+        with startup.phase('draw view'):
+            self.update_view()
+        with startup.phase('flush board'):
+            self.board.update_idletasks()
+
+    def zoom(self, step, screen_x, screen_y):
+        ''' Zooms in (step 1) or out (step -1) around the mouse position.'''
+        self.view.left = self.board.canvasx(0)
+        self.view.top = self.board.canvasy(0)
+        if not self.view.zoom_at(step, screen_x, screen_y):
+            return
+        board_width, board_height = self.view.board_size()
+        self.board.configure(scrollregion=(0, 0, board_width, board_height))
+        self.board.xview_moveto(self.view.left / board_width)
+        self.board.yview_moveto(self.view.top / board_height)
+        self.view_zoomed = True
+        self.view_moved()
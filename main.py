@@ -1,2 +1,4 @@
-from Start_menu_tkinter import *
+import Timing
+with Timing.startup.phase('import Start_menu_tkinter'):
+    from Start_menu_tkinter import *
 menu = Start_menu()
\ No newline at end of file